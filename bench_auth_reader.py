@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Benchmark the credential lookup in CursorAuthReader on a synthetic state.vscdb.
+
+Long-lived installs keep gigabytes of composer blobs in cursorDiskKV next to
+the few cursorAuth/ keys. The database built here has the same layout: the
+auth keys in ItemTable and --gb of composerData:* blobs in cursorDiskKV. The
+"full scan" row replays the old lookup (every row of both tables, filtered
+in Python); the others go through the reader's key index.
+
+Usage: bench_auth_reader.py [--gb 1] [--blob-kb 512] [--db PATH]
+"""
+
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from cursor_auth_reader import CursorAuthReader
+
+AUTH_KEYS = {
+    'cursorAuth/accessToken': 'token-' + 'a' * 400,
+    'cursorAuth/refreshToken': 'token-' + 'r' * 400,
+    'cursorAuth/cachedEmail': 'user@example.com',
+    'cursorAuth/stripeMembershipType': 'pro',
+    'storage.serviceMachineId': 'f' * 64,
+}
+
+
+def build_database(path: Path, gb: float, blob_kb: int):
+    """state.vscdb with the auth keys and gb of composer blobs"""
+    conn = sqlite3.connect(str(path))
+    for table in CursorAuthReader.TABLES:
+        conn.execute(f"CREATE TABLE {table} (key TEXT UNIQUE ON CONFLICT REPLACE, value BLOB)")
+    conn.executemany("INSERT INTO ItemTable VALUES (?, ?)", AUTH_KEYS.items())
+    blob = b'{"conversation": "' + b'x' * (blob_kb * 1024) + b'"}'
+    count = int(gb * 1024 * 1024 // blob_kb)
+    conn.executemany(
+        "INSERT INTO cursorDiskKV VALUES (?, ?)",
+        ((f"composerData:{i:08d}", blob) for i in range(count)),
+    )
+    conn.commit()
+    conn.close()
+
+
+def full_scan(path: Path) -> dict:
+    """The old read_sqlite_storage: read both tables, keep cursorAuth/ keys"""
+    conn = sqlite3.connect(str(path))
+    data = {}
+    for table in CursorAuthReader.TABLES:
+        cursor = conn.execute(f"SELECT key, value FROM {table}")
+        for key, value in cursor.fetchall():
+            if key and isinstance(key, str) and key.startswith('cursorAuth/'):
+                data[key] = value
+    conn.close()
+    return data
+
+
+def timed(func, repeat: int = 3) -> float:
+    """Best wall time in milliseconds"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    args = sys.argv[1:]
+    gb = 1.0
+    blob_kb = 512
+    db = None
+
+    i = 0
+    while i < len(args):
+        if args[i] == '--gb' and i + 1 < len(args):
+            gb = float(args[i + 1])
+            i += 2
+        elif args[i] == '--blob-kb' and i + 1 < len(args):
+            blob_kb = int(args[i + 1])
+            i += 2
+        elif args[i] == '--db' and i + 1 < len(args):
+            db = Path(args[i + 1])
+            i += 2
+        else:
+            i += 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = db or Path(tmp) / 'state.vscdb'
+        if not path.exists():
+            print(f"Building {gb:g} GB synthetic {path.name}...")
+            build_database(path, gb, blob_kb)
+        size = path.stat().st_size / (1024 ** 3)
+
+        # Point a reader at the synthetic database instead of Cursor's
+        reader = CursorAuthReader.__new__(CursorAuthReader)
+        reader.cursor_data_path = path.parent
+        reader.storage_path = path
+        assert reader.read_sqlite_storage().keys() == full_scan(path).keys()
+
+        print(f"{'lookup':>22} {'ms':>10}   ({size:.2f} GB database)")
+        cases = (
+            ("full scan (old)", lambda: full_scan(path)),
+            ("cursorAuth/ prefix", reader.read_sqlite_storage),
+            ("IN (token keys)", lambda: reader.read_sqlite_keys(['cursorAuth/accessToken'])),
+        )
+        for label, func in cases:
+            print(f"{label:>22} {timed(func):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
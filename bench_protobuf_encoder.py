@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Benchmark request encoding against plain bytes concatenation.
+
+Encodes a long agent conversation and a large read_file tool result, the two
+payloads where re-copying an immutable bytes object on every appended field
+used to dominate. The "encoder" column times the compiled cursor_schema
+codecs (the client encoder for the tool result); the "concat" column
+replays the same field layout with the old
+`msg += ProtobufEncoder.encode_field(...)` pattern. Both columns build the
+same bytes: the messages / message_ids section of the agent request, and the
+whole read_file result request.
+
+A second table gives encode and decode throughput of the whole agent request
+and the read_file result request for each cursor_schema backend: the
+compiled Python codecs and the generated protobuf classes (upb runtime).
+The turn table times one more user turn on a long history, re-encoding a
+plain message list against an AgentConversation that reuses the encoded
+history; only the user half of the alternating history is sent (see
+AgentConversation). The skeleton table times a short request built from the
+client's MessageTemplate against encoding every field each time. A last table breaks the agent request down into bytes
+per StreamUnifiedChatRequest field.
+
+Usage: bench_protobuf_encoder.py [--messages 500] [--result-mb 5]
+"""
+
+import sys
+import time
+
+import cursor_schema
+from cursor_agent_client import AgentConversation, CursorAgentClient, ClientSideToolV2, ToolResult
+from cursor_chat_proto import ProtobufEncoder, ProtobufWriter
+
+
+def make_conversation(count: int) -> list:
+    """Alternating user/assistant turns with a few hundred bytes each"""
+    return [
+        {'role': 'user' if i % 2 == 0 else 'assistant',
+         'content': f"turn {i}: " + "lorem ipsum dolor sit amet " * 12}
+        for i in range(count)
+    ]
+
+
+def concat_conversation(messages: list) -> bytes:
+    """Messages section of encode_agent_request built by bytes concatenation"""
+    msg = b''
+    for i, user_msg in enumerate(messages):
+        message = b''
+        message += ProtobufEncoder.encode_field(1, 2, user_msg['content'])
+        message += ProtobufEncoder.encode_field(2, 0, 1)
+        message += ProtobufEncoder.encode_field(13, 2, f"id-{i}")
+        message += ProtobufEncoder.encode_field(47, 0, 2)
+        msg += ProtobufEncoder.encode_field(1, 2, message)
+    for i in range(len(messages)):
+        message_id = b''
+        message_id += ProtobufEncoder.encode_field(1, 2, f"id-{i}")
+        message_id += ProtobufEncoder.encode_field(3, 0, 1)
+        msg += ProtobufEncoder.encode_field(30, 2, message_id)
+    return msg
+
+
+def encode_conversation(messages: list) -> bytes:
+    """concat_conversation()'s section from the cursor_schema codecs, as
+    AgentConversation builds it"""
+    fields = ProtobufWriter()
+    for i, message in enumerate(messages):
+        fields.write_bytes_field(1, cursor_schema.encode('ConversationMessage', {
+            'content': message['content'], 'role': 1, 'message_id': f"id-{i}", 'chat_mode_enum': 2,
+        }))
+    for i in range(len(messages)):
+        fields.write_bytes_field(30, cursor_schema.encode('MessageId', {'message_id': f"id-{i}", 'role': 1}))
+    return fields.getvalue()
+
+
+def concat_read_file(tool_call_id: str, data: dict) -> bytes:
+    """ClientSideToolV2Result for read_file built by bytes concatenation"""
+    result = b''
+    result += ProtobufEncoder.encode_field(1, 2, data['contents'])
+    result += ProtobufEncoder.encode_field(9, 2, data['relative_workspace_path'])
+    result += ProtobufEncoder.encode_field(12, 0, data['total_lines'])
+    msg = b''
+    msg += ProtobufEncoder.encode_field(1, 0, ClientSideToolV2.READ_FILE)
+    msg += ProtobufEncoder.encode_field(35, 2, tool_call_id)
+    msg += ProtobufEncoder.encode_field(6, 2, result)
+    return ProtobufEncoder.encode_field(2, 2, msg)
+
+
+def best_of(func, repeat: int = 5) -> float:
+    """Best wall time in milliseconds over a few runs"""
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    args = sys.argv[1:]
+    message_count = 500
+    result_mb = 5.0
+
+    i = 0
+    while i < len(args):
+        if args[i] == '--messages' and i + 1 < len(args):
+            message_count = int(args[i + 1])
+            i += 2
+        elif args[i] == '--result-mb' and i + 1 < len(args):
+            result_mb = float(args[i + 1])
+            i += 2
+        else:
+            i += 1
+
+    # Encoding needs no credentials, so skip the auth lookup in __init__
+    client = CursorAgentClient.__new__(CursorAgentClient)
+
+    messages = make_conversation(message_count)
+    conversation = [m for m in messages if m['role'] == 'user']
+    line = "x = compute(value)  # some representative source line\n"
+    data = {
+        'contents': line * int(result_mb * 1024 * 1024 // len(line)),
+        'relative_workspace_path': 'src/module.py',
+        'total_lines': int(result_mb * 1024 * 1024 // len(line)),
+    }
+    result = ToolResult(True, data)
+
+    print(f"{'payload':>22} {'KB':>8} {'encoder (ms)':>13} {'concat (ms)':>12}")
+    cases = (
+        (f"{message_count}-message history",
+         lambda: encode_conversation(conversation),
+         lambda: concat_conversation(conversation)),
+        (f"{result_mb:g} MB read_file result",
+         lambda: client.encode_tool_result_request(ClientSideToolV2.READ_FILE, 'toolu_1', result),
+         lambda: concat_read_file('toolu_1', data)),
+    )
+    for label, encoder, concat in cases:
+        assert encoder() == concat(), label
+        size = len(encoder()) / 1024
+        print(f"{label:>22} {size:>8.0f} {best_of(encoder):>13.2f} {best_of(concat):>12.2f}")
+    
+    # The backends are timed on the same prepared field values, so the rows
+    # measure cursor_schema.encode() and decode() and not the client code
+    # (ids, timestamps) that builds the values
+    values = (
+        (f"{message_count}-message request", 'StreamUnifiedChatRequest', {
+            **client._request_template().static,
+            **client._agent_request_value(messages, "claude-4-sonnet"),
+        }),
+        (f"{result_mb:g} MB read_file result", 'StreamUnifiedChatRequestWithTools', {
+            'client_side_tool_v2_result': client._tool_result_value(ClientSideToolV2.READ_FILE, 'toolu_1', result),
+        }),
+    )
+    print()
+    print(f"{'payload':>22} {'backend':>8} {'encode MB/s':>12} {'decode MB/s':>12}")
+    for backend in cursor_schema.BACKENDS:
+        cursor_schema.set_backend(backend)
+        for label, message, value in values:
+            body = cursor_schema.encode(message, value)
+            mb = len(body) / (1024 * 1024)
+            encode_ms = best_of(lambda: cursor_schema.encode(message, value))
+            decode_ms = best_of(lambda: cursor_schema.decode(message, body))
+            print(f"{label:>22} {backend:>8} {mb / encode_ms * 1000:>12.1f} "
+                  f"{mb / decode_ms * 1000:>12.1f}")
+    cursor_schema.set_backend('python')
+    
+    print()
+    print(f"{'history':>22} {'list (ms)':>10} {'conversation (ms)':>18}")
+    for turns in (10, 100, 1000):
+        history = make_conversation(turns)
+        conversation = AgentConversation(history)
+        client.encode_agent_request(conversation, "claude-4-sonnet")
+        
+        def next_turn_list():
+            client.encode_agent_request(history + [history[0]], "claude-4-sonnet")
+        
+        def next_turn_conversation():
+            conversation.append(history[0])
+            client.encode_agent_request(conversation, "claude-4-sonnet")
+        
+        print(f"{f'{turns} messages':>22} {best_of(next_turn_list):>10.3f} "
+              f"{best_of(next_turn_conversation):>18.3f}")
+    
+    print()
+    print(f"{'request':>22} {'template (us)':>14} {'full encode (us)':>17}")
+    static = {}
+    for piece in client._request_template().pieces:
+        if piece.__class__ is bytes:
+            static.update(cursor_schema.decode('StreamUnifiedChatRequest', piece))
+    for turns in (1, 10):
+        history = make_conversation(turns)
+        
+        def full_encode():
+            value = client._agent_request_value(history, "claude-4-sonnet")
+            value['metadata'] = client._metadata_value()
+            cursor_schema.encode('StreamUnifiedChatRequest', {**static, **value})
+        
+        def template_build():
+            client.encode_agent_request(history, "claude-4-sonnet")
+        
+        print(f"{f'{turns} messages':>22} {best_of(template_build, 200) * 1000:>14.1f} "
+              f"{best_of(full_encode, 200) * 1000:>17.1f}")
+    
+    print()
+    sizes = client.request_size_report(messages, "claude-4-sonnet")
+    total = sum(sizes.values())
+    print(f"{'request section':>22} {'bytes':>8} {'share':>7}")
+    for name, size in sizes.items():
+        print(f"{name:>22} {size:>8} {size / total:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
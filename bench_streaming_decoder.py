@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+Benchmark CursorStreamDecoder.feed_data on large multi-frame captures.
+
+Replays a capture in a single burst (the worst case for buffer handling) at
+increasing sizes and reports throughput. With linear-time frame consumption
+the MB/s column should stay roughly flat as the capture grows.
+
+It then compares per-frame CPU time of the wire-level text-delta fast path
+against the full generated-class parse on the same stream, and the cost of
+path-targeted tool-call extraction against brute-force probing on frames
+that carry large text alongside a tool call.
+
+Usage: bench_streaming_decoder.py [capture.bin] [--size-mb 50]
+Without a capture file, a synthetic stream of text-delta frames is generated.
+"""
+
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'cursor-grpc'))
+
+from cursor_chat_proto import ToolCallDecoder
+from cursor_streaming_decoder import CursorStreamDecoder
+from server_full_pb2 import StreamUnifiedChatResponseWithTools
+
+
+def make_text_frame(text: str) -> bytes:
+    """Build one uncompressed protobuf frame carrying a text delta"""
+    response = StreamUnifiedChatResponseWithTools()
+    response.stream_unified_chat_response.text = text
+    payload = response.SerializeToString()
+    return struct.pack('>BI', 0, len(payload)) + payload
+
+
+def make_capture(size_bytes: int) -> bytes:
+    """Build a synthetic capture of roughly size_bytes, ending with an end-of-stream frame"""
+    frames = [make_text_frame(f"token {i} " * (1 + i % 16)) for i in range(64)]
+    block = b''.join(frames)
+    repeat = max(1, size_bytes // len(block))
+    return block * repeat + struct.pack('>BI', 2, 2) + b'{}'
+
+
+def make_tool_call_payload(text_size: int) -> bytes:
+    """Response payload holding a tool call next to text_size bytes of text"""
+    response = StreamUnifiedChatResponseWithTools()
+    call = response.client_side_tool_v2_call
+    call.tool = 5
+    call.tool_call_id = "toolu_bench"
+    call.name = "read_file"
+    call.raw_args = '{"relative_workspace_path": "src/main.py"}'
+    response.stream_unified_chat_response.text = "lorem ipsum " * (text_size // 12)
+    return response.SerializeToString()
+
+
+def count_frames(capture: bytes) -> int:
+    """Count the frames in a capture by walking the envelope headers"""
+    count = 0
+    offset = 0
+    while offset + 5 <= len(capture):
+        offset += 5 + struct.unpack_from('>I', capture, offset + 1)[0]
+        count += 1
+    return count
+
+
+def replay(capture: bytes, fast_text_path: bool = True) -> float:
+    """Feed the whole capture to a fresh decoder, return elapsed seconds"""
+    decoder = CursorStreamDecoder(fast_text_path=fast_text_path)
+    start = time.perf_counter()
+    decoder.feed_data(capture)
+    return time.perf_counter() - start
+
+
+def cpu_per_frame(capture: bytes, fast_text_path: bool) -> float:
+    """CPU microseconds per frame for one decoder configuration"""
+    decoder = CursorStreamDecoder(fast_text_path=fast_text_path)
+    start = time.process_time()
+    decoder.feed_data(capture)
+    return (time.process_time() - start) * 1e6 / count_frames(capture)
+
+
+def main():
+    args = sys.argv[1:]
+    size_mb = 50
+    capture = None
+
+    i = 0
+    while i < len(args):
+        if args[i] == '--size-mb' and i + 1 < len(args):
+            size_mb = float(args[i + 1])
+            i += 2
+        else:
+            with open(args[i], 'rb') as f:
+                capture = f.read()
+            i += 1
+
+    if capture is None:
+        capture = make_capture(int(size_mb * 1024 * 1024))
+
+    print(f"{'size (MB)':>10} {'time (s)':>10} {'MB/s':>10}")
+    for fraction in (0.125, 0.25, 0.5, 1.0):
+        sample = capture[:int(len(capture) * fraction)]
+        elapsed = replay(sample)
+        size = len(sample) / (1024 * 1024)
+        print(f"{size:>10.2f} {elapsed:>10.3f} {size / elapsed:>10.1f}")
+
+    print()
+    print(f"{'path':>10} {'us/frame':>10}")
+    sample = capture[:min(len(capture), 8 * 1024 * 1024)]
+    sample = sample[:sum_frame_bytes(sample)]
+    for label, fast in (('full', False), ('fast', True)):
+        print(f"{label:>10} {cpu_per_frame(sample, fast):>10.2f}")
+
+    print()
+    print(f"{'text (KB)':>10} {'path (ms)':>10} {'probe (ms)':>11}")
+    for text_kb in (1, 64, 1024):
+        payload = make_tool_call_payload(text_kb * 1024)
+        print(f"{text_kb:>10} {tool_call_time(payload, False):>10.3f} "
+              f"{tool_call_time(payload, True):>11.3f}")
+
+
+def tool_call_time(payload: bytes, probe: bool) -> float:
+    """Best wall time in milliseconds to extract the tool calls from payload"""
+    best = float('inf')
+    for _ in range(5):
+        start = time.perf_counter()
+        ToolCallDecoder.find_tool_calls(payload, probe=probe)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def sum_frame_bytes(capture: bytes) -> int:
+    """Length of the longest prefix of capture made of whole frames"""
+    offset = 0
+    while offset + 5 <= len(capture):
+        frame_end = offset + 5 + struct.unpack_from('>I', capture, offset + 1)[0]
+        if frame_end > len(capture):
+            break
+        offset = frame_end
+    return offset
+
+
+if __name__ == "__main__":
+    main()
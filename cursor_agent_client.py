@@ -33,17 +33,21 @@ import asyncio
 import httpx
 import uuid
 import hashlib
-import gzip
 import time
 import os
 import subprocess
+import sys
 import json
 from pathlib import Path
-from typing import Optional, Dict, Any, List, Tuple
+from typing import Optional, Dict, Any, Iterable, Iterator, List, Tuple
 from dataclasses import dataclass
 
-from cursor_auth_reader import CursorAuthReader
-from cursor_chat_proto import ProtobufEncoder
+from cursor_auth_reader import DEFAULT_CREDENTIALS
+from cursor_chat_proto import ProtobufWriter, ToolCallAssembler
+from cursor_compression import DEFAULT_POLICY
+from cursor_headers import CONFIG_VERSION, HeaderTemplate, cursor_checksum
+from cursor_schema import EncodedFields, MessageTemplate, encode, field_sizes
+from cursor_transport import DEFAULT_POOL, PooledClient
 
 
 # ClientSideToolV2 enum values (from TASK-110-tool-enum-mapping.md)
@@ -113,6 +117,23 @@ class ToolCall:
     name: str
     raw_args: str
     params: Dict[str, Any]
+    
+    @classmethod
+    def from_decoded(cls, tc: Dict, names: Dict[int, str]) -> 'ToolCall':
+        """From a ClientSideToolV2Call dict of ToolCallAssembler / ToolCallDecoder"""
+        params = {}
+        if tc['raw_args']:
+            try:
+                params = json.loads(tc['raw_args'])
+            except ValueError:
+                pass
+        return cls(
+            tool=tc['tool'],
+            tool_call_id=tc['tool_call_id'],
+            name=tc['name'] or names.get(tc['tool'], f"tool_{tc['tool']}"),
+            raw_args=tc['raw_args'],
+            params=params,
+        )
 
 
 @dataclass
@@ -123,6 +144,74 @@ class ToolResult:
     error: Optional[str] = None
 
 
+class AgentConversation:
+    """Agent-mode message history that encodes each message once
+    
+    run_agent_loop re-sends the whole history on every turn. Each message gets
+    its message id when it is appended, and the StreamUnifiedChatRequest
+    messages / message_ids fields of its user turns are encoded the first time
+    a request is built and kept joined in order. The request takes the joined
+    fields as is (cursor_schema.EncodedFields).
+    
+    Only user turns are sent, as with a plain message list: assistant and tool
+    turns stay in the history but ConversationMessage (TASK-7) has no fields
+    for tool calls or results, so they are skipped. The tool turns
+    run_agent_loop appends therefore leave the request unchanged; what is
+    saved is re-encoding the user turns and new message ids on every turn.
+    
+    Stands in for the list of message dicts (append, len, iteration); appended
+    messages must not be modified afterwards.
+    """
+    
+    # StreamUnifiedChatRequest.messages / .message_ids (TASK-7)
+    FIELD_MESSAGES = 1
+    FIELD_MESSAGE_IDS = 30
+    
+    def __init__(self, messages: Iterable[Dict] = (), chat_mode_enum: int = UnifiedMode.AGENT):
+        self.chat_mode_enum = chat_mode_enum
+        self.messages: List[Dict] = []
+        self.message_ids: List[str] = []
+        self._encoded = 0
+        self._message_fields = ProtobufWriter()
+        self._message_id_fields = ProtobufWriter()
+        for message in messages:
+            self.append(message)
+    
+    def __len__(self) -> int:
+        return len(self.messages)
+    
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self.messages)
+    
+    def append(self, message: Dict) -> str:
+        """Add a message and return its message id"""
+        msg_id = str(uuid.uuid4())
+        self.messages.append(message)
+        self.message_ids.append(msg_id)
+        return msg_id
+    
+    def encoded_fields(self) -> Tuple[EncodedFields, EncodedFields]:
+        """(messages, message_ids) request fields, encoding only new messages"""
+        for i in range(self._encoded, len(self.messages)):
+            message = self.messages[i]
+            if message['role'] != 'user':
+                continue  # Only user turns are sent, see the class docstring
+            msg_id = self.message_ids[i]
+            self._message_fields.write_bytes_field(self.FIELD_MESSAGES, encode('ConversationMessage', {
+                'content': message['content'],
+                'role': 1,  # user
+                'message_id': msg_id,
+                'chat_mode_enum': self.chat_mode_enum,
+            }))
+            self._message_id_fields.write_bytes_field(self.FIELD_MESSAGE_IDS, encode('MessageId', {
+                'message_id': msg_id,
+                'role': 1,
+            }))
+        self._encoded = len(self.messages)
+        return (EncodedFields(self._message_fields.buf),
+                EncodedFields(self._message_id_fields.buf))
+
+
 class ToolExecutor:
     """Executes tools locally and returns results"""
     
@@ -877,9 +966,107 @@ class CursorAgentClient:
         ClientSideToolV2.GLOB_FILE_SEARCH,
     ]
     
+    # Tool enum to name mapping (from TASK-110-tool-enum-mapping.md)
+    TOOL_NAMES = {
+        ClientSideToolV2.LIST_DIR: 'list_dir',
+        ClientSideToolV2.READ_FILE: 'read_file',
+        ClientSideToolV2.EDIT_FILE: 'edit_file',
+        ClientSideToolV2.DELETE_FILE: 'delete_file',
+        ClientSideToolV2.FILE_SEARCH: 'file_search',
+        ClientSideToolV2.GLOB_FILE_SEARCH: 'glob_file_search',
+        ClientSideToolV2.RIPGREP_SEARCH: 'grep_search',
+        ClientSideToolV2.SEMANTIC_SEARCH_FULL: 'codebase_search',
+        ClientSideToolV2.SEARCH_SYMBOLS: 'search_symbols',
+        ClientSideToolV2.DEEP_SEARCH: 'deep_search',
+        ClientSideToolV2.RUN_TERMINAL_COMMAND_V2: 'run_terminal_cmd',
+        ClientSideToolV2.WEB_SEARCH: 'web_search',
+        ClientSideToolV2.FETCH_RULES: 'fetch_rules',
+        ClientSideToolV2.FETCH_PULL_REQUEST: 'fetch_pull_request',
+        ClientSideToolV2.MCP: 'mcp',
+        ClientSideToolV2.CALL_MCP_TOOL: 'call_mcp_tool',
+        ClientSideToolV2.LIST_MCP_RESOURCES: 'list_mcp_resources',
+        ClientSideToolV2.READ_MCP_RESOURCE: 'read_mcp_resource',
+        ClientSideToolV2.TASK: 'task',
+        ClientSideToolV2.AWAIT_TASK: 'await_task',
+        ClientSideToolV2.TODO_READ: 'todo_read',
+        ClientSideToolV2.TODO_WRITE: 'todo_write',
+        ClientSideToolV2.CREATE_PLAN: 'create_plan',
+        ClientSideToolV2.REAPPLY: 'reapply',
+        ClientSideToolV2.GO_TO_DEFINITION: 'go_to_definition',
+        ClientSideToolV2.CREATE_DIAGRAM: 'create_diagram',
+        ClientSideToolV2.FIX_LINTS: 'fix_lints',
+        ClientSideToolV2.READ_LINTS: 'read_lints',
+        ClientSideToolV2.ASK_QUESTION: 'ask_question',
+        ClientSideToolV2.SWITCH_MODE: 'switch_mode',
+        ClientSideToolV2.GENERATE_IMAGE: 'generate_image',
+        ClientSideToolV2.COMPUTER_USE: 'computer_use',
+        ClientSideToolV2.LIST_DIR_V2: 'list_dir_v2',
+        ClientSideToolV2.READ_FILE_V2: 'read_file_v2',
+        ClientSideToolV2.EDIT_FILE_V2: 'edit_file_v2',
+    }
+    
+    # Tools that require params before execution (ToolCallAssembler needs_args)
+    TOOLS_NEEDING_PARAMS = frozenset({
+        ClientSideToolV2.FILE_SEARCH, ClientSideToolV2.RIPGREP_SEARCH,
+        ClientSideToolV2.READ_FILE, ClientSideToolV2.EDIT_FILE,
+        ClientSideToolV2.LIST_DIR, ClientSideToolV2.LIST_DIR_V2,
+        ClientSideToolV2.READ_FILE_V2, ClientSideToolV2.EDIT_FILE_V2,
+        ClientSideToolV2.RUN_TERMINAL_COMMAND_V2, ClientSideToolV2.GLOB_FILE_SEARCH,
+        ClientSideToolV2.WEB_SEARCH, ClientSideToolV2.SEMANTIC_SEARCH_FULL,
+        ClientSideToolV2.DEEP_SEARCH, ClientSideToolV2.SEARCH_SYMBOLS,
+        ClientSideToolV2.DELETE_FILE, ClientSideToolV2.TODO_WRITE,
+        ClientSideToolV2.CREATE_PLAN, ClientSideToolV2.CALL_MCP_TOOL,
+    })
+    
+    # Decides which request bodies and frames are gzipped (cursor_compression.py)
+    compression = DEFAULT_POLICY
+    
+    # Token and machine id, shared per process and re-read when state.vscdb
+    # changes (cursor_auth_reader.py)
+    credentials = DEFAULT_CREDENTIALS
+    
+    # Warm HTTP connections shared by all clients (cursor_transport.py)
+    transport = DEFAULT_POOL
+    
+    # Fields that change on every request; the rest of StreamUnifiedChatRequest
+    # is encoded once per supported_tools list (see _request_template)
+    REQUEST_FIELDS = ('messages', 'model', 'conversation_id', 'metadata', 'message_ids')
+    METADATA_TEMPLATE = MessageTemplate('Metadata', dynamic=('timestamp',))
+    _request_templates: Dict[Tuple[int, ...], MessageTemplate] = {}
+    
+    # Request headers; {uuid} is new per request (cursor_headers.py)
+    HEADERS = HeaderTemplate({
+        'authorization': 'Bearer {auth_token}',
+        'connect-accept-encoding': 'gzip',
+        'connect-protocol-version': '1',
+        'content-type': 'application/connect+proto',
+        'user-agent': 'connect-es/1.6.1',
+        'x-amzn-trace-id': 'Root={uuid}',
+        'x-client-key': '{client_key}',
+        'x-cursor-checksum': '{cursor_checksum}',
+        'x-cursor-client-version': '2.3.41',
+        'x-cursor-client-type': 'ide',
+        'x-cursor-client-os': 'linux',
+        'x-cursor-client-arch': 'x64',
+        'x-cursor-client-device-type': 'desktop',
+        'x-cursor-config-version': CONFIG_VERSION,
+        'x-cursor-timezone': 'Europe/Copenhagen',
+        'x-ghost-mode': 'true',
+        'x-request-id': '{uuid}',
+        'x-session-id': '{session_id}',
+        'Host': 'api2.cursor.sh'
+    })
+    
+    @property
+    def auth_reader(self):
+        return self.credentials.reader
+    
+    @property
+    def token(self) -> Optional[str]:
+        """Bearer token, re-read when state.vscdb changes"""
+        return self.credentials.get_bearer_token()
+    
     def __init__(self, workspace_root: str = "."):
-        self.auth_reader = CursorAuthReader()
-        self.token = self.auth_reader.get_bearer_token()
         self.base_url = "https://api2.cursor.sh"
         self.tool_executor = ToolExecutor(workspace_root)
         self.workspace_root = Path(workspace_root).resolve()
@@ -895,635 +1082,326 @@ class CursorAgentClient:
         return str(uuid.uuid5(uuid.NAMESPACE_DNS, auth_token))
     
     def get_machine_id(self) -> Optional[str]:
-        """Get machine ID from Cursor storage"""
-        import sqlite3
-        db_path = self.auth_reader.storage_path
-        if not db_path:
-            return None
-        try:
-            conn = sqlite3.connect(str(db_path))
-            cursor = conn.cursor()
-            cursor.execute("SELECT value FROM ItemTable WHERE key = 'storage.serviceMachineId'")
-            row = cursor.fetchone()
-            conn.close()
-            if row:
-                val = row[0]
-                if isinstance(val, bytes):
-                    val = val.decode('utf-8')
-                return val
-        except:
-            pass
-        return None
+        """Get machine ID from Cursor storage (cached, see cursor_auth_reader.py)"""
+        return self.credentials.get_machine_id()
     
     def generate_cursor_checksum(self, token: str) -> str:
         """Generate checksum (Jyh cipher)"""
         machine_id = self.get_machine_id()
         if not machine_id:
             machine_id = self.generate_hashed_64_hex(token, 'machineId')
-        
-        timestamp = int(time.time() * 1000 // 1000000)
-        
-        byte_array = bytearray([
-            (timestamp >> 40) & 255,
-            (timestamp >> 32) & 255,
-            (timestamp >> 24) & 255,
-            (timestamp >> 16) & 255,
-            (timestamp >> 8) & 255,
-            timestamp & 255,
-        ])
-        
-        # Obfuscate (Jyh cipher)
-        t = 165
-        for i in range(len(byte_array)):
-            byte_array[i] = ((byte_array[i] ^ t) + (i % 256)) & 255
-            t = byte_array[i]
-        
-        # URL-safe base64
-        alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
-        encoded = ""
-        for i in range(0, len(byte_array), 3):
-            a = byte_array[i]
-            b = byte_array[i + 1] if i + 1 < len(byte_array) else 0
-            c = byte_array[i + 2] if i + 2 < len(byte_array) else 0
-            encoded += alphabet[a >> 2]
-            encoded += alphabet[((a & 3) << 4) | (b >> 4)]
-            if i + 1 < len(byte_array):
-                encoded += alphabet[((b & 15) << 2) | (c >> 6)]
-            if i + 2 < len(byte_array):
-                encoded += alphabet[c & 63]
-        
-        return f"{encoded}{machine_id}"
+        return cursor_checksum(machine_id)
     
     def encode_message(self, content: str, role: int, message_id: str, chat_mode_enum: int = None) -> bytes:
         """Encode a conversation message"""
-        msg = b''
-        msg += ProtobufEncoder.encode_field(1, 2, content)
-        msg += ProtobufEncoder.encode_field(2, 0, role)
-        msg += ProtobufEncoder.encode_field(13, 2, message_id)
-        if chat_mode_enum is not None:
-            msg += ProtobufEncoder.encode_field(47, 0, chat_mode_enum)
-        return msg
+        return encode('ConversationMessage', {
+            'content': content,
+            'role': role,
+            'message_id': message_id,
+            'chat_mode_enum': chat_mode_enum,
+        })
     
     def encode_instruction(self, instruction_text: str) -> bytes:
         """Encode instruction"""
-        msg = b''
-        if instruction_text:
-            msg += ProtobufEncoder.encode_field(1, 2, instruction_text)
-        return msg
+        return encode('Instruction', {'instruction': instruction_text or None})
     
     def encode_model(self, model_name: str) -> bytes:
         """Encode model"""
-        msg = b''
-        msg += ProtobufEncoder.encode_field(1, 2, model_name)
-        msg += ProtobufEncoder.encode_field(4, 2, b'')
-        return msg
+        return encode('Model', {'name': model_name, 'empty': b''})
     
     def encode_cursor_setting(self) -> bytes:
         """Encode CursorSetting"""
-        msg = b''
-        msg += ProtobufEncoder.encode_field(1, 2, "cursor\\aisettings")
-        msg += ProtobufEncoder.encode_field(3, 2, b'')
-        unknown6_msg = b''
-        unknown6_msg += ProtobufEncoder.encode_field(1, 2, b'')
-        unknown6_msg += ProtobufEncoder.encode_field(2, 2, b'')
-        msg += ProtobufEncoder.encode_field(6, 2, unknown6_msg)
-        msg += ProtobufEncoder.encode_field(8, 0, 1)
-        msg += ProtobufEncoder.encode_field(9, 0, 1)
-        return msg
+        return encode('CursorSetting', {})
     
     def encode_metadata(self) -> bytes:
         """Encode Metadata"""
-        msg = b''
-        msg += ProtobufEncoder.encode_field(1, 2, "linux")
-        msg += ProtobufEncoder.encode_field(2, 2, "x64")
-        msg += ProtobufEncoder.encode_field(3, 2, "6.13.0")
-        msg += ProtobufEncoder.encode_field(4, 2, "/usr/bin/python3")
+        return self.METADATA_TEMPLATE.build(self._metadata_value())
+    
+    def _metadata_value(self) -> Dict:
         from datetime import datetime
-        msg += ProtobufEncoder.encode_field(5, 2, datetime.now().isoformat())
-        return msg
+        return {'timestamp': datetime.now().isoformat()}
     
     def encode_message_id(self, message_id: str, role: int, summary_id: str = None) -> bytes:
         """Encode MessageId"""
-        msg = b''
-        msg += ProtobufEncoder.encode_field(1, 2, message_id)
-        if summary_id:
-            msg += ProtobufEncoder.encode_field(2, 2, summary_id)
-        msg += ProtobufEncoder.encode_field(3, 0, role)
-        return msg
+        return encode('MessageId', {
+            'message_id': message_id,
+            'summary_id': summary_id or None,
+            'role': role,
+        })
     
     def encode_agent_request(self, messages: List[Dict], model_name: str, 
                             supported_tools: List[int] = None) -> bytes:
         """Encode Agent mode request with supported_tools"""
-        if supported_tools is None:
-            supported_tools = self.DEFAULT_TOOLS
-        
-        msg = b''
-        
-        # Format messages
-        formatted_messages = []
-        message_ids = []
-        
-        for user_msg in messages:
-            if user_msg['role'] == 'user':
-                msg_id = str(uuid.uuid4())
-                formatted_messages.append({
-                    'content': user_msg['content'],
-                    'role': 1,  # user
-                    'messageId': msg_id,
-                    'chatModeEnum': 2  # Agent mode
-                })
-                message_ids.append({
-                    'messageId': msg_id,
-                    'role': 1
-                })
-        
-        # repeated Message messages = 1;
-        for formatted_msg in formatted_messages:
-            message_bytes = self.encode_message(
-                formatted_msg['content'],
-                formatted_msg['role'],
-                formatted_msg['messageId'],
-                formatted_msg.get('chatModeEnum')
-            )
-            msg += ProtobufEncoder.encode_field(1, 2, message_bytes)
-        
-        # int32 unknown2 = 2; // 1
-        msg += ProtobufEncoder.encode_field(2, 0, 1)
-        
-        # Instruction instruction = 3;
-        instruction_bytes = self.encode_instruction("")
-        msg += ProtobufEncoder.encode_field(3, 2, instruction_bytes)
-        
-        # int32 unknown4 = 4; // 1
-        msg += ProtobufEncoder.encode_field(4, 0, 1)
-        
-        # Model model = 5;
-        model_bytes = self.encode_model(model_name)
-        msg += ProtobufEncoder.encode_field(5, 2, model_bytes)
-        
-        # string webTool = 8;
-        msg += ProtobufEncoder.encode_field(8, 2, "")
-        
-        # int32 unknown13 = 13;
-        msg += ProtobufEncoder.encode_field(13, 0, 1)
-        
-        # CursorSetting cursorSetting = 15;
-        cursor_setting_bytes = self.encode_cursor_setting()
-        msg += ProtobufEncoder.encode_field(15, 2, cursor_setting_bytes)
-        
-        # int32 unknown19 = 19; // 1
-        msg += ProtobufEncoder.encode_field(19, 0, 1)
-        
-        # string conversationId = 23;
-        msg += ProtobufEncoder.encode_field(23, 2, str(uuid.uuid4()))
-        
-        # Metadata metadata = 26;
-        metadata_bytes = self.encode_metadata()
-        msg += ProtobufEncoder.encode_field(26, 2, metadata_bytes)
-        
-        # bool is_agentic = 27; (field 27 in StreamUnifiedChatRequest)
-        msg += ProtobufEncoder.encode_field(27, 0, 1)  # true
-        
-        # repeated ClientSideToolV2 supported_tools = 29;
-        for tool in supported_tools:
-            msg += ProtobufEncoder.encode_field(29, 0, tool)
-        
-        # repeated MessageId messageIds = 30;
-        for msg_id_data in message_ids:
-            message_id_bytes = self.encode_message_id(
-                msg_id_data['messageId'],
-                msg_id_data['role']
+        return self._request_template(supported_tools).build(
+            self._agent_request_value(messages, model_name))
+    
+    def request_size_report(self, messages: List[Dict], model_name: str,
+                            supported_tools: List[int] = None) -> Dict[str, int]:
+        """Encoded bytes per StreamUnifiedChatRequest field, largest first"""
+        return self.field_size_report(self.encode_agent_request(messages, model_name, supported_tools))
+    
+    @staticmethod
+    def field_size_report(request: bytes) -> Dict[str, int]:
+        """request_size_report() of an already encoded StreamUnifiedChatRequest"""
+        sizes = field_sizes('StreamUnifiedChatRequest', request)
+        return dict(sorted(sizes.items(), key=lambda item: -item[1]))
+    
+    def _request_template(self, supported_tools: List[int] = None) -> MessageTemplate:
+        """StreamUnifiedChatRequest for agent mode with everything but
+        REQUEST_FIELDS encoded; constant fields come from the schema defaults
+        in cursor_schema.SCHEMAS"""
+        key = tuple(self.DEFAULT_TOOLS if supported_tools is None else supported_tools)
+        template = self._request_templates.get(key)
+        if template is None:
+            template = self._request_templates[key] = MessageTemplate(
+                'StreamUnifiedChatRequest',
+                static={
+                    'is_agentic': True,
+                    'supported_tools': list(key),
+                    'chat_mode_enum': 2,  # Agent mode
+                    'chat_mode': "agent",
+                },
+                dynamic=self.REQUEST_FIELDS,
             )
-            msg += ProtobufEncoder.encode_field(30, 2, message_id_bytes)
-        
-        # int32 largeContext = 35; // 0
-        msg += ProtobufEncoder.encode_field(35, 0, 0)
-        
-        # int32 unknown38 = 38; // 0
-        msg += ProtobufEncoder.encode_field(38, 0, 0)
-        
-        # int32 chatModeEnum = 46; // 2 for Agent mode
-        msg += ProtobufEncoder.encode_field(46, 0, 2)
-        
-        # string unknown47 = 47;
-        msg += ProtobufEncoder.encode_field(47, 2, "")
-        
-        # int32 unknown48 = 48; // 0
-        msg += ProtobufEncoder.encode_field(48, 0, 0)
-        
-        # int32 unknown49 = 49; // 0
-        msg += ProtobufEncoder.encode_field(49, 0, 0)
-        
-        # int32 unknown51 = 51; // 0
-        msg += ProtobufEncoder.encode_field(51, 0, 0)
-        
-        # int32 unknown53 = 53; // 1
-        msg += ProtobufEncoder.encode_field(53, 0, 1)
+        return template
+    
+    def _agent_request_value(self, messages: List[Dict], model_name: str) -> Dict:
+        """Per-request StreamUnifiedChatRequest fields, see REQUEST_FIELDS
         
-        # string chatMode = 54; // "agent"
-        msg += ProtobufEncoder.encode_field(54, 2, "agent")
+        Only user messages are sent; assistant and tool messages are skipped
+        (see AgentConversation)."""
+        if isinstance(messages, AgentConversation):
+            conversation, message_ids = messages.encoded_fields()
+        else:
+            conversation = []
+            message_ids = []
+            for user_msg in messages:
+                if user_msg['role'] == 'user':
+                    msg_id = str(uuid.uuid4())
+                    conversation.append({
+                        'content': user_msg['content'],
+                        'role': 1,  # user
+                        'message_id': msg_id,
+                        'chat_mode_enum': 2  # Agent mode
+                    })
+                    message_ids.append({'message_id': msg_id, 'role': 1})
         
-        return msg
+        return {
+            'messages': conversation,
+            'model': {'name': model_name, 'empty': b''},
+            'conversation_id': str(uuid.uuid4()),
+            'metadata': self.encode_metadata(),
+            'message_ids': message_ids,
+        }
     
     def encode_stream_unified_chat_request(self, messages: List[Dict], model_name: str) -> bytes:
         """Encode StreamUnifiedChatWithToolsRequest for agent mode"""
-        msg = b''
-        
-        # Request request = 1;
-        request_bytes = self.encode_agent_request(messages, model_name)
-        msg += ProtobufEncoder.encode_field(1, 2, request_bytes)
-        
-        return msg
+        return self.wrap_agent_request(self.encode_agent_request(messages, model_name))
+    
+    def wrap_agent_request(self, request: bytes) -> bytes:
+        """StreamUnifiedChatRequestWithTools around an encoded StreamUnifiedChatRequest"""
+        return encode('StreamUnifiedChatRequestWithTools', {'request': request})
     
     def encode_tool_result(self, tool: int, tool_call_id: str, result: ToolResult) -> bytes:
         """Encode ClientSideToolV2Result"""
-        msg = b''
-        
-        # ClientSideToolV2 tool = 1;
-        msg += ProtobufEncoder.encode_field(1, 0, tool)
-        
-        # string tool_call_id = 35;
-        msg += ProtobufEncoder.encode_field(35, 2, tool_call_id)
+        return encode('ClientSideToolV2Result', self._tool_result_value(tool, tool_call_id, result))
+    
+    def _tool_result_value(self, tool: int, tool_call_id: str, result: ToolResult) -> Dict:
+        """ClientSideToolV2Result fields for a tool result"""
+        value = {'tool': tool, 'tool_call_id': tool_call_id}
         
         if result.success:
             # Encode result based on tool type
-            result_bytes = self._encode_tool_specific_result(tool, result.data)
-            if result_bytes:
-                # The field number depends on the tool type
-                field_num = self._get_result_field_number(tool)
-                msg += ProtobufEncoder.encode_field(field_num, 2, result_bytes)
+            result_value = self._tool_specific_result_value(tool, result.data)
+            if result_value:
+                # The oneof field depends on the tool type
+                value[self._get_result_field_name(tool)] = result_value
         else:
             # ToolResultError error = 8;
-            error_bytes = ProtobufEncoder.encode_field(1, 2, result.error or "Unknown error")
-            msg += ProtobufEncoder.encode_field(8, 2, error_bytes)
+            value['error'] = {'client_visible_error_message': result.error or "Unknown error"}
         
-        return msg
+        return value
     
-    def _encode_tool_specific_result(self, tool: int, data: Dict) -> bytes:
-        """Encode tool-specific result data"""
-        msg = b''
-        
+    def _tool_specific_result_value(self, tool: int, data: Dict) -> Dict:
+        """Tool-specific result fields (empty when there is nothing to send)"""
         if tool == ClientSideToolV2.READ_FILE:
             # ReadFileResult
-            if 'contents' in data:
-                msg += ProtobufEncoder.encode_field(1, 2, data['contents'])
-            if 'relative_workspace_path' in data:
-                msg += ProtobufEncoder.encode_field(9, 2, data['relative_workspace_path'])
-            if 'total_lines' in data:
-                msg += ProtobufEncoder.encode_field(12, 0, data['total_lines'])
-                
-        elif tool == ClientSideToolV2.LIST_DIR:
+            return {key: data[key] for key in ('contents', 'relative_workspace_path', 'total_lines')
+                    if key in data}
+        
+        if tool == ClientSideToolV2.LIST_DIR:
             # ListDirResult: repeated File files = 1; string directory_relative_workspace_path = 2;
+            value = {}
             entries = data.get('entries', [])
-            for entry in entries:
-                # File message: name=1(string), is_directory=2(bool), size=3(int64)
-                file_msg = b''
-                file_msg += ProtobufEncoder.encode_field(1, 2, entry.get('name', ''))
-                file_msg += ProtobufEncoder.encode_field(2, 0, 1 if entry.get('is_directory') else 0)
-                if entry.get('size'):
-                    file_msg += ProtobufEncoder.encode_field(3, 0, entry['size'])
-                msg += ProtobufEncoder.encode_field(1, 2, file_msg)
-            # directory_relative_workspace_path = 2
+            if entries:
+                value['files'] = [{
+                    'name': entry.get('name', ''),
+                    'is_directory': bool(entry.get('is_directory')),
+                    'size': entry['size'] if entry.get('size') else None,
+                } for entry in entries]
             if 'directory_path' in data:
-                msg += ProtobufEncoder.encode_field(2, 2, data['directory_path'])
-            
-        elif tool == ClientSideToolV2.RIPGREP_SEARCH:
+                value['directory_relative_workspace_path'] = data['directory_path']
+            return value
+        
+        if tool == ClientSideToolV2.RIPGREP_SEARCH:
             # RipgrepSearchResult: internal=1(RipgrepSearchResultInternal)
-            # RipgrepSearchResultInternal: results=1(repeated IFileMatch), exit=2(enum)
-            # IFileMatch: resource=1(string), results=2(repeated ITextSearchResult)
-            # ITextSearchResult: match=1(ITextSearchMatch oneof)
-            # ITextSearchMatch: range_locations=2(repeated), preview_text=3(string)
-            internal_msg = b''
-            
             # Group matches by file path
-            matches = data.get('matches', [])
             files_dict = {}
-            for match in matches:
+            for match in data.get('matches', []):
                 if isinstance(match, dict):
                     path = match.get('path', '')
                     if path:
-                        if path not in files_dict:
-                            files_dict[path] = []
-                        files_dict[path].append(match)
+                        files_dict.setdefault(path, []).append(match)
             
             # Encode each file's matches as IFileMatch
-            for file_path, file_matches in files_dict.items():
-                file_match_msg = b''
-                # resource = 1 (file path)
-                file_match_msg += ProtobufEncoder.encode_field(1, 2, file_path)
-                
-                # results = 2 (repeated ITextSearchResult)
-                for match in file_matches:
+            file_matches = []
+            for file_path, matches in files_dict.items():
+                results = []
+                for match in matches:
                     line_content = match.get('line_content', '')
                     line_number = match.get('line_number', 0)
-                    
-                    # ITextSearchMatch: preview_text=3
-                    text_search_match = b''
-                    text_search_match += ProtobufEncoder.encode_field(3, 2, line_content)
-                    
+                    text_search_match = {'preview_text': line_content}
                     # Optionally add range_locations for line number
                     if line_number:
-                        # ISearchRangeSetPairing: source=1(Range)
-                        # Range: startLineNumber=1, startColumn=2, endLineNumber=3, endColumn=4
-                        range_msg = b''
-                        range_msg += ProtobufEncoder.encode_field(1, 0, line_number)  # startLineNumber
-                        range_msg += ProtobufEncoder.encode_field(2, 0, 1)  # startColumn
-                        range_msg += ProtobufEncoder.encode_field(3, 0, line_number)  # endLineNumber
-                        range_msg += ProtobufEncoder.encode_field(4, 0, len(line_content) + 1)  # endColumn
-                        pairing = ProtobufEncoder.encode_field(1, 2, range_msg)  # source
-                        text_search_match += ProtobufEncoder.encode_field(2, 2, pairing)
-                    
-                    # ITextSearchResult: match=1 (oneof field)
-                    text_search_result = ProtobufEncoder.encode_field(1, 2, text_search_match)
-                    file_match_msg += ProtobufEncoder.encode_field(2, 2, text_search_result)
-                
-                internal_msg += ProtobufEncoder.encode_field(1, 2, file_match_msg)
-            
-            # exit = NORMAL (1)
-            internal_msg += ProtobufEncoder.encode_field(2, 0, 1)
-            
-            # Wrap in RipgrepSearchResult.internal
-            msg += ProtobufEncoder.encode_field(1, 2, internal_msg)
+                        text_search_match['range_locations'] = [{'source': {
+                            'start_line_number': line_number,
+                            'start_column': 1,
+                            'end_line_number': line_number,
+                            'end_column': len(line_content) + 1,
+                        }}]
+                    results.append({'match': text_search_match})
+                file_matches.append({'resource': file_path, 'results': results})
             
-        elif tool == ClientSideToolV2.RUN_TERMINAL_COMMAND_V2:
+            return {'internal': {'results': file_matches, 'exit': 1}}  # exit = NORMAL
+        
+        if tool == ClientSideToolV2.RUN_TERMINAL_COMMAND_V2:
             # RunTerminalCommandV2Result: output=1(string), exit_code=2(int32), rejected=3(bool)
             # Combine stdout and stderr into output
+            value = {}
             output = data.get('stdout', '') or data.get('output', '')
             if data.get('stderr'):
                 output += '\n' + data['stderr']
             if output:
-                msg += ProtobufEncoder.encode_field(1, 2, output)
+                value['output'] = output
             if 'exit_code' in data:
-                msg += ProtobufEncoder.encode_field(2, 0, data['exit_code'])
-                
-        elif tool == ClientSideToolV2.EDIT_FILE:
+                value['exit_code'] = data['exit_code']
+            return value
+        
+        if tool == ClientSideToolV2.EDIT_FILE:
             # EditFileResult: is_applied=2(bool)
-            if data.get('is_applied'):
-                msg += ProtobufEncoder.encode_field(2, 0, 1)  # is_applied = true
+            return {'is_applied': True} if data.get('is_applied') else {}
         
-        elif tool == ClientSideToolV2.FILE_SEARCH:
+        if tool in (ClientSideToolV2.FILE_SEARCH, ClientSideToolV2.GLOB_FILE_SEARCH):
             # ToolCallFileSearchResult: files=1(repeated File), limit_hit=2(bool), num_results=3(int32)
-            # File: uri=1(string)
+            # GlobFileSearchResult is sent with the same structure
             files = data.get('files', [])
-            for f in files:
-                file_msg = ProtobufEncoder.encode_field(1, 2, f.get('uri', ''))
-                msg += ProtobufEncoder.encode_field(1, 2, file_msg)
-            if data.get('limit_hit'):
-                msg += ProtobufEncoder.encode_field(2, 0, 1)
-            msg += ProtobufEncoder.encode_field(3, 0, data.get('num_results', len(files)))
-        
-        elif tool == ClientSideToolV2.GLOB_FILE_SEARCH:
-            # GlobFileSearchResult - same structure as FileSearchResult
-            files = data.get('files', [])
-            for f in files:
-                file_msg = ProtobufEncoder.encode_field(1, 2, f.get('uri', ''))
-                msg += ProtobufEncoder.encode_field(1, 2, file_msg)
-            if data.get('limit_hit'):
-                msg += ProtobufEncoder.encode_field(2, 0, 1)
-            msg += ProtobufEncoder.encode_field(3, 0, data.get('num_results', len(files)))
-        
-        return msg
-    
-    def _get_result_field_number(self, tool: int) -> int:
-        """Get the field number for tool result in ClientSideToolV2Result
-        Based on TASK-26-tool-schemas.md ClientSideToolV2Result oneof result {}"""
+            return {
+                'files': [{'uri': f.get('uri', '')} for f in files],
+                'limit_hit': True if data.get('limit_hit') else None,
+                'num_results': data.get('num_results', len(files)),
+            }
+        
+        return {}
+    
+    def _get_result_field_name(self, tool: int) -> str:
+        """Get the oneof field name for tool result in ClientSideToolV2Result
+        Based on TASK-26-tool-schemas.md ClientSideToolV2Result oneof result {};
+        field numbers live in cursor_schema.SCHEMAS"""
         result_field_map = {
             # Core file operations
-            ClientSideToolV2.READ_SEMSEARCH_FILES: 2,     # read_semsearch_files_result
-            ClientSideToolV2.RIPGREP_SEARCH: 4,           # ripgrep_search_result
-            ClientSideToolV2.READ_FILE: 6,                # read_file_result
-            ClientSideToolV2.LIST_DIR: 9,                 # list_dir_result
-            ClientSideToolV2.EDIT_FILE: 10,               # edit_file_result
-            ClientSideToolV2.FILE_SEARCH: 11,             # file_search_result
-            ClientSideToolV2.SEMANTIC_SEARCH_FULL: 18,    # semantic_search_full_result
-            ClientSideToolV2.DELETE_FILE: 20,             # delete_file_result
-            ClientSideToolV2.REAPPLY: 21,                 # reapply_result
-            ClientSideToolV2.RUN_TERMINAL_COMMAND_V2: 24, # run_terminal_command_v2_result
-            ClientSideToolV2.FETCH_RULES: 25,             # fetch_rules_result
-            ClientSideToolV2.WEB_SEARCH: 27,              # web_search_result
-            ClientSideToolV2.MCP: 28,                     # mcp_result
-            ClientSideToolV2.SEARCH_SYMBOLS: 32,          # search_symbols_result
-            ClientSideToolV2.BACKGROUND_COMPOSER_FOLLOWUP: 33,  # background_composer_followup_result
-            ClientSideToolV2.KNOWLEDGE_BASE: 34,          # knowledge_base_result
-            ClientSideToolV2.FETCH_PULL_REQUEST: 36,      # fetch_pull_request_result
-            ClientSideToolV2.DEEP_SEARCH: 37,             # deep_search_result
-            ClientSideToolV2.CREATE_DIAGRAM: 38,          # create_diagram_result
-            ClientSideToolV2.FIX_LINTS: 39,               # fix_lints_result
-            ClientSideToolV2.READ_LINTS: 40,              # read_lints_result
-            ClientSideToolV2.GO_TO_DEFINITION: 41,        # gotodef_result
-            ClientSideToolV2.TASK: 42,                    # task_result
-            ClientSideToolV2.AWAIT_TASK: 43,              # await_task_result
-            ClientSideToolV2.TODO_READ: 44,               # todo_read_result
-            ClientSideToolV2.TODO_WRITE: 45,              # todo_write_result
+            ClientSideToolV2.READ_SEMSEARCH_FILES: 'read_semsearch_files_result',
+            ClientSideToolV2.RIPGREP_SEARCH: 'ripgrep_search_result',
+            ClientSideToolV2.READ_FILE: 'read_file_result',
+            ClientSideToolV2.LIST_DIR: 'list_dir_result',
+            ClientSideToolV2.EDIT_FILE: 'edit_file_result',
+            ClientSideToolV2.FILE_SEARCH: 'file_search_result',
+            ClientSideToolV2.SEMANTIC_SEARCH_FULL: 'semantic_search_full_result',
+            ClientSideToolV2.DELETE_FILE: 'delete_file_result',
+            ClientSideToolV2.REAPPLY: 'reapply_result',
+            ClientSideToolV2.RUN_TERMINAL_COMMAND_V2: 'run_terminal_command_v2_result',
+            ClientSideToolV2.FETCH_RULES: 'fetch_rules_result',
+            ClientSideToolV2.WEB_SEARCH: 'web_search_result',
+            ClientSideToolV2.MCP: 'mcp_result',
+            ClientSideToolV2.SEARCH_SYMBOLS: 'search_symbols_result',
+            ClientSideToolV2.BACKGROUND_COMPOSER_FOLLOWUP: 'background_composer_followup_result',
+            ClientSideToolV2.KNOWLEDGE_BASE: 'knowledge_base_result',
+            ClientSideToolV2.FETCH_PULL_REQUEST: 'fetch_pull_request_result',
+            ClientSideToolV2.DEEP_SEARCH: 'deep_search_result',
+            ClientSideToolV2.CREATE_DIAGRAM: 'create_diagram_result',
+            ClientSideToolV2.FIX_LINTS: 'fix_lints_result',
+            ClientSideToolV2.READ_LINTS: 'read_lints_result',
+            ClientSideToolV2.GO_TO_DEFINITION: 'gotodef_result',
+            ClientSideToolV2.TASK: 'task_result',
+            ClientSideToolV2.AWAIT_TASK: 'await_task_result',
+            ClientSideToolV2.TODO_READ: 'todo_read_result',
+            ClientSideToolV2.TODO_WRITE: 'todo_write_result',
             # V2 versions
-            ClientSideToolV2.EDIT_FILE_V2: 51,            # edit_file_v2_result
-            ClientSideToolV2.LIST_DIR_V2: 52,             # list_dir_v2_result
-            ClientSideToolV2.READ_FILE_V2: 53,            # read_file_v2_result
-            ClientSideToolV2.RIPGREP_RAW_SEARCH: 54,      # ripgrep_raw_search_result
-            ClientSideToolV2.GLOB_FILE_SEARCH: 55,        # glob_file_search_result
-            ClientSideToolV2.CREATE_PLAN: 56,             # create_plan_result
-            ClientSideToolV2.LIST_MCP_RESOURCES: 57,      # list_mcp_resources_result
-            ClientSideToolV2.READ_MCP_RESOURCE: 58,       # read_mcp_resource_result
-            ClientSideToolV2.READ_PROJECT: 59,            # read_project_result
-            ClientSideToolV2.UPDATE_PROJECT: 60,          # update_project_result
-            ClientSideToolV2.TASK_V2: 61,                 # task_v2_result
-            ClientSideToolV2.CALL_MCP_TOOL: 62,           # call_mcp_tool_result
-            ClientSideToolV2.APPLY_AGENT_DIFF: 63,        # apply_agent_diff_result
-            ClientSideToolV2.ASK_QUESTION: 64,            # ask_question_result
-            ClientSideToolV2.SWITCH_MODE: 65,             # switch_mode_result
-            ClientSideToolV2.COMPUTER_USE: 66,            # computer_use_result
-            ClientSideToolV2.GENERATE_IMAGE: 67,          # generate_image_result
-            ClientSideToolV2.WRITE_SHELL_STDIN: 68,       # write_shell_stdin_result
+            ClientSideToolV2.EDIT_FILE_V2: 'edit_file_v2_result',
+            ClientSideToolV2.LIST_DIR_V2: 'list_dir_v2_result',
+            ClientSideToolV2.READ_FILE_V2: 'read_file_v2_result',
+            ClientSideToolV2.RIPGREP_RAW_SEARCH: 'ripgrep_raw_search_result',
+            ClientSideToolV2.GLOB_FILE_SEARCH: 'glob_file_search_result',
+            ClientSideToolV2.CREATE_PLAN: 'create_plan_result',
+            ClientSideToolV2.LIST_MCP_RESOURCES: 'list_mcp_resources_result',
+            ClientSideToolV2.READ_MCP_RESOURCE: 'read_mcp_resource_result',
+            ClientSideToolV2.READ_PROJECT: 'read_project_result',
+            ClientSideToolV2.UPDATE_PROJECT: 'update_project_result',
+            ClientSideToolV2.TASK_V2: 'task_v2_result',
+            ClientSideToolV2.CALL_MCP_TOOL: 'call_mcp_tool_result',
+            ClientSideToolV2.APPLY_AGENT_DIFF: 'apply_agent_diff_result',
+            ClientSideToolV2.ASK_QUESTION: 'ask_question_result',
+            ClientSideToolV2.SWITCH_MODE: 'switch_mode_result',
+            ClientSideToolV2.COMPUTER_USE: 'computer_use_result',
+            ClientSideToolV2.GENERATE_IMAGE: 'generate_image_result',
+            ClientSideToolV2.WRITE_SHELL_STDIN: 'write_shell_stdin_result',
         }
-        return result_field_map.get(tool, 2)  # Default to field 2
+        return result_field_map.get(tool, 'read_semsearch_files_result')  # Default to field 2
     
     def generate_request_body(self, messages: List[Dict], model_name: str) -> bytes:
         """Generate request body with proper framing"""
         buffer = self.encode_stream_unified_chat_request(messages, model_name)
-        
-        magic_number = 0x00
-        if len(messages) >= 3:
-            buffer = gzip.compress(buffer)
-            magic_number = 0x01
-        
-        length_hex = format(len(buffer), '08x')
-        length_bytes = bytes.fromhex(length_hex)
-        
-        return bytes([magic_number]) + length_bytes + buffer
-    
-    def parse_tool_call_from_chunk(self, chunk: bytes) -> Optional[ToolCall]:
-        """Parse tool call from response chunk"""
-        try:
-            text = chunk.decode('utf-8', errors='ignore')
-            
-            # Look for tool call patterns in the response
-            # Pattern 1: JSON in text (magic byte 2 or 3)
-            if chunk and len(chunk) > 5 and chunk[0] in (2, 3):
-                try:
-                    if chunk[0] == 3:
-                        data = gzip.decompress(chunk[5:])
-                    else:
-                        data = chunk[5:]
-                    json_data = json.loads(data.decode('utf-8'))
-                    if 'tool' in json_data or 'name' in json_data:
-                        return ToolCall(
-                            tool=json_data.get('tool', 0),
-                            tool_call_id=json_data.get('tool_call_id', ''),
-                            name=json_data.get('name', ''),
-                            raw_args=json_data.get('raw_args', ''),
-                            params=json.loads(json_data.get('raw_args', '{}')) if json_data.get('raw_args') else {}
-                        )
-                except:
-                    pass
-            
-            # Pattern 2: Look for tool markers in text
-            # Tool calls often appear as: toolu_bdrk_... or similar IDs
-            import re
-            
-            # Match tool call ID pattern
-            tool_id_match = re.search(r'(toolu_[a-zA-Z0-9_]+)', text)
-            if tool_id_match:
-                tool_call_id = tool_id_match.group(1)
-                
-                # Try to find the tool name
-                tool_name = None
-                for name in ['list_dir', 'read_file', 'grep_search', 'edit_file', 'run_terminal_command']:
-                    if name in text.lower():
-                        tool_name = name
-                        break
-                
-                if tool_name:
-                    # Map name to enum - see TASK-110-tool-enum-mapping.md
-                    name_to_enum = {
-                        # Core file operations
-                        'list_dir': ClientSideToolV2.LIST_DIR,
-                        'read_file': ClientSideToolV2.READ_FILE,
-                        'edit_file': ClientSideToolV2.EDIT_FILE,
-                        'delete_file': ClientSideToolV2.DELETE_FILE,
-                        'file_search': ClientSideToolV2.FILE_SEARCH,
-                        'glob_file_search': ClientSideToolV2.GLOB_FILE_SEARCH,
-                        # Search
-                        'grep_search': ClientSideToolV2.RIPGREP_SEARCH,
-                        'ripgrep_search': ClientSideToolV2.RIPGREP_SEARCH,
-                        'codebase_search': ClientSideToolV2.SEMANTIC_SEARCH_FULL,
-                        'search_symbols': ClientSideToolV2.SEARCH_SYMBOLS,
-                        'deep_search': ClientSideToolV2.DEEP_SEARCH,
-                        # Terminal
-                        'run_terminal_command': ClientSideToolV2.RUN_TERMINAL_COMMAND_V2,
-                        'run_terminal_cmd': ClientSideToolV2.RUN_TERMINAL_COMMAND_V2,
-                        # Web/external
-                        'web_search': ClientSideToolV2.WEB_SEARCH,
-                        'fetch_rules': ClientSideToolV2.FETCH_RULES,
-                        'fetch_pull_request': ClientSideToolV2.FETCH_PULL_REQUEST,
-                        # MCP
-                        'mcp': ClientSideToolV2.MCP,
-                        'call_mcp_tool': ClientSideToolV2.CALL_MCP_TOOL,
-                        # Task/Agent
-                        'task': ClientSideToolV2.TASK,
-                        'todo_read': ClientSideToolV2.TODO_READ,
-                        'todo_write': ClientSideToolV2.TODO_WRITE,
-                        # Misc
-                        'reapply': ClientSideToolV2.REAPPLY,
-                        'go_to_definition': ClientSideToolV2.GO_TO_DEFINITION,
-                        'gotodef': ClientSideToolV2.GO_TO_DEFINITION,
-                        'create_diagram': ClientSideToolV2.CREATE_DIAGRAM,
-                        'fix_lints': ClientSideToolV2.FIX_LINTS,
-                        'read_lints': ClientSideToolV2.READ_LINTS,
-                        # V2 versions
-                        'list_dir_v2': ClientSideToolV2.LIST_DIR_V2,
-                        'read_file_v2': ClientSideToolV2.READ_FILE_V2,
-                        'edit_file_v2': ClientSideToolV2.EDIT_FILE_V2,
-                    }
-                    
-                    # Try to extract JSON params
-                    params = {}
-                    json_match = re.search(r'\{[^{}]+\}', text)
-                    if json_match:
-                        try:
-                            params = json.loads(json_match.group())
-                        except:
-                            pass
-                    
-                    return ToolCall(
-                        tool=name_to_enum.get(tool_name, 0),
-                        tool_call_id=tool_call_id,
-                        name=tool_name,
-                        raw_args=json_match.group() if json_match else '',
-                        params=params
-                    )
-            
-            return None
-        except:
-            return None
+        return self.compression.frame(buffer)
     
     def get_headers(self, auth_token: str, session_id: str, client_key: str, 
                    cursor_checksum: str) -> Dict[str, str]:
         """Get HTTP headers for requests"""
-        return {
-            'authorization': f'Bearer {auth_token}',
-            'connect-accept-encoding': 'gzip',
-            'connect-protocol-version': '1',
-            'content-type': 'application/connect+proto',
-            'user-agent': 'connect-es/1.6.1',
-            'x-amzn-trace-id': f'Root={uuid.uuid4()}',
-            'x-client-key': client_key,
-            'x-cursor-checksum': cursor_checksum,
-            'x-cursor-client-version': '2.3.41',
-            'x-cursor-client-type': 'ide',
-            'x-cursor-client-os': 'linux',
-            'x-cursor-client-arch': 'x64',
-            'x-cursor-client-device-type': 'desktop',
-            'x-cursor-config-version': str(uuid.uuid4()),
-            'x-cursor-timezone': 'Europe/Copenhagen',
-            'x-ghost-mode': 'true',
-            'x-request-id': str(uuid.uuid4()),
-            'x-session-id': session_id,
-            'Host': 'api2.cursor.sh'
-        }
+        return self.HEADERS.headers(
+            auth_token=auth_token, client_key=client_key,
+            cursor_checksum=cursor_checksum, session_id=session_id,
+        )
     
     def encode_tool_result_request(self, tool: int, tool_call_id: str, result: ToolResult) -> bytes:
         """Encode StreamUnifiedChatRequestWithTools with tool result (field 2)"""
-        msg = b''
-        
         # ClientSideToolV2Result client_side_tool_v2_result = 2;
-        result_bytes = self.encode_tool_result(tool, tool_call_id, result)
-        msg += ProtobufEncoder.encode_field(2, 2, result_bytes)
-        
-        return msg
+        return encode('StreamUnifiedChatRequestWithTools', {
+            'client_side_tool_v2_result': self._tool_result_value(tool, tool_call_id, result),
+        })
     
-    def frame_message(self, data: bytes, compress: bool = False) -> bytes:
-        """Frame a message with magic byte and length"""
-        if compress:
-            data = gzip.compress(data)
-            magic = 0x01
-        else:
-            magic = 0x00
-        
-        length_hex = format(len(data), '08x')
-        length_bytes = bytes.fromhex(length_hex)
+    def frame_message(self, data: bytes, compress: Optional[bool] = None) -> bytes:
+        """Frame a message with magic byte and length
         
-        return bytes([magic]) + length_bytes + data
+        Compressed as self.compression decides unless compress is given.
+        """
+        return self.compression.frame(data, compress)
     
-    async def send_bidi_append(self, client: httpx.AsyncClient, request_id: str, 
+    async def send_bidi_append(self, client: PooledClient, request_id: str, 
                                seqno: int, data: bytes, headers: Dict[str, str],
                                verbose: bool = False) -> bool:
         """Send tool result via BidiAppend (SSE fallback)"""
         url = f"{self.base_url}/aiserver.v1.BidiService/BidiAppend"
         
         # Encode BidiAppendRequest
-        msg = b''
-        # string data = 1; (contains serialized StreamUnifiedChatRequestWithTools as JSON string)
         import base64
+        # data contains serialized StreamUnifiedChatRequestWithTools as JSON string
         # According to analysis: data is JSON string, not binary
         data_as_json = base64.b64encode(data).decode()  # For binary, base64 encode
-        msg += ProtobufEncoder.encode_field(1, 2, data_as_json)
-        # BidiRequestId request_id = 2;
-        request_id_msg = ProtobufEncoder.encode_field(1, 2, request_id)
-        msg += ProtobufEncoder.encode_field(2, 2, request_id_msg)
-        # int64 append_seqno = 3;
-        msg += ProtobufEncoder.encode_field(3, 0, seqno)
+        append_request = encode('BidiAppendRequest', {
+            'data': data_as_json,
+            'request_id': {'request_id': request_id},
+            'append_seqno': seqno,
+        })
         
-        framed = self.frame_message(msg)
+        framed = self.frame_message(append_request)
         
         try:
             response = await client.post(url, headers=headers, content=framed)
@@ -1538,6 +1416,13 @@ class CursorAgentClient:
                 print(f"[BidiAppend error: {e}]")
             return False
     
+    def _report_incomplete(self, assembler: ToolCallAssembler):
+        """Log the tool calls a finished response left without complete arguments"""
+        for tc in assembler.finish():
+            name = tc['name'] or self.TOOL_NAMES.get(tc['tool'], f"tool_{tc['tool']}")
+            print(f"\n[Tool call {name} ({tc['tool_call_id']}) ended without "
+                  f"complete arguments; not run]", file=sys.stderr)
+    
     async def run_agent_loop(self, prompt: str, model: str = "claude-4-sonnet",
                             max_tool_calls: int = 10, verbose: bool = False) -> str:
         """Run agent using a conversation loop - new request for each tool result"""
@@ -1558,26 +1443,36 @@ class CursorAgentClient:
             print(f"Workspace: {self.workspace_root}")
             print("=" * 50)
         
-        messages = [{"role": "user", "content": prompt}]
+        # Messages are encoded once and reused on every later turn
+        messages = AgentConversation([{"role": "user", "content": prompt}])
         conversation_id = str(uuid.uuid4())
         
         url = f"{self.base_url}/aiserver.v1.ChatService/StreamUnifiedChatWithTools"
         full_response = ""
         tool_calls_executed = 0
         
-        async with httpx.AsyncClient(http2=True, timeout=120.0) as client:
+        async with self.transport.client(http2=True, timeout=120.0) as client:
             while tool_calls_executed < max_tool_calls:
                 headers = self.get_headers(auth_token, session_id, client_key, cursor_checksum)
                 headers['x-conversation-id'] = conversation_id
                 
-                cursor_body = self.generate_request_body(messages, model)
+                # Encoded once; the verbose size report reads the same bytes
+                request = self.encode_agent_request(messages, model)
+                cursor_body = self.compression.frame(self.wrap_agent_request(request))
                 
                 if verbose and tool_calls_executed > 0:
                     print(f"\n[Continuing conversation with tool result...]")
+                if verbose:
+                    sizes = self.field_size_report(request)
+                    top = ', '.join(f"{name} {size}" for name, size in list(sizes.items())[:4])
+                    print(f"[Request {len(cursor_body)} bytes on the wire; {top}]")
                 
                 try:
                     pending_tool_call = None
                     turn_response = ""
+                    # Tool calls are taken from the decoded frames once their
+                    # arguments are complete
+                    assembler = ToolCallAssembler(self.TOOLS_NEEDING_PARAMS)
                     
                     async with client.stream('POST', url, headers=headers, content=cursor_body) as response:
                         if verbose and tool_calls_executed == 0:
@@ -1599,11 +1494,12 @@ class CursorAgentClient:
                             except:
                                 pass
                             
-                            # Check for tool call
-                            tool_call = self.parse_tool_call_from_chunk(chunk)
-                            if tool_call:
-                                pending_tool_call = tool_call
+                            # Check for tool call; one is run per turn
+                            for tc in assembler.feed(chunk):
+                                if pending_tool_call is None:
+                                    pending_tool_call = ToolCall.from_decoded(tc, self.TOOL_NAMES)
                     
+                    self._report_incomplete(assembler)
                     full_response += turn_response
                     
                     # If there's a pending tool call, execute it and add result to messages
@@ -1647,6 +1543,10 @@ class CursorAgentClient:
                     break
             
             print()
+            if verbose:
+                stats = self.compression.stats
+                print(f"[Compression: {stats.compressed}/{stats.messages} bodies, "
+                      f"{stats.bytes_saved} bytes saved in {stats.time_spent * 1000:.1f} ms]")
             return full_response
     
     async def run_agent(self, prompt: str, model: str = "claude-4-sonnet",
@@ -1693,8 +1593,9 @@ class CursorAgentClient:
         full_response = ""
         tool_calls_detected = []
         tool_results = []
+        assembler = ToolCallAssembler(self.TOOLS_NEEDING_PARAMS)
         
-        async with httpx.AsyncClient(http2=True, timeout=120.0) as client:
+        async with self.transport.client(http2=True, timeout=120.0) as client:
             try:
                 async with client.stream('POST', url, headers=headers, content=cursor_body) as response:
                     if verbose:
@@ -1715,13 +1616,11 @@ class CursorAgentClient:
                         except:
                             pass
                         
-                        # Detect tool calls
-                        tool_call = self.parse_tool_call_from_chunk(chunk)
-                        if tool_call and len(tool_calls_detected) < max_tool_calls:
-                            # Skip if we already have this tool call
-                            if any(tc.tool_call_id == tool_call.tool_call_id for tc in tool_calls_detected):
-                                continue
-                            
+                        # Detect tool calls; each is returned once, when complete
+                        for tc in assembler.feed(chunk):
+                            if len(tool_calls_detected) >= max_tool_calls:
+                                break
+                            tool_call = ToolCall.from_decoded(tc, self.TOOL_NAMES)
                             tool_calls_detected.append(tool_call)
                             
                             if execute_tools:
@@ -1740,6 +1639,7 @@ class CursorAgentClient:
                                         print(f"[Result preview: {data_str}...]")
                 
                 print()
+                self._report_incomplete(assembler)
                 
                 if tool_calls_detected:
                     print(f"\n--- Tool Call Summary ---")
@@ -7,16 +7,19 @@ Updated for Cursor 1.3.7 with Protocol Buffer support
 
 import json
 import asyncio
-import aiohttp
 import base64
 from typing import Dict, Optional, List, AsyncIterator
 import struct
 
 from constants import CURSOR_EMBEDDED_AI_KEY
+from cursor_transport import DEFAULT_POOL
 
 class CursorAPIClient:
     """Minimal client for Cursor's gRPC-web API"""
     
+    # Warm HTTP connections shared by all clients (cursor_transport.py)
+    transport = DEFAULT_POOL
+    
     def __init__(self, bearer_token: Optional[str] = None):
         """
         Initialize the client
@@ -122,18 +125,19 @@ class CursorAPIClient:
         request_bytes = json.dumps(request_data).encode('utf-8')
         encoded_request = self._encode_length_delimited(request_bytes)
         
-        async with aiohttp.ClientSession() as session:
-            async with session.post(
+        async with self.transport.client(http2=True) as client:
+            async with client.stream(
+                'POST',
                 endpoint,
-                data=encoded_request,
+                content=encoded_request,
                 headers=self.headers
             ) as response:
-                if response.status != 200:
-                    error_text = await response.text()
-                    raise Exception(f"API error: {response.status} - {error_text}")
+                if response.status_code != 200:
+                    error_text = (await response.aread()).decode('utf-8', errors='ignore')
+                    raise Exception(f"API error: {response.status_code} - {error_text}")
                 
                 # Stream the response
-                async for chunk in response.content.iter_any():
+                async for chunk in response.aiter_bytes():
                     if chunk:
                         messages = self._decode_grpc_web_response(chunk)
                         for message in messages:
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Resident `ask` server on a Unix domain socket.
+
+A plain `ask` run imports httpx and protobuf, reads state.vscdb, bootstraps
+a session and opens a TLS connection before the prompt goes out. The daemon
+does all of that once. It keeps the credentials, the session cache and the
+pooled HTTP/2 connections warm, and `ask` becomes a thin client that writes
+one request line and copies the streamed text to stdout.
+
+Protocol, one JSON object per line:
+
+    -> {"prompt": "...", "model": "gpt-4"}
+    <- {"text": "..."}            once per text delta, as it arrives
+    <- {"done": true} | {"error": "..."}
+
+The socket is created with mode 0600 at $CURSOR_ASK_SOCKET, else
+$XDG_RUNTIME_DIR/cursor-ask.sock, else ~/.cache/cursor-api/ask.sock.
+
+    ask --serve              # run the daemon in the foreground
+    ask "question"           # uses the daemon when it is running
+
+Only the standard library is imported at module level; the Cursor client
+(httpx, protobuf) is imported when the daemon starts, so the thin client
+stays fast to start.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+from typing import Iterator, Optional
+
+
+def default_socket_path() -> Path:
+    if os.environ.get('CURSOR_ASK_SOCKET'):
+        return Path(os.environ['CURSOR_ASK_SOCKET'])
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return Path(os.environ['XDG_RUNTIME_DIR']) / 'cursor-ask.sock'
+    return Path.home() / '.cache' / 'cursor-api' / 'ask.sock'
+
+
+def connect(path: Optional[Path] = None) -> Optional[socket.socket]:
+    """A connection to the daemon, or None when none is listening"""
+    path = path or default_socket_path()
+    if not path.exists():
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(path))
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def request(sock: socket.socket, prompt: str, model: str) -> Iterator[str]:
+    """Send one prompt and yield the response text as it streams back
+
+    Raises RuntimeError with the daemon's message on failure. Closes sock.
+    """
+    with sock, sock.makefile('rb') as lines:
+        sock.sendall(json.dumps({'prompt': prompt, 'model': model}).encode('utf-8') + b'\n')
+        for line in lines:
+            reply = json.loads(line)
+            if 'text' in reply:
+                yield reply['text']
+            elif 'error' in reply:
+                raise RuntimeError(reply['error'])
+            elif reply.get('done'):
+                return
+    raise RuntimeError("daemon closed the connection")
+
+
+class AskDaemon:
+    """Serves ask requests from one long-lived CursorHTTP2Client"""
+    
+    DEFAULT_MODEL = "gpt-4"
+    
+    # Longest request line accepted; prompts are often whole piped files
+    REQUEST_LIMIT = 64 * 1024 * 1024
+    
+    def __init__(self, path: Optional[Path] = None, client=None):
+        self.path = Path(path) if path else default_socket_path()
+        if client is None:
+            from cursor_http2_client import CursorHTTP2Client
+            client = CursorHTTP2Client()
+        self.client = client
+        self.server = None
+    
+    async def start(self):
+        """Listen on the socket, replacing a stale one left by a dead daemon"""
+        if self.path.exists():
+            running = connect(self.path)
+            if running:
+                running.close()
+                raise RuntimeError(f"a daemon is already listening on {self.path}")
+            self.path.unlink()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        old_umask = os.umask(0o177)
+        try:
+            self.server = await asyncio.start_unix_server(
+                self._handle, path=str(self.path), limit=self.REQUEST_LIMIT)
+        finally:
+            os.umask(old_umask)
+    
+    async def serve_forever(self):
+        await self.start()
+        print(f"ask daemon listening on {self.path}", file=sys.stderr)
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        finally:
+            await self.close()
+    
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        if hasattr(self.client, 'transport'):
+            await self.client.transport.aclose()
+        try:
+            self.path.unlink()
+        except OSError:
+            pass
+    
+    async def _handle(self, reader, writer):
+        def send(reply: dict):
+            writer.write(json.dumps(reply).encode('utf-8') + b'\n')
+    
+        try:
+            try:
+                req = json.loads(await reader.readline())
+                prompt = req['prompt']
+                model = req.get('model') or self.DEFAULT_MODEL
+            except (ValueError, KeyError, TypeError) as e:
+                send({'error': f"bad request: {e}"})
+                return
+    
+            messages = [{"role": "user", "content": prompt}]
+            stream = self.client.stream_chat(messages, model)
+            try:
+                async for text in stream:
+                    send({'text': text})
+                    await writer.drain()
+                send({'done': True})
+            except ConnectionError:
+                raise
+            except Exception as e:
+                send({'error': str(e) or type(e).__name__})
+            finally:
+                # Close the upstream request now, not at garbage collection,
+                # when the client hangs up mid-stream
+                await stream.aclose()
+        except ConnectionError:
+            pass  # Client went away
+        finally:
+            try:
+                await writer.drain()
+                writer.close()
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+
+def serve(path: Optional[Path] = None):
+    """Run the daemon in the foreground until interrupted"""
+    daemon = AskDaemon(path)
+    try:
+        asyncio.run(daemon.serve_forever())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    serve(Path(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -3,21 +3,48 @@
 Cursor Authentication Token Reader
 Reads the stored authentication tokens from Cursor's local storage
 Updated for Cursor 1.3.7 with embedded AI key support
+
+Clients share one CredentialProvider (DEFAULT_CREDENTIALS) that reads the
+token and machine id once per process and again only when state.vscdb or
+its WAL changes.
 """
 
 import os
 import json
 import sqlite3
 import platform
+import asyncio
+import threading
 from pathlib import Path
-from typing import Optional, Dict
+from typing import Optional, Dict, Iterable, Tuple
 
 from constants import CURSOR_EMBEDDED_AI_KEY
 
 
+def connect_readonly(path) -> sqlite3.Connection:
+    """Open a state.vscdb read-only
+    
+    mode=ro still honours locks and the WAL of a running Cursor. If that fails,
+    e.g. because the -shm file cannot be created, fall back to immutable=1,
+    which reads the database file as is.
+    """
+    uri = Path(path).resolve().as_uri()
+    try:
+        conn = sqlite3.connect(f"{uri}?mode=ro", uri=True)
+        conn.execute("SELECT 1 FROM sqlite_master LIMIT 1")
+        return conn
+    except sqlite3.OperationalError:
+        return sqlite3.connect(f"{uri}?immutable=1", uri=True)
+
+
 class CursorAuthReader:
     """Read Cursor's stored authentication tokens"""
     
+    # Key/value tables in state.vscdb; cursorDiskKV also holds the (large)
+    # composer data, so only ever query it by key
+    TABLES = ('ItemTable', 'cursorDiskKV')
+    AUTH_PREFIX = 'cursorAuth/'
+    
     def __init__(self):
         self.cursor_data_path = self._find_cursor_data_path()
         self.storage_path = None
@@ -87,40 +114,68 @@ class CursorAuthReader:
             return None
     
     def read_sqlite_storage(self) -> Optional[Dict]:
-        """Read storage from SQLite database"""
+        """Read the cursorAuth/ entries from the SQLite database"""
+        # Prefix range on the key index: '0' follows '/'
+        return self._query_sqlite(
+            "key >= ? AND key < ?", (self.AUTH_PREFIX, self.AUTH_PREFIX[:-1] + '0'))
+    
+    def read_sqlite_keys(self, keys: Iterable[str]) -> Optional[Dict]:
+        """Read the given keys from the SQLite database; missing keys are left out"""
+        keys = list(keys)
+        return self._query_sqlite(f"key IN ({', '.join('?' * len(keys))})", keys)
+    
+    def _query_sqlite(self, where: str, params) -> Optional[Dict]:
         if not self.storage_path or self.storage_path.suffix != '.vscdb':
             return None
             
         try:
-            conn = sqlite3.connect(str(self.storage_path))
-            cursor = conn.cursor()
-            
-            # Try different table names that might store the data
-            tables = ['ItemTable', 'cursorDiskKV']
+            conn = connect_readonly(self.storage_path)
             storage_data = {}
-            
-            for table in tables:
-                try:
-                    cursor.execute(f"SELECT key, value FROM {table}")
-                    for key, value in cursor.fetchall():
-                        if key and isinstance(key, str) and key.startswith('cursorAuth/'):
-                            # Value might be bytes or string
-                            if isinstance(value, bytes):
-                                value = value.decode('utf-8')
-                            # Try to parse as JSON, otherwise use as string
-                            try:
-                                storage_data[key] = json.loads(value)
-                            except:
-                                storage_data[key] = value
-                except sqlite3.Error as e:
-                    continue
-            
-            conn.close()
+            try:
+                for table in self.TABLES:
+                    try:
+                        rows = conn.execute(f"SELECT key, value FROM {table} WHERE {where}", params)
+                        for key, value in rows:
+                            storage_data[key] = self._decode_value(value)
+                    except sqlite3.Error:
+                        continue
+            finally:
+                conn.close()
             return storage_data
         except Exception as e:
             print(f"Error reading SQLite storage: {e}")
             return None
     
+    @staticmethod
+    def _decode_value(value):
+        # Value might be bytes or string
+        if isinstance(value, bytes):
+            value = value.decode('utf-8')
+        # Try to parse as JSON, otherwise use as string
+        try:
+            return json.loads(value)
+        except (TypeError, ValueError):
+            return value
+    
+    def read_machine_id(self) -> Optional[str]:
+        """storage.serviceMachineId, used in the x-cursor-checksum header"""
+        if not self.storage_path or self.storage_path.suffix != '.vscdb':
+            return None
+        try:
+            conn = connect_readonly(self.storage_path)
+            try:
+                row = conn.execute(
+                    "SELECT value FROM ItemTable WHERE key = 'storage.serviceMachineId'"
+                ).fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return None
+        if not row:
+            return None
+        val = row[0]
+        return val.decode('utf-8') if isinstance(val, bytes) else val
+    
     def get_auth_tokens(self) -> Dict[str, Optional[str]]:
         """Get all authentication tokens"""
         tokens = {
@@ -141,16 +196,6 @@ class CursorAuthReader:
         
         print(f"Found storage at: {self.storage_path}")
         
-        # Try reading based on file type
-        if self.storage_path.suffix == '.json':
-            storage_data = self.read_json_storage()
-        else:
-            storage_data = self.read_sqlite_storage()
-        
-        if not storage_data:
-            print("Could not read storage data")
-            return tokens
-        
         # Extract tokens
         key_mappings = {
             'cursorAuth/accessToken': 'access_token',
@@ -163,6 +208,16 @@ class CursorAuthReader:
             'cursorAuth/stripeMembershipType': 'membership_type',
         }
         
+        # Try reading based on file type
+        if self.storage_path.suffix == '.json':
+            storage_data = self.read_json_storage()
+        else:
+            storage_data = self.read_sqlite_keys(key_mappings)
+        
+        if not storage_data:
+            print("Could not read storage data")
+            return tokens
+        
         for storage_key, token_key in key_mappings.items():
             if storage_key in storage_data:
                 tokens[token_key] = storage_data[storage_key]
@@ -179,6 +234,79 @@ class CursorAuthReader:
         return CURSOR_EMBEDDED_AI_KEY
 
 
+class CredentialProvider:
+    """
+    Token and machine id read once per process.
+    
+    Every access compares the mtime and size of the storage file and its
+    -wal file with what they were at the last read, and reads again when
+    they changed (Cursor refreshed the token, or the user logged in as
+    someone else). The CursorAuthReader, which searches for the storage
+    path, is also only built once.
+    
+        token = DEFAULT_CREDENTIALS.get_bearer_token()
+        await DEFAULT_CREDENTIALS.refresh()
+    """
+    
+    def __init__(self, reader: Optional[CursorAuthReader] = None):
+        self._reader = reader
+        self._lock = threading.Lock()
+        self._stamp = None
+        # (tokens, machine id), replaced as a whole so readers never see a mix
+        self._state: Optional[Tuple[Dict[str, Optional[str]], Optional[str]]] = None
+    
+    @property
+    def reader(self) -> CursorAuthReader:
+        if self._reader is None:
+            with self._lock:
+                if self._reader is None:
+                    self._reader = CursorAuthReader()
+        return self._reader
+    
+    def get_auth_tokens(self) -> Dict[str, Optional[str]]:
+        return dict(self._load()[0])
+    
+    def get_bearer_token(self) -> Optional[str]:
+        return self._load()[0].get('access_token')
+    
+    def get_machine_id(self) -> Optional[str]:
+        return self._load()[1]
+    
+    def load(self, force: bool = False):
+        """Read the credentials now if the storage changed (or always with force)"""
+        reader = self.reader
+        with self._lock:
+            stamp = self._file_stamp(reader.storage_path)
+            if force or self._state is None or stamp != self._stamp:
+                self._state = (reader.get_auth_tokens(), reader.read_machine_id())
+                self._stamp = stamp
+    
+    async def refresh(self):
+        """Re-read the credentials without blocking the event loop"""
+        await asyncio.get_running_loop().run_in_executor(None, self.load, True)
+    
+    def _load(self) -> Tuple[Dict[str, Optional[str]], Optional[str]]:
+        self.load()
+        return self._state
+    
+    @staticmethod
+    def _file_stamp(path: Optional[Path]) -> tuple:
+        if not path:
+            return ()
+        stamp = []
+        for candidate in (path, path.with_name(path.name + '-wal')):
+            try:
+                st = os.stat(candidate)
+                stamp.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                stamp.append(None)
+        return tuple(stamp)
+
+
+# Shared by the clients unless they are given their own provider
+DEFAULT_CREDENTIALS = CredentialProvider()
+
+
 def main():
     """Main function to demonstrate usage"""
     reader = CursorAuthReader()
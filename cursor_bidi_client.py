@@ -19,8 +19,6 @@ Related analysis documents:
 import asyncio
 import ssl
 import socket
-import struct
-import json
 import uuid
 import hashlib
 import time
@@ -33,8 +31,10 @@ import h2.connection
 import h2.events
 import h2.config
 
-from cursor_auth_reader import CursorAuthReader
-from cursor_chat_proto import ProtobufEncoder, ProtobufDecoder, ToolCallDecoder
+from cursor_auth_reader import DEFAULT_CREDENTIALS
+from cursor_chat_proto import ProtobufDecoder, ToolCallDecoder, ToolCallAssembler
+from cursor_compression import DEFAULT_POLICY, FLAG_COMPRESSED, iter_frames
+from cursor_headers import CONFIG_VERSION, HeaderTemplate
 
 
 # Import from agent client
@@ -81,17 +81,62 @@ class CursorBidiClient:
         ClientSideToolV2.GLOB_FILE_SEARCH,
     ]
     
-    def __init__(self, workspace_root: str = "."):
+    # Tool names and the tools that wait for their arguments, shared with
+    # the httpx agent loops
+    TOOL_NAMES = CursorAgentClient.TOOL_NAMES
+    TOOLS_NEEDING_PARAMS = CursorAgentClient.TOOLS_NEEDING_PARAMS
+    
+    # Decides which request bodies and tool results are gzipped (cursor_compression.py)
+    compression = DEFAULT_POLICY
+    
+    # Token and machine id, shared per process and re-read when state.vscdb
+    # changes (cursor_auth_reader.py)
+    credentials = DEFAULT_CREDENTIALS
+    
+    # HTTP/2 request headers; {uuid} is new per request (cursor_headers.py)
+    HEADERS = HeaderTemplate({
+        ":method": "POST",
+        ":path": "/aiserver.v1.ChatService/StreamUnifiedChatWithTools",
+        ":authority": "{authority}",
+        ":scheme": "https",
+        "authorization": "Bearer {auth_token}",
+        "connect-accept-encoding": "gzip",
+        "connect-protocol-version": "1",
+        "content-type": "application/connect+proto",
+        "user-agent": "connect-es/1.6.1",
+        "x-amzn-trace-id": "Root={uuid}",
+        "x-client-key": "{client_key}",
+        "x-cursor-checksum": "{cursor_checksum}",
+        "x-cursor-client-version": "2.3.41",
+        "x-cursor-client-type": "ide",
+        "x-cursor-client-os": "linux",
+        "x-cursor-client-arch": "x64",
+        "x-cursor-client-device-type": "desktop",
+        "x-cursor-config-version": CONFIG_VERSION,
+        "x-cursor-timezone": "Europe/Copenhagen",
+        "x-ghost-mode": "true",
+        "x-request-id": "{uuid}",
+        "x-session-id": "{session_id}",
+    })
+    
+    @property
+    def auth_reader(self):
+        return self.credentials.reader
+    
+    @property
+    def token(self) -> Optional[str]:
+        """Bearer token, re-read when state.vscdb changes"""
+        return self.credentials.get_bearer_token()
+    
+    @property
+    def machine_id(self) -> Optional[str]:
+        return self.credentials.get_machine_id()
+    
+    def __init__(self, workspace_root: str = ".", probe_tool_calls: bool = False):
         self.workspace_root = Path(workspace_root).resolve()
-        self.auth_reader = CursorAuthReader()
-        self.token = self.auth_reader.get_bearer_token()
-        
-        # Get machine ID from storage
-        try:
-            storage_data = self.auth_reader.read_sqlite_storage()
-            self.machine_id = storage_data.get('storage.serviceMachineId')
-        except:
-            self.machine_id = None
+        # Diagnostic: probe every nested field for tool calls instead of
+        # following client_side_tool_v2_call (slow on large frames)
+        self.probe_tool_calls = probe_tool_calls
         
         self.tool_executor = ToolExecutor(str(self.workspace_root))
         
@@ -123,60 +168,36 @@ class CursorBidiClient:
         checksum = self.generate_cursor_checksum(auth_token)
         
         # Match the headers from the working httpx client exactly
-        return [
-            (":method", "POST"),
-            (":path", "/aiserver.v1.ChatService/StreamUnifiedChatWithTools"),
-            (":authority", self.BASE_URL),
-            (":scheme", "https"),
-            ("authorization", f"Bearer {auth_token}"),
-            ("connect-accept-encoding", "gzip"),
-            ("connect-protocol-version", "1"),
-            ("content-type", "application/connect+proto"),
-            ("user-agent", "connect-es/1.6.1"),
-            ("x-amzn-trace-id", f"Root={uuid.uuid4()}"),
-            ("x-client-key", client_key),
-            ("x-cursor-checksum", checksum),
-            ("x-cursor-client-version", "2.3.41"),
-            ("x-cursor-client-type", "ide"),
-            ("x-cursor-client-os", "linux"),
-            ("x-cursor-client-arch", "x64"),
-            ("x-cursor-client-device-type", "desktop"),
-            ("x-cursor-config-version", str(uuid.uuid4())),
-            ("x-cursor-timezone", "Europe/Copenhagen"),
-            ("x-ghost-mode", "true"),
-            ("x-request-id", str(uuid.uuid4())),
-            ("x-session-id", session_id),
-        ]
+        return list(self.HEADERS.headers(
+            authority=self.BASE_URL, auth_token=auth_token, client_key=client_key,
+            cursor_checksum=checksum, session_id=session_id,
+        ).items())
     
-    def frame_message(self, data: bytes, compress: bool = False) -> bytes:
-        """Frame a message with ConnectRPC envelope"""
-        flags = 0x01 if compress else 0x00
-        length = len(data)
-        return struct.pack('>BI', flags, length) + data
+    def frame_message(self, data: bytes, compress: Optional[bool] = None) -> bytes:
+        """Frame a message with ConnectRPC envelope
+        
+        Compressed as self.compression decides unless compress is given.
+        """
+        return self.compression.frame(data, compress)
     
     def parse_frames(self, data: bytes) -> List[Tuple[bool, bytes]]:
         """Parse ConnectRPC framed messages from data"""
-        frames = []
-        offset = 0
-        while offset + 5 <= len(data):
-            flags = data[offset]
-            length = struct.unpack('>I', data[offset+1:offset+5])[0]
-            if offset + 5 + length > len(data):
-                break
-            payload = data[offset+5:offset+5+length]
-            compressed = bool(flags & 0x01)
-            frames.append((compressed, payload))
-            offset += 5 + length
-        return frames
+        return [
+            (bool(flags & FLAG_COMPRESSED), data[start:end])
+            for flags, start, end in iter_frames(data)
+        ]
+    
+    def _message_payloads(self, data: bytes) -> List[bytes]:
+        """Protobuf payloads of the complete frames in data (end-of-stream JSON skipped)"""
+        return ToolCallDecoder.message_payloads(data)[0]
     
     def encode_agent_request(self, messages: List[Dict], model: str) -> bytes:
         """Encode the initial agent request using agent client's encoding
         
         Note: This returns FRAMED data (magic byte + length + payload)
         """
-        # Use the proven encoding from CursorAgentClient
-        # generate_request_body already includes framing
-        return self._encoder.generate_request_body(messages, model)
+        # Use the proven encoding from CursorAgentClient, framed under our policy
+        return self.frame_message(self._encoder.encode_stream_unified_chat_request(messages, model))
     
     def encode_tool_result(self, tool: int, tool_call_id: str, result: ToolResult) -> bytes:
         """Encode ClientSideToolV2Result using agent client's encoding"""
@@ -185,11 +206,12 @@ class CursorBidiClient:
     
     def encode_tool_result_message(self, tool: int, tool_call_id: str, result: ToolResult) -> bytes:
         """Encode StreamUnifiedChatRequestWithTools containing tool result"""
-        msg = b''
         # Field 2: client_side_tool_v2_result
-        result_bytes = self.encode_tool_result(tool, tool_call_id, result)
-        msg += ProtobufEncoder.encode_field(2, 2, result_bytes)
-        return msg
+        return self._encoder.encode_tool_result_request(tool, tool_call_id, result)
+    
+    def _to_tool_call(self, tc: Dict) -> ToolCall:
+        """Build a ToolCall from a decoded ClientSideToolV2Call dict"""
+        return ToolCall.from_decoded(tc, self.TOOL_NAMES)
     
     def parse_tool_call(self, data: bytes) -> Optional[ToolCall]:
         """Parse tool call from response data using protobuf decoding
@@ -200,148 +222,25 @@ class CursorBidiClient:
         - name = field 9 (string)
         - raw_args = field 10 (string, JSON)
         """
-        # Tool enum to name mapping (from TASK-110-tool-enum-mapping.md)
-        enum_to_name = {
-            ClientSideToolV2.LIST_DIR: 'list_dir',
-            ClientSideToolV2.READ_FILE: 'read_file',
-            ClientSideToolV2.EDIT_FILE: 'edit_file',
-            ClientSideToolV2.DELETE_FILE: 'delete_file',
-            ClientSideToolV2.FILE_SEARCH: 'file_search',
-            ClientSideToolV2.GLOB_FILE_SEARCH: 'glob_file_search',
-            ClientSideToolV2.RIPGREP_SEARCH: 'grep_search',
-            ClientSideToolV2.SEMANTIC_SEARCH_FULL: 'codebase_search',
-            ClientSideToolV2.SEARCH_SYMBOLS: 'search_symbols',
-            ClientSideToolV2.DEEP_SEARCH: 'deep_search',
-            ClientSideToolV2.RUN_TERMINAL_COMMAND_V2: 'run_terminal_cmd',
-            ClientSideToolV2.WEB_SEARCH: 'web_search',
-            ClientSideToolV2.FETCH_RULES: 'fetch_rules',
-            ClientSideToolV2.FETCH_PULL_REQUEST: 'fetch_pull_request',
-            ClientSideToolV2.MCP: 'mcp',
-            ClientSideToolV2.CALL_MCP_TOOL: 'call_mcp_tool',
-            ClientSideToolV2.LIST_MCP_RESOURCES: 'list_mcp_resources',
-            ClientSideToolV2.READ_MCP_RESOURCE: 'read_mcp_resource',
-            ClientSideToolV2.TASK: 'task',
-            ClientSideToolV2.AWAIT_TASK: 'await_task',
-            ClientSideToolV2.TODO_READ: 'todo_read',
-            ClientSideToolV2.TODO_WRITE: 'todo_write',
-            ClientSideToolV2.CREATE_PLAN: 'create_plan',
-            ClientSideToolV2.REAPPLY: 'reapply',
-            ClientSideToolV2.GO_TO_DEFINITION: 'go_to_definition',
-            ClientSideToolV2.CREATE_DIAGRAM: 'create_diagram',
-            ClientSideToolV2.FIX_LINTS: 'fix_lints',
-            ClientSideToolV2.READ_LINTS: 'read_lints',
-            ClientSideToolV2.ASK_QUESTION: 'ask_question',
-            ClientSideToolV2.SWITCH_MODE: 'switch_mode',
-            ClientSideToolV2.GENERATE_IMAGE: 'generate_image',
-            ClientSideToolV2.COMPUTER_USE: 'computer_use',
-            ClientSideToolV2.LIST_DIR_V2: 'list_dir_v2',
-            ClientSideToolV2.READ_FILE_V2: 'read_file_v2',
-            ClientSideToolV2.EDIT_FILE_V2: 'edit_file_v2',
-        }
-        
-        # Tools that require params before execution
-        tools_needing_params = {
-            ClientSideToolV2.FILE_SEARCH, ClientSideToolV2.RIPGREP_SEARCH,
-            ClientSideToolV2.READ_FILE, ClientSideToolV2.EDIT_FILE,
-            ClientSideToolV2.RUN_TERMINAL_COMMAND_V2, ClientSideToolV2.GLOB_FILE_SEARCH,
-            ClientSideToolV2.WEB_SEARCH, ClientSideToolV2.SEMANTIC_SEARCH_FULL,
-            ClientSideToolV2.DEEP_SEARCH, ClientSideToolV2.SEARCH_SYMBOLS,
-            ClientSideToolV2.DELETE_FILE, ClientSideToolV2.TODO_WRITE,
-            ClientSideToolV2.CREATE_PLAN, ClientSideToolV2.CALL_MCP_TOOL,
-        }
-        
-        try:
-            # Try protobuf decoding first
-            tool_calls = ToolCallDecoder.find_tool_calls(data)
-            for tc in tool_calls:
-                tool_enum = tc['tool']
-                tool_call_id = tc['tool_call_id']
-                raw_args = tc['raw_args']
-                name = tc['name'] or enum_to_name.get(tool_enum, f'tool_{tool_enum}')
-                
-                # Parse JSON params from raw_args
-                params = {}
-                if raw_args:
-                    try:
-                        params = json.loads(raw_args)
-                    except:
-                        pass
-                
-                # Check if this tool needs params
-                if tool_enum in tools_needing_params and not params:
-                    continue  # Skip until params arrive
-                
-                return ToolCall(
-                    tool=tool_enum,
-                    tool_call_id=tool_call_id,
-                    name=name,
-                    raw_args=raw_args,
-                    params=params
-                )
-            
-            # Fallback: regex-based detection for tool call IDs in text
-            # This catches cases where protobuf nesting is different
-            import re
-            text = data.decode('utf-8', errors='ignore')
-            
-            # Look for tool call ID pattern
-            tool_id_match = re.search(r'(toolu_bdrk_[a-zA-Z0-9]{24,28})', text)
-            if not tool_id_match:
-                return None
-            
-            tool_call_id = tool_id_match.group(1)
-            
-            # Look for raw_args JSON that contains known param keys
-            raw_args_match = re.search(
-                r'\{[^{}]*"(command|relative_workspace_path|query|pattern|search_term|directory_path)"[^{}]+\}',
-                text, re.IGNORECASE
-            )
-            
-            if not raw_args_match:
-                return None  # No params yet
-            
-            raw_args = raw_args_match.group()
-            try:
-                params = json.loads(raw_args)
-            except:
-                return None
-            
-            # Infer tool type from params
-            tool_enum = ClientSideToolV2.UNSPECIFIED
-            name = 'unknown'
-            
-            if 'command' in params:
-                tool_enum = ClientSideToolV2.RUN_TERMINAL_COMMAND_V2
-                name = 'run_terminal_cmd'
-            elif 'relative_workspace_path' in params and 'old_string' in params:
-                tool_enum = ClientSideToolV2.EDIT_FILE
-                name = 'edit_file'
-            elif 'relative_workspace_path' in params or 'directory_path' in params:
-                tool_enum = ClientSideToolV2.LIST_DIR
-                name = 'list_dir'
-            elif 'query' in params:
-                tool_enum = ClientSideToolV2.FILE_SEARCH
-                name = 'file_search'
-            elif 'pattern' in params:
-                tool_enum = ClientSideToolV2.RIPGREP_SEARCH
-                name = 'grep_search'
-            elif 'search_term' in params:
-                tool_enum = ClientSideToolV2.WEB_SEARCH
-                name = 'web_search'
-            
-            if tool_enum == ClientSideToolV2.UNSPECIFIED:
-                return None
+        # Follow the known field path in each frame, or probe the raw body
+        # when diagnosing an unknown layout
+        if self.probe_tool_calls:
+            tool_calls = ToolCallDecoder.probe_tool_calls(data)
+        else:
+            tool_calls = [
+                tc for payload in self._message_payloads(data)
+                for tc in ToolCallDecoder.find_tool_calls(payload)
+            ]
+        for tc in tool_calls:
+            tool_call = self._to_tool_call(tc)
             
-            return ToolCall(
-                tool=tool_enum,
-                tool_call_id=tool_call_id,
-                name=name,
-                raw_args=raw_args,
-                params=params
-            )
+            # Check if this tool needs params
+            if tool_call.tool in self.TOOLS_NEEDING_PARAMS and not tool_call.params:
+                continue  # Skip until params arrive
             
-        except Exception as e:
-            return None
+            return tool_call
+        
+        return None
     
     def connect(self) -> bool:
         """Establish TLS connection and HTTP/2 handshake"""
@@ -505,8 +404,9 @@ class CursorBidiClient:
             
             # Main loop
             full_response = ""
-            tool_calls_seen = set()
             tool_calls_executed = 0
+            # Tool calls are run once their streamed parts are complete
+            assembler = ToolCallAssembler(self.TOOLS_NEEDING_PARAMS, probe=self.probe_tool_calls)
             last_activity = time.time()
             timeout = 60.0
             
@@ -536,10 +436,9 @@ class CursorBidiClient:
                         except:
                             pass
                         
-                        # Check for tool calls
-                        tool_call = self.parse_tool_call(data)
-                        if tool_call and tool_call.tool_call_id not in tool_calls_seen:
-                            tool_calls_seen.add(tool_call.tool_call_id)
+                        # Check for completed tool calls
+                        for tc in assembler.feed(data):
+                            tool_call = self._to_tool_call(tc)
                             
                             if tool_calls_executed < max_tool_calls:
                                 if verbose:
@@ -562,9 +461,6 @@ class CursorBidiClient:
                                 if verbose:
                                     print(f"[Sending tool result ({len(framed_result)} bytes)]")
                                 
-                                # Small delay to let server finish sending tool call details
-                                time.sleep(0.2)
-                                
                                 self.send_data(stream_id, framed_result)
                                 
                                 if verbose:
@@ -574,6 +470,8 @@ class CursorBidiClient:
                     if state.ended:
                         if verbose:
                             print("\n[Stream ended]")
+                        # Calls cut off by the end of the stream are reported, not run
+                        self._encoder._report_incomplete(assembler)
                         break
             
             print()
@@ -593,6 +491,7 @@ async def main():
     model = "claude-4-sonnet"
     prompt = "List the files in the current directory"
     verbose = False
+    probe_tool_calls = False
     
     args = sys.argv[1:]
     i = 0
@@ -603,10 +502,14 @@ async def main():
         elif args[i] == '-v':
             verbose = True
             i += 1
+        elif args[i] == '--probe-tool-calls':
+            probe_tool_calls = True
+            i += 1
         elif args[i] == '--help':
-            print("Usage: cursor_bidi_client.py [-m model] [-v] [prompt]")
+            print("Usage: cursor_bidi_client.py [-m model] [-v] [--probe-tool-calls] [prompt]")
             print("  -m model   Model to use (default: claude-4-sonnet)")
             print("  -v         Verbose output")
+            print("  --probe-tool-calls  Search every nested field for tool calls (diagnostic)")
             print("  prompt     The prompt to send")
             print()
             print("This client uses true HTTP/2 bidirectional streaming")
@@ -616,7 +519,7 @@ async def main():
             prompt = args[i]
             i += 1
     
-    client = CursorBidiClient(workspace_root=".")
+    client = CursorBidiClient(workspace_root=".", probe_tool_calls=probe_tool_calls)
     result = client.run_agent(prompt, model=model, verbose=verbose)
     
     if not result:
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Offline decoder for archived Cursor ConnectRPC stream captures.
+
+The capture is memory-mapped and its frame envelopes
+([type:1][len:4BE][payload]) are walked once to cut it into batches of
+whole frames. Batches are decoded in a process pool, each worker mapping the
+file itself, and results are written as JSON lines in capture order. Only a
+bounded number of batches is in flight at a time, so memory use does not
+grow with the capture size.
+
+Usage: cursor_capture_decoder.py capture.bin [-j workers] [-o out.jsonl]
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, TextIO, Tuple
+
+# Batches are cut at whichever limit is reached first
+BATCH_BYTES = 4 * 1024 * 1024
+BATCH_FRAMES = 4096
+
+
+def iter_batches(data, batch_bytes: int = BATCH_BYTES,
+                 batch_frames: int = BATCH_FRAMES) -> Iterator[Tuple[int, int]]:
+    """
+    Walk the frame headers once and yield (start, end) byte ranges, each
+    holding only whole frames. A truncated trailing frame is reported on
+    stderr and left out.
+    """
+    size = len(data)
+    offset = 0
+    batch_start = 0
+    frames = 0
+
+    while offset + 5 <= size:
+        msg_len = struct.unpack_from('>I', data, offset + 1)[0]
+        frame_end = offset + 5 + msg_len
+        if frame_end > size:
+            break
+        offset = frame_end
+        frames += 1
+        if frames >= batch_frames or offset - batch_start >= batch_bytes:
+            yield batch_start, offset
+            batch_start = offset
+            frames = 0
+
+    if offset > batch_start:
+        yield batch_start, offset
+    if offset < size:
+        print(f"Ignoring {size - offset} trailing bytes of a truncated frame at offset {offset}",
+              file=sys.stderr)
+
+
+def decode_batch(path: str, start: int, end: int) -> List[str]:
+    """Decode the frames in data[start:end] of a capture file into JSON lines"""
+    # Imported here so the protobuf classes load once per worker process
+    from cursor_streaming_decoder import CursorStreamDecoder
+
+    decoder = CursorStreamDecoder()
+    lines = []
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        view = memoryview(mm)
+        try:
+            offset = start
+            while offset < end:
+                msg_type = mm[offset]
+                msg_len = struct.unpack_from('>I', mm, offset + 1)[0]
+                payload = view[offset + 5:offset + 5 + msg_len]
+                try:
+                    message = decoder.decode_frame(msg_type, payload)
+                finally:
+                    payload.release()
+                if message:
+                    lines.append(json.dumps({
+                        'offset': offset,
+                        'frame_type': msg_type,
+                        'type': message.msg_type,
+                        'content': message.content,
+                    }))
+                offset += 5 + msg_len
+        finally:
+            view.release()
+        release_pages(mm, start, end)
+    return lines
+
+
+def release_pages(mm: mmap.mmap, start: int, end: int):
+    """Drop the mapped pages of data[start:end] so a long pass keeps a flat RSS"""
+    if not hasattr(mmap, 'MADV_DONTNEED'):
+        return  # Not available on this platform; the OS reclaims pages lazily
+    start -= start % mmap.PAGESIZE
+    if end > start:
+        mm.madvise(mmap.MADV_DONTNEED, start, end - start)
+
+
+def decode_capture(path: str, out: TextIO, workers: Optional[int] = None,
+                   max_in_flight: Optional[int] = None) -> int:
+    """
+    Decode a capture file into JSON lines on out, in capture order.
+    Returns the number of lines written.
+    """
+    if os.path.getsize(path) == 0:
+        return 0
+
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = max_in_flight or workers * 2
+    written = 0
+
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for start, end in iter_batches(mm):
+                release_pages(mm, start, end)
+                pending.append(pool.submit(decode_batch, path, start, end))
+                if len(pending) >= max_in_flight:
+                    written += _write_lines(pending.popleft().result(), out)
+            while pending:
+                written += _write_lines(pending.popleft().result(), out)
+
+    return written
+
+
+def _write_lines(lines: List[str], out: TextIO) -> int:
+    for line in lines:
+        out.write(line)
+        out.write('\n')
+    return len(lines)
+
+
+def main():
+    args = sys.argv[1:]
+    workers = None
+    output = None
+    path = None
+
+    i = 0
+    while i < len(args):
+        if args[i] == '-j' and i + 1 < len(args):
+            workers = int(args[i + 1])
+            i += 2
+        elif args[i] == '-o' and i + 1 < len(args):
+            output = args[i + 1]
+            i += 2
+        elif args[i] == '--help':
+            print("Usage: cursor_capture_decoder.py capture.bin [-j workers] [-o out.jsonl]")
+            print("  -j workers  Decoder processes (default: CPU count)")
+            print("  -o file     Write JSON lines to file (default: stdout)")
+            return
+        else:
+            path = args[i]
+            i += 1
+
+    if not path:
+        print("Usage: cursor_capture_decoder.py capture.bin [-j workers] [-o out.jsonl]",
+              file=sys.stderr)
+        sys.exit(1)
+
+    if output:
+        with open(output, 'w', encoding='utf-8') as out:
+            count = decode_capture(path, out, workers)
+    else:
+        count = decode_capture(path, sys.stdout, workers)
+    print(f"Decoded {count} messages", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
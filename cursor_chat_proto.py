@@ -16,9 +16,14 @@ Wire format reference:
 - Wire type 5: 32-bit (fixed32, sfixed32, float)
 """
 
+import json
 import struct
 import uuid
-from typing import Dict, List, Tuple, Any, Optional
+from typing import Dict, Iterable, List, Tuple, Any, Optional, Union
+
+from cursor_compression import (
+    FLAG_COMPRESSED, FLAG_END_STREAM, INFLATE_ERRORS, GzipFrameInflater, iter_frames,
+)
 
 
 class ProtobufDecoder:
@@ -83,6 +88,11 @@ class ProtobufDecoder:
             fields[field_num].append((wire_type, value))
         return fields
     
+    @staticmethod
+    def view(data: Union[bytes, bytearray, memoryview]) -> 'MessageView':
+        """Lazy, zero-copy alternative to decode_message; see MessageView"""
+        return MessageView(data)
+    
     @staticmethod
     def get_string(fields: Dict, field_num: int) -> Optional[str]:
         """Extract string field value"""
@@ -114,6 +124,146 @@ class ProtobufDecoder:
         return None
 
 
+class MessageView:
+    """Lazy, zero-copy view of an encoded protobuf message
+    
+    Wraps a memoryview and walks the wire format only when a field is asked
+    for, stopping at the first match. Nothing is sliced or copied while
+    walking: length-delimited values come back as memoryview slices of the
+    original buffer, and nested messages are only parsed when a view of
+    them is used, so probing several nesting levels of a large payload
+    allocates nothing in proportion to its size.
+    
+        view = MessageView(payload)
+        call = view.get_message(1)
+        if call is not None:
+            tool_call_id = call.get_string(3)
+    
+    Parsing follows ProtobufDecoder.decode_message: a truncated
+    length-delimited value is clipped at the end of the buffer, groups
+    (wire types 3 and 4) are skipped, and a truncated fixed-width value
+    raises ValueError when the walk reaches it.
+    """
+    
+    __slots__ = ('data', '_fields')
+    
+    def __init__(self, data: Union[bytes, bytearray, memoryview]):
+        self.data = data if isinstance(data, memoryview) else memoryview(data)
+        self._fields = None
+    
+    def scan(self):
+        """Yield (field_num, wire_type, start_or_value, end) for each field
+        
+        For varints the third item is the value itself, otherwise it is the
+        offset of the value within data.
+        """
+        data = self.data
+        end = len(data)
+        pos = 0
+        while pos < end:
+            tag = data[pos]
+            pos += 1
+            if tag & 0x80:
+                tag &= 0x7F
+                shift = 7
+                while pos < end:
+                    b = data[pos]
+                    pos += 1
+                    tag |= (b & 0x7F) << shift
+                    if not b & 0x80:
+                        break
+                    shift += 7
+            wire_type = tag & 0x07
+            if wire_type == 0 or wire_type == 2:
+                value = 0
+                shift = 0
+                while pos < end:
+                    b = data[pos]
+                    pos += 1
+                    value |= (b & 0x7F) << shift
+                    if not b & 0x80:
+                        break
+                    shift += 7
+                if wire_type == 0:
+                    yield tag >> 3, 0, value, pos
+                else:
+                    start = pos
+                    pos = min(pos + value, end)
+                    yield tag >> 3, 2, start, pos
+            elif wire_type == 1 or wire_type == 5:
+                start = pos
+                pos += 8 if wire_type == 1 else 4
+                if pos > end:
+                    raise ValueError("truncated fixed-width field")
+                yield tag >> 3, wire_type, start, pos
+    
+    @property
+    def fields(self) -> Dict[int, List[Tuple[int, int, int]]]:
+        """field_num -> [(wire_type, start_or_value, end)], indexed on first access"""
+        if self._fields is None:
+            fields = {}
+            for field_num, wire_type, start, end in self.scan():
+                fields.setdefault(field_num, []).append((wire_type, start, end))
+            self._fields = fields
+        return self._fields
+    
+    def _find(self, field_num: int, wire_type: int):
+        """(start_or_value, end) of the first field_num value with wire_type, or None"""
+        if self._fields is not None:
+            for entry_type, start, end in self._fields.get(field_num, ()):
+                if entry_type == wire_type:
+                    return start, end
+            return None
+        for num, entry_type, start, end in self.scan():
+            if num == field_num and entry_type == wire_type:
+                return start, end
+        return None
+    
+    def __contains__(self, field_num: int) -> bool:
+        return field_num in self.fields
+    
+    def __iter__(self):
+        """Yield (field_num, wire_type, value) with int or memoryview values"""
+        data = self.data
+        for field_num, wire_type, start, end in self.scan():
+            yield field_num, wire_type, start if wire_type == 0 else data[start:end]
+    
+    def get_int(self, field_num: int) -> Optional[int]:
+        """First varint value of a field"""
+        found = self._find(field_num, 0)
+        return found[0] if found else None
+    
+    def get_bytes(self, field_num: int) -> Optional[memoryview]:
+        """First length-delimited value of a field, as a view into data"""
+        found = self._find(field_num, 2)
+        return self.data[found[0]:found[1]] if found else None
+    
+    def get_string(self, field_num: int) -> Optional[str]:
+        """First length-delimited value of a field that is valid UTF-8"""
+        entries = self.fields.get(field_num, ()) if self._fields is not None else (
+            (wire_type, start, end) for num, wire_type, start, end in self.scan()
+            if num == field_num)
+        for wire_type, start, end in entries:
+            if wire_type == 2:
+                try:
+                    return str(self.data[start:end], 'utf-8')
+                except UnicodeDecodeError:
+                    pass
+        return None
+    
+    def get_message(self, field_num: int) -> Optional['MessageView']:
+        """Lazy view of the first length-delimited value of a field"""
+        value = self.get_bytes(field_num)
+        return MessageView(value) if value is not None else None
+    
+    def messages(self, min_size: int = 0):
+        """Yield (field_num, view) for every length-delimited field longer than min_size"""
+        data = self.data
+        for field_num, wire_type, start, end in self.scan():
+            if wire_type == 2 and end - start > min_size:
+                yield field_num, MessageView(data[start:end])
+
+
 class ToolCallDecoder:
     """Decode ClientSideToolV2Call messages from stream
     
@@ -127,11 +277,16 @@ class ToolCallDecoder:
     }
     """
     
+    # StreamUnifiedChatResponseWithTools.client_side_tool_v2_call
+    FIELD_RESPONSE_TOOL_CALL = 1
+    
     # Field numbers from TASK-26-tool-schemas.md
     FIELD_TOOL = 1
     FIELD_TOOL_CALL_ID = 3
     FIELD_NAME = 9
     FIELD_RAW_ARGS = 10
+    FIELD_IS_STREAMING = 14
+    FIELD_IS_LAST_MESSAGE = 15
     
     @staticmethod
     def parse_frame(data: bytes) -> Tuple[Optional[bytes], bytes]:
@@ -151,96 +306,451 @@ class ToolCallDecoder:
         return payload, remaining
     
     @staticmethod
-    def find_tool_calls(data: bytes) -> List[Dict]:
-        """Find tool calls in protobuf data by looking for known field patterns
+    def message_payloads(data: Union[bytes, bytearray],
+                         inflater: Optional[GzipFrameInflater] = None) -> Tuple[List[bytes], int]:
+        """Protobuf payloads of the complete frames at the start of data
+        
+        End-of-stream (JSON) frames are skipped and gzip frames inflated
+        through inflater (bounded by its max_size); frames that are corrupt,
+        truncated or too large once inflated are dropped. Returns (payloads,
+        bytes_consumed); a trailing partial frame is left for the caller to
+        complete.
+        """
+        if inflater is None:
+            inflater = GzipFrameInflater()
+        payloads = []
+        consumed = 0
+        for flags, start, end in iter_frames(data):
+            consumed = end
+            if flags & FLAG_END_STREAM:
+                continue
+            payload = bytes(data[start:end])
+            if flags & FLAG_COMPRESSED:
+                try:
+                    payload = inflater.inflate(payload)
+                except INFLATE_ERRORS:
+                    continue
+            payloads.append(payload)
+        return payloads, consumed
+    
+    @staticmethod
+    def find_tool_calls(data: Union[bytes, memoryview], probe: bool = False) -> List[Dict]:
+        """Extract tool calls from a StreamUnifiedChatResponseWithTools payload
+        
+        Follows the known path, client_side_tool_v2_call = 1, so the cost does
+        not depend on how much text or how many other fields the frame holds.
+        With probe=True, falls back to probe_tool_calls() (diagnostics only).
         
         Returns list of dicts with: tool, tool_call_id, name, raw_args
         """
-        tool_calls = []
+        if probe:
+            return ToolCallDecoder.probe_tool_calls(data)
         
-        # Try to decode as protobuf
         try:
-            fields = ProtobufDecoder.decode_message(data)
-        except:
+            call = MessageView(data).get_message(ToolCallDecoder.FIELD_RESPONSE_TOOL_CALL)
+            tool_call = ToolCallDecoder._extract_tool_call(call) if call is not None else None
+        except ValueError:
             return []
+        return [tool_call] if tool_call else []
+    
+    @staticmethod
+    def probe_tool_calls(data: Union[bytes, memoryview]) -> List[Dict]:
+        """Find tool calls by trying every length-delimited field, two levels deep
         
-        # Look for nested messages that might contain tool calls
-        # The response is a StreamUnifiedChatResponse which contains
-        # various nested messages including tool calls
+        Diagnostic mode for payloads whose layout is unknown (for example when
+        the server moves tool calls to a new field). Every field longer than
+        10 bytes is parsed as a candidate ClientSideToolV2Call, so the cost
+        grows with the payload size.
+        """
+        tool_calls = []
+        
+        # Views share the payload buffer, so probing nested levels copies nothing
+        try:
+            candidates = list(MessageView(data).messages(min_size=10))
+        except ValueError:
+            return []
         
         # Try each length-delimited field as a potential tool call container
-        for field_num, values in fields.items():
-            for wire_type, value in values:
-                if wire_type == 2 and isinstance(value, bytes) and len(value) > 10:
-                    # Try to decode as nested message
-                    try:
-                        nested = ProtobufDecoder.decode_message(value)
-                        tool_call = ToolCallDecoder._extract_tool_call(nested)
-                        if tool_call:
-                            tool_calls.append(tool_call)
-                        
-                        # Also check nested messages within
-                        for nf, nv in nested.items():
-                            for nwt, nval in nv:
-                                if nwt == 2 and isinstance(nval, bytes) and len(nval) > 10:
-                                    try:
-                                        deep = ProtobufDecoder.decode_message(nval)
-                                        tool_call = ToolCallDecoder._extract_tool_call(deep)
-                                        if tool_call:
-                                            tool_calls.append(tool_call)
-                                    except:
-                                        pass
-                    except:
-                        pass
+        for _, nested in candidates:
+            try:
+                tool_call = ToolCallDecoder._extract_tool_call(nested)
+                deep_candidates = list(nested.messages(min_size=10))
+            except ValueError:
+                continue
+            if tool_call:
+                tool_calls.append(tool_call)
+            
+            # Also check nested messages within
+            for _, deep in deep_candidates:
+                try:
+                    tool_call = ToolCallDecoder._extract_tool_call(deep)
+                except ValueError:
+                    continue
+                if tool_call:
+                    tool_calls.append(tool_call)
         
         return tool_calls
     
     @staticmethod
-    def _extract_tool_call(fields: Dict) -> Optional[Dict]:
-        """Extract tool call from decoded fields"""
-        tool = ProtobufDecoder.get_int(fields, ToolCallDecoder.FIELD_TOOL)
-        tool_call_id = ProtobufDecoder.get_string(fields, ToolCallDecoder.FIELD_TOOL_CALL_ID)
-        name = ProtobufDecoder.get_string(fields, ToolCallDecoder.FIELD_NAME)
-        raw_args = ProtobufDecoder.get_string(fields, ToolCallDecoder.FIELD_RAW_ARGS)
+    def _extract_tool_call(view: MessageView) -> Optional[Dict]:
+        """Extract tool call from a message view"""
+        tool = view.get_int(ToolCallDecoder.FIELD_TOOL)
+        if tool is None or tool <= 0:
+            return None
+        tool_call_id = view.get_string(ToolCallDecoder.FIELD_TOOL_CALL_ID)
         
         # Valid tool call needs at least tool enum and tool_call_id
-        if tool is not None and tool > 0 and tool_call_id:
+        if tool_call_id:
             return {
                 'tool': tool,
                 'tool_call_id': tool_call_id,
-                'name': name or '',
-                'raw_args': raw_args or '',
+                'name': view.get_string(ToolCallDecoder.FIELD_NAME) or '',
+                'raw_args': view.get_string(ToolCallDecoder.FIELD_RAW_ARGS) or '',
             }
         return None
 
 
+class ToolCallAssembler:
+    """Assemble streamed ClientSideToolV2Call parts into completed calls
+    
+    The server may send one tool call as several frames sharing a
+    tool_call_id, first without arguments or with is_streaming set and
+    raw_args arriving in pieces (TASK-81-tool-batching.md). feed() takes raw
+    response body chunks, which may split frames anywhere, merges the parts
+    by tool_call_id and returns each call exactly once, when it is final:
+    
+    - a streaming call once its is_last_message part arrives
+    - any other call once raw_args holds complete JSON or a part carries
+      is_last_message; with no raw_args at all only for tools that take no
+      arguments (not in needs_args)
+    
+    Calls that never become final are not run; finish() hands them over for
+    reporting once the stream has ended.
+    
+    raw_args of streaming parts are appended, unless a part repeats the
+    arguments received so far, in which case it replaces them.
+    
+        assembler = ToolCallAssembler(needs_args={ClientSideToolV2.READ_FILE})
+        for chunk in body_chunks:
+            for call in assembler.feed(chunk):
+                run(call)  # dict with tool, tool_call_id, name, raw_args
+        for call in assembler.finish():
+            log_incomplete(call)  # arguments missing or cut short
+    
+    With probe=True parts are found with ToolCallDecoder.probe_tool_calls()
+    and treated as non-streaming (diagnostics only). Gzip frames are inflated
+    up to max_decompressed_size; bad ones are dropped rather than raised.
+    """
+    
+    __slots__ = ('needs_args', 'probe', 'inflater', '_buffer', '_pending', '_completed')
+    
+    def __init__(self, needs_args: Iterable[int] = (), probe: bool = False,
+                 max_decompressed_size: int = GzipFrameInflater.MAX_SIZE):
+        self.needs_args = frozenset(needs_args)
+        self.probe = probe
+        self.inflater = GzipFrameInflater(max_decompressed_size)
+        self._buffer = bytearray()
+        # tool_call_id -> [call dict, is_streaming]
+        self._pending: Dict[str, list] = {}
+        self._completed = set()
+    
+    @property
+    def pending(self) -> List[Dict]:
+        """Calls seen but not yet final"""
+        return [call for call, _ in self._pending.values()]
+    
+    def feed(self, data: Union[bytes, bytearray, memoryview]) -> List[Dict]:
+        """Add response body bytes, return the calls completed by them"""
+        self._buffer += data
+        payloads, consumed = ToolCallDecoder.message_payloads(self._buffer, self.inflater)
+        del self._buffer[:consumed]
+        
+        completed = []
+        for payload in payloads:
+            for part in self._parts(payload):
+                call = self._merge(*part)
+                if call is not None:
+                    completed.append(call)
+        return completed
+    
+    def _parts(self, payload: bytes) -> List[Tuple[int, str, str, str, bool, bool]]:
+        """(tool, tool_call_id, name, raw_args, is_streaming, is_last_message)
+        of the tool call parts in one frame payload"""
+        if self.probe:
+            return [
+                (tc['tool'], tc['tool_call_id'], tc['name'], tc['raw_args'], False, False)
+                for tc in ToolCallDecoder.probe_tool_calls(payload)
+            ]
+        
+        try:
+            view = MessageView(payload).get_message(ToolCallDecoder.FIELD_RESPONSE_TOOL_CALL)
+            if view is None:
+                return []
+            # Follow-up parts of a streaming call may carry only the id
+            tool_call_id = view.get_string(ToolCallDecoder.FIELD_TOOL_CALL_ID)
+            if not tool_call_id:
+                return []
+            return [(
+                view.get_int(ToolCallDecoder.FIELD_TOOL) or 0,
+                tool_call_id,
+                view.get_string(ToolCallDecoder.FIELD_NAME) or '',
+                view.get_string(ToolCallDecoder.FIELD_RAW_ARGS) or '',
+                bool(view.get_int(ToolCallDecoder.FIELD_IS_STREAMING)),
+                bool(view.get_int(ToolCallDecoder.FIELD_IS_LAST_MESSAGE)),
+            )]
+        except ValueError:
+            return []
+    
+    def _merge(self, tool: int, tool_call_id: str, name: str, raw_args: str,
+               is_streaming: bool, is_last_message: bool) -> Optional[Dict]:
+        """Fold one part into its pending call, return the call once final"""
+        if tool_call_id in self._completed:
+            return None
+        
+        entry = self._pending.get(tool_call_id)
+        if entry is None:
+            entry = self._pending[tool_call_id] = [
+                {'tool': 0, 'tool_call_id': tool_call_id, 'name': '', 'raw_args': ''}, False,
+            ]
+        call = entry[0]
+        entry[1] = entry[1] or is_streaming
+        
+        if tool > 0:
+            call['tool'] = tool
+        if name:
+            call['name'] = name
+        if raw_args:
+            if entry[1] and not raw_args.startswith(call['raw_args']):
+                call['raw_args'] += raw_args
+            else:
+                call['raw_args'] = raw_args
+        
+        if call['tool'] <= 0:
+            return None
+        if entry[1] or is_last_message:
+            final = is_last_message
+        elif call['raw_args']:
+            final = self._is_json(call['raw_args'])
+        else:
+            final = call['tool'] not in self.needs_args
+        if not final:
+            return None
+        
+        return self._complete(tool_call_id)
+    
+    def finish(self) -> List[Dict]:
+        """The calls still pending when the stream ended, which never became final
+        
+        Their raw_args are missing or incomplete, so they must not be run.
+        The assembler is left empty.
+        """
+        incomplete = [call for call, _ in self._pending.values()]
+        self._completed.update(self._pending)
+        self._pending.clear()
+        return incomplete
+    
+    def _complete(self, tool_call_id: str) -> Dict:
+        call, _ = self._pending.pop(tool_call_id)
+        self._completed.add(tool_call_id)
+        return call
+    
+    @staticmethod
+    def _is_json(raw_args: str) -> bool:
+        if not raw_args:
+            return False
+        try:
+            json.loads(raw_args)
+        except ValueError:
+            return False
+        return True
+
+
+# Varints below 16384 take at most two bytes and cover most tags, lengths,
+# enum values and line numbers we encode, so they are encoded once up front
+SMALL_VARINT_LIMIT = 1 << 14
+_SMALL_VARINTS = tuple(
+    bytes((value,)) if value < 0x80 else bytes((value & 0x7F | 0x80, value >> 7))
+    for value in range(SMALL_VARINT_LIMIT)
+)
+
+# Encoded tags for fields numbered 2048 and above, keyed by (field_num, wire_type)
+_LARGE_TAGS: Dict[Tuple[int, int], bytes] = {}
+
+
+def encode_tag(field_num: int, wire_type: int) -> bytes:
+    """Encoded tag bytes for (field_num, wire_type), cached after first use"""
+    tag = (field_num << 3) | wire_type
+    if tag < SMALL_VARINT_LIMIT:
+        return _SMALL_VARINTS[tag]
+    cached = _LARGE_TAGS.get((field_num, wire_type))
+    if cached is None:
+        w = ProtobufWriter()
+        w.write_varint(tag)
+        cached = _LARGE_TAGS[(field_num, wire_type)] = w.getvalue()
+    return cached
+
+
+class ProtobufWriter:
+    """Append-only protobuf writer over a single bytearray
+    
+    Fields are appended in place, so building a message costs time linear in
+    its size instead of re-copying an immutable bytes object on every field.
+    Nested messages are written in place too: message() reserves one length
+    byte and backpatches it when the sub-message is closed, only shifting the
+    body when its length needs a longer varint.
+    
+        w = ProtobufWriter()
+        w.write_string(1, "hello")
+        with w.message(2):
+            w.write_varint_field(1, 42)
+        data = w.getvalue()
+    """
+    
+    __slots__ = ('buf',)
+    
+    def __init__(self):
+        self.buf = bytearray()
+    
+    def __len__(self) -> int:
+        return len(self.buf)
+    
+    def getvalue(self) -> bytes:
+        return bytes(self.buf)
+    
+    def write_varint(self, value: int):
+        """Append a bare varint (negative values use 64-bit two's complement)"""
+        buf = self.buf
+        if value >= 0:
+            if value < 0x80:
+                buf.append(value)
+                return
+            if value < SMALL_VARINT_LIMIT:
+                buf += _SMALL_VARINTS[value]
+                return
+        else:
+            value += 1 << 64
+        while value >= 0x80:
+            buf.append(value & 0x7F | 0x80)
+            value >>= 7
+        buf.append(value)
+    
+    def write_tag(self, field_num: int, wire_type: int):
+        self.buf += encode_tag(field_num, wire_type)
+    
+    def write_varint_field(self, field_num: int, value: int):
+        """Wire type 0: int32, int64, uint32, uint64, bool, enum"""
+        self.buf += encode_tag(field_num, 0)
+        self.write_varint(value)
+    
+    def write_enum_field(self, field_num: int, value: int):
+        """Wire type 0 enum; values below 128 are a single appended byte"""
+        buf = self.buf
+        buf += encode_tag(field_num, 0)
+        if 0 <= value < 0x80:
+            buf.append(value)
+        else:
+            self.write_varint(value)
+    
+    def write_bool_field(self, field_num: int, value: bool):
+        """Wire type 0 bool, always a single byte after the tag"""
+        buf = self.buf
+        buf += encode_tag(field_num, 0)
+        buf.append(1 if value else 0)
+    
+    def write_bytes_field(self, field_num: int, value: Union[bytes, bytearray, memoryview, str]):
+        """Wire type 2: string, bytes or an already encoded sub-message"""
+        if isinstance(value, str):
+            value = value.encode('utf-8')
+        buf = self.buf
+        buf += encode_tag(field_num, 2)
+        length = len(value)
+        if length < 0x80:
+            buf.append(length)
+        else:
+            self.write_varint(length)
+        buf += value
+    
+    write_string = write_bytes_field
+    
+    def write_fixed64_field(self, field_num: int, value: int):
+        """Wire type 1: fixed64, sfixed64"""
+        self.buf += encode_tag(field_num, 1)
+        self.buf += struct.pack('<Q', value)
+    
+    def write_field(self, field_num: int, wire_type: int, value):
+        """Append a field, same semantics as ProtobufEncoder.encode_field"""
+        if wire_type == 0:
+            self.write_varint_field(field_num, value)
+        elif wire_type == 2:
+            self.write_bytes_field(field_num, value)
+        elif wire_type == 1:
+            self.write_fixed64_field(field_num, value)
+        else:
+            self.write_tag(field_num, wire_type)
+    
+    def begin_message(self, field_num: int) -> int:
+        """Open a nested message field; pass the result to end_message()"""
+        self.buf += encode_tag(field_num, 2)
+        self.buf.append(0)  # Length placeholder, patched by end_message
+        return len(self.buf)
+    
+    def end_message(self, start: int):
+        """Close a nested message opened at start and backpatch its length"""
+        buf = self.buf
+        length = len(buf) - start
+        if length < 0x80:
+            buf[start - 1] = length
+            return
+        if length < SMALL_VARINT_LIMIT:
+            buf[start - 1:start] = _SMALL_VARINTS[length]
+            return
+        prefix = bytearray()
+        while length >= 0x80:
+            prefix.append(length & 0x7F | 0x80)
+            length >>= 7
+        prefix.append(length)
+        buf[start - 1:start] = prefix  # Shift the body once, by the extra length bytes
+    
+    def message(self, field_num: int) -> '_NestedMessage':
+        """Context manager writing a nested message field in place"""
+        return _NestedMessage(self, field_num)
+
+
+class _NestedMessage:
+    """Context manager returned by ProtobufWriter.message()"""
+    
+    __slots__ = ('writer', 'field_num', 'start')
+    
+    def __init__(self, writer: ProtobufWriter, field_num: int):
+        self.writer = writer
+        self.field_num = field_num
+    
+    def __enter__(self) -> ProtobufWriter:
+        self.start = self.writer.begin_message(self.field_num)
+        return self.writer
+    
+    def __exit__(self, exc_type, exc, tb):
+        self.writer.end_message(self.start)
+
+
 class ProtobufEncoder:
     @staticmethod
     def encode_varint(value):
         """Encode an integer as a varint"""
-        result = b''
-        while value >= 0x80:
-            result += bytes([value & 0x7F | 0x80])
-            value >>= 7
-        result += bytes([value & 0x7F])
-        return result
+        if 0 <= value < SMALL_VARINT_LIMIT:
+            return _SMALL_VARINTS[value]
+        w = ProtobufWriter()
+        w.write_varint(value)
+        return w.getvalue()
     
     @staticmethod
     def encode_field(field_num, wire_type, value):
         """Encode a protobuf field"""
-        tag = (field_num << 3) | wire_type
-        result = ProtobufEncoder.encode_varint(tag)
-        
-        if wire_type == 0:  # Varint
-            result += ProtobufEncoder.encode_varint(value)
-        elif wire_type == 2:  # Length-delimited
-            if isinstance(value, str):
-                value = value.encode('utf-8')
-            result += ProtobufEncoder.encode_varint(len(value)) + value
-        elif wire_type == 1:  # Fixed64
-            result += struct.pack('<Q', value)
-            
-        return result
+        if wire_type == 0 and 0 <= value < SMALL_VARINT_LIMIT:
+            return encode_tag(field_num, 0) + _SMALL_VARINTS[value]
+        w = ProtobufWriter()
+        w.write_field(field_num, wire_type, value)
+        return w.getvalue()
 
 class CursorChatMessage:
     """
@@ -265,14 +775,14 @@ class CursorChatMessage:
         int32 role = 2;
         string message_id = 13;
         """
+        from cursor_schema import encode
+        return encode('ConversationMessage', CursorChatMessage._user_message_value(content, role, message_id))
+    
+    @staticmethod
+    def _user_message_value(content, role=1, message_id=None):
         if not message_id:
             message_id = str(uuid.uuid4())
-            
-        msg = b''
-        msg += ProtobufEncoder.encode_field(1, 2, content)  # content (string)
-        msg += ProtobufEncoder.encode_field(2, 0, role)     # role (int32) - 1=user, 2=assistant
-        msg += ProtobufEncoder.encode_field(13, 2, message_id)  # message_id (string)
-        return msg
+        return {'content': content, 'role': role, 'message_id': message_id}
     
     @staticmethod
     def create_instructions(instruction):
@@ -282,7 +792,8 @@ class CursorChatMessage:
         """
         if not instruction:
             return b''
-        return ProtobufEncoder.encode_field(1, 2, instruction)
+        from cursor_schema import encode
+        return encode('Instruction', {'instruction': instruction})
     
     @staticmethod
     def create_model(name, empty=""):
@@ -291,11 +802,8 @@ class CursorChatMessage:
         string name = 1;
         string empty = 4;
         """
-        msg = b''
-        msg += ProtobufEncoder.encode_field(1, 2, name)
-        if empty:
-            msg += ProtobufEncoder.encode_field(4, 2, empty)
-        return msg
+        from cursor_schema import encode
+        return encode('Model', {'name': name, 'empty': empty or None})
     
     @staticmethod
     def create_chat_message(messages, model="claude-3.5-sonnet", instructions=None, 
@@ -304,51 +812,32 @@ class CursorChatMessage:
         """
         Create complete ChatMessage
         """
+        from cursor_schema import encode
+        
         if not request_id:
             request_id = str(uuid.uuid4())
         if not conversation_id:
             conversation_id = str(uuid.uuid4())
-            
-        chat_msg = b''
-        
-        # Field 2: repeated UserMessage messages
-        for msg in messages:
-            if isinstance(msg, dict):
-                # Create UserMessage from dict
-                user_msg = CursorChatMessage.create_user_message(
-                    msg.get('content', ''),
-                    1 if msg.get('role', 'user') == 'user' else 2,
-                    msg.get('message_id')
-                )
-                chat_msg += ProtobufEncoder.encode_field(2, 2, user_msg)
-            else:
-                # Assume it's already encoded
-                chat_msg += ProtobufEncoder.encode_field(2, 2, msg)
-        
-        # Field 4: Instructions (optional)
-        if instructions:
-            instr_msg = CursorChatMessage.create_instructions(instructions)
-            chat_msg += ProtobufEncoder.encode_field(4, 2, instr_msg)
-        
-        # Field 5: projectPath (string)
-        if project_path:
-            chat_msg += ProtobufEncoder.encode_field(5, 2, project_path)
-        
-        # Field 7: Model
-        model_msg = CursorChatMessage.create_model(model)
-        chat_msg += ProtobufEncoder.encode_field(7, 2, model_msg)
-        
-        # Field 9: requestId (string)
-        chat_msg += ProtobufEncoder.encode_field(9, 2, request_id)
-        
-        # Field 11: summary (string)
-        if summary:
-            chat_msg += ProtobufEncoder.encode_field(11, 2, summary)
         
-        # Field 15: conversationId (string)
-        chat_msg += ProtobufEncoder.encode_field(15, 2, conversation_id)
+        # Field 2: repeated UserMessage messages, dicts or already encoded bytes
+        user_messages = [
+            CursorChatMessage._user_message_value(
+                msg.get('content', ''),
+                1 if msg.get('role', 'user') == 'user' else 2,
+                msg.get('message_id')
+            ) if isinstance(msg, dict) else msg
+            for msg in messages
+        ]
         
-        return chat_msg
+        return encode('ChatMessage', {
+            'messages': user_messages,
+            'instructions': {'instruction': instructions} if instructions else None,
+            'project_path': project_path or None,
+            'model': {'name': model},
+            'request_id': request_id,
+            'summary': summary or None,
+            'conversation_id': conversation_id,
+        })
     
     @staticmethod
     def create_simple_chat_request(prompt, model="claude-3.5-sonnet"):
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Compression policy for outgoing ConnectRPC messages.
+
+Request bodies and tool-result frames share one envelope,
+[flags:1][len:4BE][payload], where flags bit 0 marks a gzip payload (see
+TASK-43-sse-poll-fallback.md). Whether to set it used to depend on the
+message count; CompressionPolicy decides from the payload itself:
+
+- payloads under min_size bytes are sent as is; gzip framing alone costs
+  about 20 bytes and the round trip through zlib is not worth it
+- larger payloads are compressed at level and only sent compressed when that
+  saves at least min_gain of their size
+- payloads over sample_size are first tried on a sample_size prefix, so
+  incompressible data (already compressed files, base64 images) is skipped
+  without paying for compressing all of it
+
+Every decision is counted in CompressionStats, including the time spent
+compressing and the bytes it saved.
+
+    policy = CompressionPolicy(level=6, min_size=1024, min_gain=0.1)
+    body = policy.frame(payload)
+    print(policy.stats.to_json())
+
+The receiving side lives here too, so every reader of response bodies walks
+envelopes with iter_frames() and inflates gzip frames through a bounded
+GzipFrameInflater without importing the protobuf classes.
+"""
+
+import gzip
+import json
+import struct
+import time
+import zlib
+from typing import Iterator, Optional, Tuple, Union
+
+_HEADER = struct.Struct('>BI')
+
+FLAG_COMPRESSED = 0x01
+FLAG_END_STREAM = 0x02
+
+# What GzipFrameInflater.inflate() raises on a corrupt, truncated or oversized frame
+INFLATE_ERRORS = (zlib.error, EOFError, ValueError)
+
+
+def iter_frames(data: Union[bytes, bytearray, memoryview], offset: int = 0) -> Iterator[Tuple[int, int, int]]:
+    """(flags, payload_start, payload_end) of each complete frame from offset on
+    
+    Stops at a trailing partial frame; the last payload_end is the number of
+    bytes consumed.
+    """
+    size = len(data)
+    while offset + 5 <= size:
+        flags, length = _HEADER.unpack_from(data, offset)
+        end = offset + 5 + length
+        if end > size:
+            return
+        yield flags, offset + 5, end
+        offset = end
+
+
+class GzipFrameInflater:
+    """
+    Per-stream inflater for gzip-compressed frames (types 1 and 3).
+    
+    Decompresses through zlib directly instead of gzip.decompress, in output
+    chunks of at most CHUNK_SIZE bytes, and refuses frames that inflate past
+    max_size so a single oversized or malicious frame cannot exhaust memory.
+    Python's zlib has no inflateReset, so each gzip member gets a fresh
+    decompressobj; that is as cheap as copying a primed one.
+    """
+    
+    # Upper bound on decompressor output per step
+    CHUNK_SIZE = 64 * 1024
+    
+    # Default limit on the decompressed size of a single frame
+    MAX_SIZE = 32 * 1024 * 1024
+    
+    def __init__(self, max_size: int = MAX_SIZE):
+        self.max_size = max_size
+    
+    def inflate(self, data: Union[bytes, memoryview]) -> bytes:
+        """Decompress one frame payload, raising one of INFLATE_ERRORS on bad input
+        
+        ValueError past max_size, zlib.error on a corrupt body, EOFError on a
+        truncated one.
+        """
+        decompressor = zlib.decompressobj(wbits=31)  # gzip header and trailer
+        chunks = []
+        total = 0
+        pending = data
+        
+        while True:
+            chunk = decompressor.decompress(pending, self.CHUNK_SIZE)
+            total += len(chunk)
+            if total > self.max_size:
+                raise ValueError(f"decompressed frame exceeds {self.max_size} bytes")
+            chunks.append(chunk)
+            
+            if decompressor.eof:
+                # Concatenated gzip members decode back to back, as in gzip.decompress
+                pending = decompressor.unused_data
+                if not pending:
+                    break
+                decompressor = zlib.decompressobj(wbits=31)
+            else:
+                pending = decompressor.unconsumed_tail
+                if not pending and not chunk:
+                    raise EOFError("compressed frame ended before the end-of-stream marker")
+        
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+
+class CompressionStats:
+    """
+    Counters for the decisions of a CompressionPolicy.
+    
+    time_spent covers every zlib call, including sampled and discarded
+    attempts, so it can be set against bytes_saved to judge the settings.
+    """
+    
+    __slots__ = ('messages', 'compressed', 'skipped_small', 'skipped_ratio',
+                 'skipped_forced', 'bytes_in', 'bytes_out', 'time_spent')
+    
+    def __init__(self):
+        self.messages = 0         # Payloads seen
+        self.compressed = 0       # Payloads sent compressed
+        self.skipped_small = 0    # Sent as is: under min_size
+        self.skipped_ratio = 0    # Sent as is: compressing saved less than min_gain
+        self.skipped_forced = 0   # Sent as is: the caller passed force=False
+        self.bytes_in = 0         # Payload bytes before compression
+        self.bytes_out = 0        # Payload bytes as sent
+        self.time_spent = 0.0     # Seconds spent in gzip
+    
+    @property
+    def bytes_saved(self) -> int:
+        return self.bytes_in - self.bytes_out
+    
+    def snapshot(self) -> dict:
+        """Current values as a plain dict"""
+        return {
+            'messages': self.messages,
+            'compressed': self.compressed,
+            'skipped_small': self.skipped_small,
+            'skipped_ratio': self.skipped_ratio,
+            'skipped_forced': self.skipped_forced,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'bytes_saved': self.bytes_saved,
+            'time_spent': self.time_spent,
+        }
+    
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot())
+
+
+class CompressionPolicy:
+    """Decide per message whether to gzip it, see the module docstring"""
+    
+    LEVEL = 6
+    MIN_SIZE = 1024
+    MIN_GAIN = 0.1
+    SAMPLE_SIZE = 256 * 1024
+    
+    def __init__(self, level: int = LEVEL, min_size: int = MIN_SIZE,
+                 min_gain: float = MIN_GAIN, sample_size: int = SAMPLE_SIZE):
+        self.level = level
+        self.min_size = min_size
+        self.min_gain = min_gain
+        self.sample_size = sample_size
+        self.stats = CompressionStats()
+    
+    def compress(self, data: bytes, force: Optional[bool] = None) -> Tuple[bool, bytes]:
+        """Return (compressed, payload) for data
+        
+        force=True or False bypasses the policy and always or never compresses.
+        """
+        stats = self.stats
+        size = len(data)
+        stats.messages += 1
+        stats.bytes_in += size
+        
+        if force is False:
+            stats.skipped_forced += 1
+        elif force is None and size < self.min_size:
+            stats.skipped_small += 1
+            force = False
+        if force is False:
+            stats.bytes_out += size
+            return False, data
+        
+        start = time.perf_counter()
+        payload = None
+        if force is None and size > self.sample_size:
+            sample = gzip.compress(data[:self.sample_size], compresslevel=self.level)
+            if not self._worth_it(len(sample), self.sample_size):
+                payload = data
+        if payload is None:
+            payload = gzip.compress(data, compresslevel=self.level)
+            if force is None and not self._worth_it(len(payload), size):
+                payload = data
+        stats.time_spent += time.perf_counter() - start
+        
+        if payload is data:
+            stats.skipped_ratio += 1
+            stats.bytes_out += size
+            return False, data
+        stats.compressed += 1
+        stats.bytes_out += len(payload)
+        return True, payload
+    
+    def frame(self, data: bytes, compress: Optional[bool] = None) -> bytes:
+        """ConnectRPC envelope for data; compress=True/False overrides the policy"""
+        compressed, payload = self.compress(data, compress)
+        return _HEADER.pack(FLAG_COMPRESSED if compressed else 0, len(payload)) + payload
+    
+    def _worth_it(self, compressed_size: int, size: int) -> bool:
+        return size - compressed_size >= size * self.min_gain
+
+
+# Shared by the clients unless they are given their own policy
+DEFAULT_POLICY = CompressionPolicy()
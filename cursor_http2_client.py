@@ -11,45 +11,122 @@ import uuid
 import hashlib
 import time
 import base64
-from cursor_auth_reader import CursorAuthReader
+import platform
+import sys
+import json
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterable, Optional, TextIO, Tuple
+from cursor_headers import HeaderTemplate
 from cursor_proper_protobuf import CursorProperProtobuf
-from cursor_streaming_decoder import CursorStreamDecoder
+from cursor_session_cache import DEFAULT_SESSION_CACHE
+from cursor_streaming_decoder import CursorStreamDecoder, TextDelta, StreamEnd, StreamError
+
+
+class SessionRejected(RuntimeError):
+    """The server refused the token or session (see AUTH_ERROR_STATUSES/CODES)"""
+
+
+class ServerBusy(RuntimeError):
+    """The server asked us to slow down (see BUSY_STATUSES)"""
+    
+    def __init__(self, message: str, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+@dataclass
+class BatchResult:
+    """Outcome of one prompt of ask_batch(); index is its position in the input"""
+    index: int
+    prompt: Optional[str]
+    model: str
+    text: Optional[str] = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+
 
 class CursorHTTP2Client(CursorProperProtobuf):
+    # Remembers established sessions across calls and processes (cursor_session_cache.py)
+    session_cache = DEFAULT_SESSION_CACHE
+    
+    # Responses that mean the session or token was rejected: HTTP statuses and
+    # ConnectRPC error codes in the end-of-stream frame
+    AUTH_ERROR_STATUSES = (401, 403)
+    AUTH_ERROR_CODES = ('unauthenticated', 'permission_denied')
+    
+    # Rate limiting and overload; ask_batch() backs off and retries these
+    BUSY_STATUSES = (429, 503)
+    BATCH_CONCURRENCY = 8
+    BATCH_RETRIES = 3
+    BATCH_BACKOFF = 1.0
+    
+    # x-cursor-client-version must match product.json; {uuid} is new per request
+    SESSION_HEADERS = HeaderTemplate({
+        'accept-encoding': 'gzip',
+        'authorization': 'Bearer {auth_token}',
+        'connect-protocol-version': '1',
+        'content-type': 'application/proto',  # Note: different content-type
+        'user-agent': 'connect-es/1.6.1',
+        'x-amzn-trace-id': 'Root={uuid}',
+        'x-client-key': '{client_key}',
+        'x-cursor-checksum': '{cursor_checksum}',
+        'x-cursor-client-version': '2.3.41',
+        'x-cursor-client-type': 'ide',
+        'x-cursor-client-os': sys.platform,
+        'x-cursor-client-arch': platform.machine(),
+        'x-cursor-client-device-type': 'desktop',
+        'x-cursor-timezone': 'Europe/Copenhagen',
+        'x-ghost-mode': 'true',
+        'x-request-id': '{uuid}',
+        'x-session-id': '{session_id}',
+        'Host': 'api2.cursor.sh',
+    })
+    CHAT_HEADERS = HeaderTemplate({
+        'authorization': 'Bearer {auth_token}',
+        'connect-accept-encoding': 'gzip',
+        'connect-protocol-version': '1',
+        'content-type': 'application/connect+proto',  # ConnectRPC content type
+        'user-agent': 'connect-es/1.6.1',
+        'x-amzn-trace-id': 'Root={uuid}',
+        'x-client-key': '{client_key}',
+        'x-cursor-checksum': '{cursor_checksum}',
+        'x-cursor-client-version': '2.3.41',
+        'x-cursor-client-type': 'ide',
+        'x-cursor-client-os': sys.platform,
+        'x-cursor-client-arch': platform.machine(),
+        'x-cursor-client-device-type': 'desktop',
+        'x-cursor-timezone': 'Europe/Copenhagen',
+        'x-ghost-mode': 'true',
+        'x-request-id': '{uuid}',
+        'x-session-id': '{session_id}',
+        'Host': 'api2.cursor.sh'
+    })
+    
     def __init__(self):
         super().__init__()
     
+    async def ensure_session(self, auth_token, session_id, client_key, cursor_checksum):
+        """Establish the session unless the cache says it already is"""
+        if self.session_cache.get(auth_token, session_id):
+            print("Session: cached")
+            return True
+        if not await self.establish_session_http2(auth_token, session_id, client_key, cursor_checksum):
+            return False
+        self.session_cache.put(auth_token, session_id, {'status': 200})
+        return True
+    
     async def establish_session_http2(self, auth_token, session_id, client_key, cursor_checksum):
         """Call AvailableModels - this works with HTTP/1.1"""
         print("Establishing session (HTTP/1.1)...")
         
-        import platform
-        import sys
-        
         url = f"{self.base_url}/aiserver.v1.AiService/AvailableModels"
-        headers = {
-            'accept-encoding': 'gzip',
-            'authorization': f'Bearer {auth_token}',
-            'connect-protocol-version': '1',
-            'content-type': 'application/proto',  # Note: different content-type
-            'user-agent': 'connect-es/1.6.1',
-            'x-amzn-trace-id': f'Root={uuid.uuid4()}',
-            'x-client-key': client_key,
-            'x-cursor-checksum': cursor_checksum,
-            'x-cursor-client-version': '2.3.41',  # Must match product.json version
-            'x-cursor-client-type': 'ide',
-            'x-cursor-client-os': sys.platform,
-            'x-cursor-client-arch': platform.machine(),
-            'x-cursor-client-device-type': 'desktop',
-            'x-cursor-timezone': 'Europe/Copenhagen',
-            'x-ghost-mode': 'true',
-            'x-request-id': str(uuid.uuid4()),
-            'x-session-id': session_id,
-            'Host': 'api2.cursor.sh',
-        }
+        headers = self.SESSION_HEADERS.headers(
+            auth_token=auth_token, client_key=client_key,
+            cursor_checksum=cursor_checksum, session_id=session_id,
+        )
         
         # Use HTTP/1.1 for AvailableModels (this works)
-        async with httpx.AsyncClient(http2=False, timeout=10.0) as client:
+        async with self.transport.client(http2=False, timeout=10.0) as client:
             response = await client.post(url, headers=headers)
             print(f"Session: {response.status_code}")
             return response.status_code == 200
@@ -58,36 +135,17 @@ class CursorHTTP2Client(CursorProperProtobuf):
         """Send chat using HTTP/2 - THE KEY DIFFERENCE!"""
         print(f"Sending to {model} with HTTP/2...")
         
-        import platform
-        import sys
-        
         cursor_body = self.generate_cursor_body_exact(messages, model)
         print(f"Body size: {len(cursor_body)} bytes")
         
         url = f"{self.base_url}/aiserver.v1.ChatService/StreamUnifiedChatWithTools"
-        headers = {
-            'authorization': f'Bearer {auth_token}',
-            'connect-accept-encoding': 'gzip',
-            'connect-protocol-version': '1',
-            'content-type': 'application/connect+proto',  # ConnectRPC content type
-            'user-agent': 'connect-es/1.6.1',
-            'x-amzn-trace-id': f'Root={uuid.uuid4()}',
-            'x-client-key': client_key,
-            'x-cursor-checksum': cursor_checksum,
-            'x-cursor-client-version': '2.3.41',  # Must match product.json version
-            'x-cursor-client-type': 'ide',
-            'x-cursor-client-os': sys.platform,
-            'x-cursor-client-arch': platform.machine(),
-            'x-cursor-client-device-type': 'desktop',
-            'x-cursor-timezone': 'Europe/Copenhagen',
-            'x-ghost-mode': 'true',
-            'x-request-id': str(uuid.uuid4()),
-            'x-session-id': session_id,
-            'Host': 'api2.cursor.sh'
-        }
+        headers = self.CHAT_HEADERS.headers(
+            auth_token=auth_token, client_key=client_key,
+            cursor_checksum=cursor_checksum, session_id=session_id,
+        )
         
         # Use HTTP/2 instead of HTTP/1.1
-        async with httpx.AsyncClient(http2=True, timeout=30.0) as client:
+        async with self.transport.client(http2=True, timeout=30.0) as client:
             try:
                 print("Using HTTP/2 protocol...")
                 async with client.stream('POST', url, headers=headers, content=cursor_body) as response:
@@ -100,26 +158,18 @@ class CursorHTTP2Client(CursorProperProtobuf):
                         # Use the proper streaming decoder based on Rust cursor-api
                         decoder = CursorStreamDecoder()
                         collected_content = []
-                        chunk_count = 0
                         
-                        async for chunk in response.aiter_bytes():
-                            chunk_count += 1
+                        # Messages arrive as soon as each frame completes; the
+                        # iterator ends on the JSON end-of-stream frame
+                        async for message in decoder.events(response.aiter_bytes()):
+                            print(f"[{message.msg_type.upper()}] {message.content[:100]}{'...' if len(message.content) > 100 else ''}")
                             
-                            # Feed chunk to decoder and get parsed messages
-                            messages = decoder.feed_data(chunk)
-                            for message in messages:
-                                print(f"[{message.msg_type.upper()}] {message.content[:100]}{'...' if len(message.content) > 100 else ''}")
-                                
-                                if message.msg_type == "content":
-                                    collected_content.append(message.content)
-                                elif message.msg_type == "stream_end":
-                                    print("Stream ended")
-                                    break
-                            
-                            # Safety limit
-                            if chunk_count > 100:
-                                print("Warning: stopping after 100 chunks")
-                                break
+                            if isinstance(message, TextDelta):
+                                collected_content.append(message.text)
+                            elif isinstance(message, StreamEnd):
+                                print("Stream ended")
+                            elif isinstance(message, StreamError) and self._is_auth_error(message.error):
+                                self.session_cache.invalidate(auth_token, session_id)
                         
                         if collected_content:
                             result = ''.join(collected_content)
@@ -131,20 +181,144 @@ class CursorHTTP2Client(CursorProperProtobuf):
                     else:
                         error = await response.aread()
                         print(f"Error {response.status_code}: {error.decode('utf-8', errors='ignore')[:200]}")
+                        if response.status_code in self.AUTH_ERROR_STATUSES:
+                            self.session_cache.invalidate(auth_token, session_id)
                         
             except Exception as e:
                 print(f"Exception: {str(e)}")
         
         return None
     
-    async def test_http2_breakthrough(self, prompt="Hello! Please respond with 'Hi from Cursor API!'", model="gpt-4"):
-        """Test the HTTP/2 breakthrough"""
+    def _is_auth_error(self, error):
+        return isinstance(error, dict) and error.get('code') in self.AUTH_ERROR_CODES
+    
+    async def stream_chat(self, messages, model):
+        """Yield response text as it arrives
+        
+        Used by the ask daemon; unlike send_chat_http2 it does not print the
+        response. A session the server rejects before any text
+        arrives is bootstrapped again once with re-read credentials; other
+        failures raise RuntimeError.
+        """
+        for attempt in range(2):
+            try:
+                async for text in self._stream_chat_once(messages, model):
+                    yield text
+                return
+            except SessionRejected:
+                if attempt:
+                    raise
+                await self.credentials.refresh()
+    
+    async def _stream_chat_once(self, messages, model):
         if not self.token:
-            print("Error: No token")
-            return None
+            raise RuntimeError("No token")
+        auth_token, session_id, client_key, cursor_checksum = self.session_params(self.token)
+        if not await self.ensure_session(auth_token, session_id, client_key, cursor_checksum):
+            raise RuntimeError("Session failed")
+        
+        cursor_body = self.generate_cursor_body_exact(messages, model)
+        url = f"{self.base_url}/aiserver.v1.ChatService/StreamUnifiedChatWithTools"
+        headers = self.CHAT_HEADERS.headers(
+            auth_token=auth_token, client_key=client_key,
+            cursor_checksum=cursor_checksum, session_id=session_id,
+        )
         
+        async with self.transport.client(http2=True, timeout=30.0) as client:
+            async with client.stream('POST', url, headers=headers, content=cursor_body) as response:
+                if response.status_code != 200:
+                    error = (await response.aread()).decode('utf-8', errors='ignore')[:200]
+                    if response.status_code in self.AUTH_ERROR_STATUSES:
+                        self.session_cache.invalidate(auth_token, session_id)
+                        raise SessionRejected(f"Error {response.status_code}: {error}")
+                    if response.status_code in self.BUSY_STATUSES:
+                        raise ServerBusy(f"Error {response.status_code}: {error}",
+                                         _retry_after(response.headers.get('retry-after')))
+                    raise RuntimeError(f"Error {response.status_code}: {error}")
+                
+                sent_text = False
+                async for message in CursorStreamDecoder().events(response.aiter_bytes()):
+                    if isinstance(message, TextDelta):
+                        sent_text = True
+                        yield message.text
+                    elif isinstance(message, StreamError):
+                        if self._is_auth_error(message.error):
+                            self.session_cache.invalidate(auth_token, session_id)
+                            if not sent_text:
+                                raise SessionRejected(message.content)
+                        raise RuntimeError(message.content)
+    
+    async def ask_batch(self, prompts: Iterable[Tuple[str, str]],
+                        concurrency: int = BATCH_CONCURRENCY) -> AsyncIterator[BatchResult]:
+        """Run (prompt, model) pairs concurrently and yield results as they complete
+        
+        At most concurrency requests are in flight; they share the pooled
+        HTTP/2 connections as multiplexed streams. prompts is consumed lazily.
+        Responses with BUSY_STATUSES are retried BATCH_RETRIES times with
+        exponential backoff (or the server's Retry-After). Failures become
+        BatchResult.error instead of ending the batch.
+        """
+        # Bootstrap the session once instead of in every worker
+        if self.token:
+            await self.ensure_session(*self.session_params(self.token))
+        
+        pairs = enumerate(prompts)
+        results = asyncio.Queue()
+        
+        async def worker():
+            for index, (prompt, model) in pairs:
+                await results.put(await self._batch_one(index, prompt, model))
+        
+        workers = [asyncio.ensure_future(worker()) for _ in range(max(1, concurrency))]
+        running = asyncio.ensure_future(asyncio.gather(*workers))
+        try:
+            while True:
+                get = asyncio.ensure_future(results.get())
+                await asyncio.wait([get, running], return_when=asyncio.FIRST_COMPLETED)
+                if get.done():
+                    yield get.result()
+                    continue
+                get.cancel()
+                running.result()  # Re-raise a worker failure
+                while not results.empty():
+                    yield results.get_nowait()
+                return
+        finally:
+            for task in workers:
+                task.cancel()
+    
+    async def _batch_one(self, index, prompt, model) -> BatchResult:
+        result = BatchResult(index, prompt, model)
+        if not isinstance(prompt, str) or not prompt:
+            result.error = "no prompt"
+            return result
+        
+        start = time.perf_counter()
+        delay = self.BATCH_BACKOFF
+        for attempt in range(self.BATCH_RETRIES + 1):
+            try:
+                parts = []
+                async for text in self.stream_chat([{"role": "user", "content": prompt}], model):
+                    parts.append(text)
+                result.text = ''.join(parts)
+                result.error = None
+                break
+            except ServerBusy as e:
+                result.error = str(e)
+                if attempt == self.BATCH_RETRIES:
+                    break
+                await asyncio.sleep(e.retry_after if e.retry_after is not None else delay)
+                delay *= 2
+            except Exception as e:
+                result.error = str(e) or type(e).__name__
+                break
+        result.elapsed = time.perf_counter() - start
+        return result
+    
+    def session_params(self, token):
+        """(auth_token, session_id, client_key, cursor_checksum) for a stored token"""
         # Process auth token
-        auth_token = self.token
+        auth_token = token
         if '::' in auth_token:
             auth_token = auth_token.split('::')[1]
         
@@ -152,6 +326,15 @@ class CursorHTTP2Client(CursorProperProtobuf):
         session_id = self.generate_session_id(auth_token)
         client_key = self.generate_hashed_64_hex(auth_token)
         cursor_checksum = self.generate_cursor_checksum(auth_token)
+        return auth_token, session_id, client_key, cursor_checksum
+    
+    async def test_http2_breakthrough(self, prompt="Hello! Please respond with 'Hi from Cursor API!'", model="gpt-4"):
+        """Test the HTTP/2 breakthrough"""
+        if not self.token:
+            print("Error: No token")
+            return None
+        
+        auth_token, session_id, client_key, cursor_checksum = self.session_params(self.token)
         
         print(f"HTTP/2 Test")
         print(f"HTTP 464 = Incompatible Protocol = Need HTTP/2!")
@@ -160,8 +343,9 @@ class CursorHTTP2Client(CursorProperProtobuf):
         print(f"Model: {model}")
         print(f"Prompt: {prompt}")
         
-        # Step 1: Establish session with HTTP/1.1 (works)
-        session_ok = await self.establish_session_http2(auth_token, session_id, client_key, cursor_checksum)
+        # Step 1: Establish session with HTTP/1.1 (works), unless it is cached
+        was_cached = self.session_cache.get(auth_token, session_id) is not None
+        session_ok = await self.ensure_session(auth_token, session_id, client_key, cursor_checksum)
         if not session_ok:
             print("Error: Session failed")
             return None
@@ -172,4 +356,76 @@ class CursorHTTP2Client(CursorProperProtobuf):
             messages, model, auth_token, session_id, client_key, cursor_checksum
         )
         
+        # A cached session the server rejected was invalidated; re-read the
+        # token in case Cursor refreshed it, bootstrap again and retry once
+        if result is None and was_cached and not self.session_cache.get(auth_token, session_id):
+            await self.credentials.refresh()
+            if not self.token:
+                return None
+            auth_token, session_id, client_key, cursor_checksum = self.session_params(self.token)
+            if await self.ensure_session(auth_token, session_id, client_key, cursor_checksum):
+                result = await self.send_chat_http2(
+                    messages, model, auth_token, session_id, client_key, cursor_checksum
+                )
+        
         return result
+
+
+def _retry_after(value: Optional[str]) -> Optional[float]:
+    """Seconds from a Retry-After header; HTTP dates are ignored"""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+async def run_batch_file(client: CursorHTTP2Client, lines: Iterable[str], output: TextIO,
+                         model: str = "gpt-4", order: str = "input",
+                         concurrency: int = CursorHTTP2Client.BATCH_CONCURRENCY) -> int:
+    """`ask --batch`: JSON-lines prompts in, JSON-lines results out
+    
+    Input lines are {"prompt": ..., "model": optional, "id": optional}. Each
+    output line carries index (input line number among non-blank lines), id,
+    model and either response or error. order="input" keeps input order,
+    order="completion" writes each result as soon as it is done. Returns the
+    number of failed prompts.
+    """
+    if order not in ("input", "completion"):
+        raise ValueError(f"order must be 'input' or 'completion', not {order!r}")
+    ids = []
+    
+    def pairs():
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                item = json.loads(line)
+                if not isinstance(item, dict):
+                    raise ValueError("not an object")
+            except ValueError:
+                item = {}
+            ids.append(item.get('id'))
+            yield item.get('prompt'), item.get('model') or model
+    
+    def write(result: BatchResult):
+        record = {'index': result.index, 'id': ids[result.index], 'model': result.model}
+        if result.error is None:
+            record['response'] = result.text
+        else:
+            record['error'] = result.error
+        output.write(json.dumps(record, ensure_ascii=False) + "\n")
+        output.flush()
+    
+    failed = 0
+    pending = {}
+    next_index = 0
+    async for result in client.ask_batch(pairs(), concurrency):
+        failed += result.error is not None
+        if order == "completion":
+            write(result)
+            continue
+        pending[result.index] = result
+        while next_index in pending:
+            write(pending.pop(next_index))
+            next_index += 1
+    return failed
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Codec backend that runs cursor_schema messages through protobuf message classes.
+
+The cursor-grpc protos only cover the response side under the names we
+decode, so the classes are generated from cursor_schema.SCHEMAS instead: a
+FileDescriptorProto is built from the schemas and loaded into a private
+descriptor pool, the way a generated *_pb2 module loads its classes.
+Serialization then runs in the installed protobuf runtime, the upb C
+extension for protobuf >= 4.21.
+
+Messages are declared proto2 so fields set to 0, "" or False are still
+written, as the compiled Python encoders write them; repeated numeric fields
+carry [packed = true] to match. The generated classes
+always serialize in field-number order. Messages whose schema lists fields in
+that order (all of the request side) come out byte-identical to the Python
+backend. ClientSideToolV2Call, ClientSideToolV2Result and ITextSearchMatch
+hold the same fields in a different order.
+
+    codec = Pb2Codec()
+    body = codec.encode('StreamUnifiedChatRequestWithTools', {'request': {...}})
+"""
+
+from typing import Any, Dict, List, Tuple, Union
+
+from google.protobuf import descriptor_pb2, descriptor_pool, message, message_factory
+from google.protobuf.internal import api_implementation
+
+from cursor_chat_proto import ProtobufWriter
+from cursor_schema import SCALAR_TYPES, SCHEMAS, EncodedFields, Field
+
+PACKAGE = 'cursor_schema'
+
+_FieldProto = descriptor_pb2.FieldDescriptorProto
+_FIELD_TYPES = {
+    'int32': _FieldProto.TYPE_INT32,
+    'enum': _FieldProto.TYPE_INT32,     # Same wire format, accepts any value
+    'int64': _FieldProto.TYPE_INT64,
+    'uint32': _FieldProto.TYPE_UINT32,
+    'uint64': _FieldProto.TYPE_UINT64,
+    'bool': _FieldProto.TYPE_BOOL,
+    'double': _FieldProto.TYPE_DOUBLE,
+    'string': _FieldProto.TYPE_STRING,
+    'bytes': _FieldProto.TYPE_BYTES,
+}
+
+# Per-field fill plan: (name, default, is_message, repeated, type)
+_Plan = List[Tuple[str, Any, bool, bool, str]]
+
+
+def build_file(schemas: Dict[str, List[Field]]) -> descriptor_pb2.FileDescriptorProto:
+    """proto2 file descriptor declaring every schema message"""
+    file_proto = descriptor_pb2.FileDescriptorProto(
+        name=f'{PACKAGE}.proto', package=PACKAGE, syntax='proto2',
+    )
+    for name, fields in schemas.items():
+        message_proto = file_proto.message_type.add(name=name)
+        for field in fields:
+            field_proto = message_proto.field.add(
+                name=field.name,
+                number=field.number,
+                label=_FieldProto.LABEL_REPEATED if field.repeated else _FieldProto.LABEL_OPTIONAL,
+            )
+            if field.type in SCALAR_TYPES:
+                field_proto.type = _FIELD_TYPES[field.type]
+                if field.is_packed:
+                    field_proto.options.packed = True
+            else:
+                field_proto.type = _FieldProto.TYPE_MESSAGE
+                field_proto.type_name = f'.{PACKAGE}.{field.type}'
+    return file_proto
+
+
+def message_classes(schemas: Dict[str, List[Field]]) -> Dict[str, type]:
+    """Generated message classes for schemas, keyed by message name"""
+    pool = descriptor_pool.DescriptorPool()
+    pool.Add(build_file(schemas))
+    return {
+        name: message_factory.GetMessageClass(pool.FindMessageTypeByName(f'{PACKAGE}.{name}'))
+        for name in schemas
+    }
+
+
+class Pb2Codec:
+    """encode()/decode() of cursor_schema with generated message classes"""
+    
+    runtime = api_implementation.Type()
+    
+    def __init__(self, schemas: Dict[str, List[Field]] = SCHEMAS):
+        self.classes = message_classes(schemas)
+        self._plans: Dict[str, _Plan] = {
+            name: [
+                (f.name, f.default, f.type not in SCALAR_TYPES, f.repeated, f.type)
+                for f in fields
+            ]
+            for name, fields in schemas.items()
+        }
+    
+    def encode(self, message_name: str, value: Dict[str, Any]) -> bytes:
+        """Encode value as the named message"""
+        msg = self.classes[message_name]()
+        self._fill(msg, message_name, value)
+        return msg.SerializeToString()
+    
+    def encode_into(self, w: ProtobufWriter, message_name: str, value: Dict[str, Any]):
+        """Append value encoded as the named message to a ProtobufWriter"""
+        w.buf += self.encode(message_name, value)
+    
+    def decode(self, message_name: str, data: Union[bytes, bytearray, memoryview]) -> Dict[str, Any]:
+        """Decode data as the named message; raises ValueError on malformed input"""
+        try:
+            msg = self.classes[message_name].FromString(bytes(data))
+        except message.DecodeError as e:
+            raise ValueError(str(e)) from e
+        return self._to_dict(msg)
+    
+    def _fill(self, msg, message_name: str, value: Dict[str, Any]):
+        for name, default, is_message, repeated, type_name in self._plans[message_name]:
+            v = value.get(name, default)
+            if v is None:
+                continue
+            if v.__class__ is EncodedFields:
+                msg.MergeFromString(v)
+            elif not is_message:
+                if type_name == 'bytes':
+                    v = [_to_bytes(item) for item in v] if repeated else _to_bytes(v)
+                if repeated:
+                    getattr(msg, name).extend(v)
+                else:
+                    setattr(msg, name, v)
+            elif repeated:
+                container = getattr(msg, name)
+                for item in v:
+                    self._fill_message(container.add(), type_name, item)
+            else:
+                sub = getattr(msg, name)
+                sub.SetInParent()
+                self._fill_message(sub, type_name, v)
+    
+    def _fill_message(self, msg, message_name: str, value: Union[Dict[str, Any], bytes]):
+        """Fill a nested message from a dict, or merge bytes already encoded"""
+        if isinstance(value, dict):
+            self._fill(msg, message_name, value)
+        else:
+            msg.MergeFromString(bytes(value))
+    
+    def _to_dict(self, msg) -> Dict[str, Any]:
+        result = {}
+        for field, v in msg.ListFields():
+            if field.message_type is None:
+                result[field.name] = list(v) if _is_repeated(field) else v
+            elif _is_repeated(field):
+                result[field.name] = [self._to_dict(item) for item in v]
+            else:
+                result[field.name] = self._to_dict(v)
+        return result
+
+
+def _to_bytes(value: Union[str, bytes, bytearray, memoryview]) -> bytes:
+    return value.encode('utf-8') if isinstance(value, str) else bytes(value)
+
+
+def _is_repeated(field) -> bool:
+    # Newer protobuf releases replace FieldDescriptor.label with is_repeated
+    if hasattr(field, 'is_repeated'):
+        return field.is_repeated
+    return field.label == field.LABEL_REPEATED
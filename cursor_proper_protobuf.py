@@ -9,16 +9,81 @@ import httpx
 import uuid
 import hashlib
 import struct
-import gzip
 import time
 import base64
-from cursor_auth_reader import CursorAuthReader
-from cursor_chat_proto import ProtobufEncoder
+from cursor_auth_reader import DEFAULT_CREDENTIALS
+from cursor_compression import DEFAULT_POLICY
+from cursor_headers import CONFIG_VERSION, HeaderTemplate, cursor_checksum
+from cursor_schema import MessageTemplate, encode
+from cursor_transport import DEFAULT_POOL
 
 class CursorProperProtobuf:
+    # Decides which request bodies are gzipped (cursor_compression.py)
+    compression = DEFAULT_POLICY
+    
+    # Token and machine id, shared per process and re-read when state.vscdb
+    # changes (cursor_auth_reader.py)
+    credentials = DEFAULT_CREDENTIALS
+    
+    # Warm HTTP connections shared by all clients (cursor_transport.py)
+    transport = DEFAULT_POOL
+    
+    # Ask-mode StreamUnifiedChatRequest with all but the per-request fields
+    # encoded once; the constant fields come from the schema defaults in
+    # cursor_schema.SCHEMAS
+    REQUEST_TEMPLATE = MessageTemplate(
+        'StreamUnifiedChatRequest',
+        static={'is_agentic': False, 'chat_mode_enum': 1, 'chat_mode': "Ask"},
+        dynamic=('messages', 'model', 'conversation_id', 'metadata', 'message_ids'),
+    )
+    METADATA_TEMPLATE = MessageTemplate('Metadata', dynamic=('timestamp',))
+    
+    # AvailableModels and StreamUnifiedChatWithTools headers; {uuid} is new per request
+    SESSION_HEADERS = HeaderTemplate({
+        'accept-encoding': 'gzip',
+        'authorization': 'Bearer {auth_token}',
+        'connect-protocol-version': '1',
+        'content-type': 'application/proto',
+        'user-agent': 'connect-es/1.6.1',
+        'x-amzn-trace-id': 'Root={uuid}',
+        'x-client-key': '{client_key}',
+        'x-cursor-checksum': '{cursor_checksum}',
+        'x-cursor-client-version': '1.1.3',
+        'x-cursor-config-version': CONFIG_VERSION,
+        'x-cursor-timezone': 'Asia/Shanghai',
+        'x-ghost-mode': 'true',
+        'x-request-id': '{uuid}',
+        'x-session-id': '{session_id}',
+        'Host': 'api2.cursor.sh',
+    })
+    CHAT_HEADERS = HeaderTemplate({
+        'authorization': 'Bearer {auth_token}',
+        'connect-accept-encoding': 'gzip',
+        'connect-protocol-version': '1',
+        'content-type': 'application/connect+proto',
+        'user-agent': 'connect-es/1.6.1',
+        'x-amzn-trace-id': 'Root={uuid}',
+        'x-client-key': '{client_key}',
+        'x-cursor-checksum': '{cursor_checksum}',
+        'x-cursor-client-version': '1.1.3',
+        'x-cursor-config-version': CONFIG_VERSION,
+        'x-cursor-timezone': 'Asia/Shanghai',
+        'x-ghost-mode': 'true',
+        'x-request-id': '{uuid}',
+        'x-session-id': '{session_id}',
+        'Host': 'api2.cursor.sh'
+    })
+    
+    @property
+    def auth_reader(self):
+        return self.credentials.reader
+    
+    @property
+    def token(self):
+        """Bearer token, re-read when state.vscdb changes"""
+        return self.credentials.get_bearer_token()
+    
     def __init__(self):
-        self.auth_reader = CursorAuthReader()
-        self.token = self.auth_reader.get_bearer_token()
         self.base_url = "https://api2.cursor.sh"
         
     def generate_hashed_64_hex(self, input_str, salt=''):
@@ -32,25 +97,8 @@ class CursorProperProtobuf:
         return str(uuid.uuid5(uuid.NAMESPACE_DNS, auth_token))
     
     def get_machine_id(self):
-        """Get machine ID from Cursor storage"""
-        import sqlite3
-        db_path = self.auth_reader.storage_path
-        if not db_path:
-            return None
-        try:
-            conn = sqlite3.connect(str(db_path))
-            cursor = conn.cursor()
-            cursor.execute("SELECT value FROM ItemTable WHERE key = 'storage.serviceMachineId'")
-            row = cursor.fetchone()
-            conn.close()
-            if row:
-                val = row[0]
-                if isinstance(val, bytes):
-                    val = val.decode('utf-8')
-                return val
-        except:
-            pass
-        return None
+        """Get machine ID from Cursor storage (cached, see cursor_auth_reader.py)"""
+        return self.credentials.get_machine_id()
     
     def generate_cursor_checksum(self, token):
         """Generate checksum like JS generateCursorChecksum"""
@@ -58,259 +106,78 @@ class CursorProperProtobuf:
         machine_id = self.get_machine_id()
         if not machine_id:
             machine_id = self.generate_hashed_64_hex(token, 'machineId')
-        
-        timestamp = int(time.time() * 1000 // 1000000)  # Math.floor(Date.now() / 1e6)
-        
-        # Create byte array like JS
-        byte_array = bytearray([
-            (timestamp >> 40) & 255,
-            (timestamp >> 32) & 255,
-            (timestamp >> 24) & 255,
-            (timestamp >> 16) & 255,
-            (timestamp >> 8) & 255,
-            timestamp & 255,
-        ])
-        
-        # Obfuscate like JS (Jyh cipher)
-        t = 165
-        for i in range(len(byte_array)):
-            byte_array[i] = ((byte_array[i] ^ t) + (i % 256)) & 255
-            t = byte_array[i]
-        
-        # URL-safe base64 without padding
-        alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_"
-        encoded = ""
-        for i in range(0, len(byte_array), 3):
-            a = byte_array[i]
-            b = byte_array[i + 1] if i + 1 < len(byte_array) else 0
-            c = byte_array[i + 2] if i + 2 < len(byte_array) else 0
-            encoded += alphabet[a >> 2]
-            encoded += alphabet[((a & 3) << 4) | (b >> 4)]
-            if i + 1 < len(byte_array):
-                encoded += alphabet[((b & 15) << 2) | (c >> 6)]
-            if i + 2 < len(byte_array):
-                encoded += alphabet[c & 63]
-        
-        return f"{encoded}{machine_id}"
+        return cursor_checksum(machine_id)
     
     def encode_message(self, content, role, message_id, chat_mode_enum=None):
         """Encode Message using exact schema"""
-        msg = b''
-        
-        # string content = 1;
-        msg += ProtobufEncoder.encode_field(1, 2, content)
-        
-        # int32 role = 2;
-        msg += ProtobufEncoder.encode_field(2, 0, role)
-        
-        # string messageId = 13;
-        msg += ProtobufEncoder.encode_field(13, 2, message_id)
-        
-        # int32 chatModeEnum = 47; // only for user message
-        if chat_mode_enum is not None:
-            msg += ProtobufEncoder.encode_field(47, 0, chat_mode_enum)
-        
-        return msg
+        return encode('ConversationMessage', {
+            'content': content,
+            'role': role,
+            'message_id': message_id,
+            'chat_mode_enum': chat_mode_enum,  # only for user message
+        })
     
     def encode_instruction(self, instruction_text):
         """Encode Instruction"""
-        msg = b''
-        
-        # string instruction = 1;
-        if instruction_text:
-            msg += ProtobufEncoder.encode_field(1, 2, instruction_text)
-        
-        return msg
+        return encode('Instruction', {'instruction': instruction_text or None})
     
     def encode_model(self, model_name):
         """Encode Model"""
-        msg = b''
-        
-        # string name = 1;
-        msg += ProtobufEncoder.encode_field(1, 2, model_name)
-        
-        # bytes empty = 4;
-        msg += ProtobufEncoder.encode_field(4, 2, b'')
-        
-        return msg
+        return encode('Model', {'name': model_name, 'empty': b''})
     
     def encode_cursor_setting(self):
         """Encode CursorSetting"""
-        msg = b''
-        
-        # string name = 1;
-        msg += ProtobufEncoder.encode_field(1, 2, "cursor\\aisettings")
-        
-        # bytes unknown3 = 3;
-        msg += ProtobufEncoder.encode_field(3, 2, b'')
-        
-        # Unknown6 unknown6 = 6;
-        unknown6_msg = b''
-        unknown6_msg += ProtobufEncoder.encode_field(1, 2, b'')  # bytes unknown1 = 1;
-        unknown6_msg += ProtobufEncoder.encode_field(2, 2, b'')  # bytes unknown2 = 2;
-        msg += ProtobufEncoder.encode_field(6, 2, unknown6_msg)
-        
-        # int32 unknown8 = 8;
-        msg += ProtobufEncoder.encode_field(8, 0, 1)
-        
-        # int32 unknown9 = 9;
-        msg += ProtobufEncoder.encode_field(9, 0, 1)
-        
-        return msg
+        return encode('CursorSetting', {})
     
     def encode_metadata(self):
         """Encode Metadata"""
-        msg = b''
-        
-        # string os = 1;
-        msg += ProtobufEncoder.encode_field(1, 2, "linux")
-        
-        # string arch = 2;
-        msg += ProtobufEncoder.encode_field(2, 2, "x64")
-        
-        # string version = 3;
-        msg += ProtobufEncoder.encode_field(3, 2, "6.13.0")
-        
-        # string path = 4;
-        msg += ProtobufEncoder.encode_field(4, 2, "/usr/bin/python3")
-        
-        # string timestamp = 5;
+        return self.METADATA_TEMPLATE.build(self._metadata_value())
+    
+    def _metadata_value(self):
         from datetime import datetime
-        msg += ProtobufEncoder.encode_field(5, 2, datetime.now().isoformat())
-        
-        return msg
+        return {'timestamp': datetime.now().isoformat()}
     
     def encode_message_id(self, message_id, role, summary_id=None):
         """Encode MessageId"""
-        msg = b''
-        
-        # string messageId = 1;
-        msg += ProtobufEncoder.encode_field(1, 2, message_id)
-        
-        # string summaryId = 2;
-        if summary_id:
-            msg += ProtobufEncoder.encode_field(2, 2, summary_id)
-        
-        # int32 role = 3;
-        msg += ProtobufEncoder.encode_field(3, 0, role)
-        
-        return msg
+        return encode('MessageId', {
+            'message_id': message_id,
+            'summary_id': summary_id or None,
+            'role': role,
+        })
     
     def encode_request(self, messages, model_name):
         """Encode Request using exact schema"""
-        msg = b''
-        
-        # Format messages
-        formatted_messages = []
+        return self.REQUEST_TEMPLATE.build(self._request_value(messages, model_name))
+    
+    def _request_value(self, messages, model_name):
+        """Per-request StreamUnifiedChatRequest fields for REQUEST_TEMPLATE"""
+        conversation = []
         message_ids = []
         
-        for i, user_msg in enumerate(messages):
+        for user_msg in messages:
             if user_msg['role'] == 'user':
                 msg_id = str(uuid.uuid4())
-                formatted_messages.append({
+                conversation.append({
                     'content': user_msg['content'],
                     'role': 1,  # user
-                    'messageId': msg_id,
-                    'chatModeEnum': 1  # ask mode
+                    'message_id': msg_id,
+                    'chat_mode_enum': 1  # ask mode
                 })
-                message_ids.append({
-                    'messageId': msg_id,
-                    'role': 1
-                })
-        
-        # repeated Message messages = 1;
-        for formatted_msg in formatted_messages:
-            message_bytes = self.encode_message(
-                formatted_msg['content'],
-                formatted_msg['role'],
-                formatted_msg['messageId'],
-                formatted_msg.get('chatModeEnum')
-            )
-            msg += ProtobufEncoder.encode_field(1, 2, message_bytes)
-        
-        # int32 unknown2 = 2; // 1
-        msg += ProtobufEncoder.encode_field(2, 0, 1)
-        
-        # Instruction instruction = 3;
-        instruction_bytes = self.encode_instruction("")
-        msg += ProtobufEncoder.encode_field(3, 2, instruction_bytes)
-        
-        # int32 unknown4 = 4; // 1
-        msg += ProtobufEncoder.encode_field(4, 0, 1)
-        
-        # Model model = 5;
-        model_bytes = self.encode_model(model_name)
-        msg += ProtobufEncoder.encode_field(5, 2, model_bytes)
-        
-        # string webTool = 8;
-        msg += ProtobufEncoder.encode_field(8, 2, "")
-        
-        # int32 unknown13 = 13;
-        msg += ProtobufEncoder.encode_field(13, 0, 1)
-        
-        # CursorSetting cursorSetting = 15;
-        cursor_setting_bytes = self.encode_cursor_setting()
-        msg += ProtobufEncoder.encode_field(15, 2, cursor_setting_bytes)
-        
-        # int32 unknown19 = 19; // 1
-        msg += ProtobufEncoder.encode_field(19, 0, 1)
-        
-        # string conversationId = 23;
-        msg += ProtobufEncoder.encode_field(23, 2, str(uuid.uuid4()))
-        
-        # Metadata metadata = 26;
-        metadata_bytes = self.encode_metadata()
-        msg += ProtobufEncoder.encode_field(26, 2, metadata_bytes)
-        
-        # int32 unknown27 = 27; // 0
-        msg += ProtobufEncoder.encode_field(27, 0, 0)
-        
-        # repeated MessageId messageIds = 30;
-        for msg_id_data in message_ids:
-            message_id_bytes = self.encode_message_id(
-                msg_id_data['messageId'],
-                msg_id_data['role']
-            )
-            msg += ProtobufEncoder.encode_field(30, 2, message_id_bytes)
-        
-        # int32 largeContext = 35; // 0
-        msg += ProtobufEncoder.encode_field(35, 0, 0)
-        
-        # int32 unknown38 = 38; // 0
-        msg += ProtobufEncoder.encode_field(38, 0, 0)
-        
-        # int32 chatModeEnum = 46; // 1
-        msg += ProtobufEncoder.encode_field(46, 0, 1)
-        
-        # string unknown47 = 47;
-        msg += ProtobufEncoder.encode_field(47, 2, "")
-        
-        # int32 unknown48 = 48; // 0
-        msg += ProtobufEncoder.encode_field(48, 0, 0)
-        
-        # int32 unknown49 = 49; // 0
-        msg += ProtobufEncoder.encode_field(49, 0, 0)
-        
-        # int32 unknown51 = 51; // 0
-        msg += ProtobufEncoder.encode_field(51, 0, 0)
-        
-        # int32 unknown53 = 53; // 1
-        msg += ProtobufEncoder.encode_field(53, 0, 1)
-        
-        # string chatMode = 54;
-        msg += ProtobufEncoder.encode_field(54, 2, "Ask")
-        
-        return msg
+                message_ids.append({'message_id': msg_id, 'role': 1})
+        
+        return {
+            'messages': conversation,
+            'model': {'name': model_name, 'empty': b''},
+            'conversation_id': str(uuid.uuid4()),
+            'metadata': self.encode_metadata(),
+            'message_ids': message_ids,
+        }
     
     def encode_stream_unified_chat_request(self, messages, model_name):
         """Encode StreamUnifiedChatWithToolsRequest"""
-        msg = b''
-        
-        # Request request = 1;
-        request_bytes = self.encode_request(messages, model_name)
-        msg += ProtobufEncoder.encode_field(1, 2, request_bytes)
-        
-        return msg
+        return encode('StreamUnifiedChatRequestWithTools', {
+            'request': self.encode_request(messages, model_name),
+        })
     
     def generate_cursor_body_exact(self, messages, model_name):
         """Generate body exactly like JS generateCursorBody"""
@@ -318,43 +185,21 @@ class CursorProperProtobuf:
         # Encode the protobuf message
         buffer = self.encode_stream_unified_chat_request(messages, model_name)
         
-        # Apply compression logic from JS
-        magic_number = 0x00
-        if len(messages) >= 3:
-            buffer = gzip.compress(buffer)
-            magic_number = 0x01
-        
-        # Create final body like JS: magic_number + length (hex) + buffer
-        length_hex = format(len(buffer), '08x')
-        length_bytes = bytes.fromhex(length_hex)
-        
-        final_body = bytes([magic_number]) + length_bytes + buffer
-        return final_body
+        # Body like JS: magic_number + length + buffer. JS gzips from 3 messages
+        # on; we let the compression policy decide from the buffer size.
+        return self.compression.frame(buffer)
     
     async def establish_session(self, auth_token, session_id, client_key, cursor_checksum):
         """Call AvailableModels first to establish session"""
         print("Establishing session...")
         
         url = f"{self.base_url}/aiserver.v1.AiService/AvailableModels"
-        headers = {
-            'accept-encoding': 'gzip',
-            'authorization': f'Bearer {auth_token}',
-            'connect-protocol-version': '1',
-            'content-type': 'application/proto',
-            'user-agent': 'connect-es/1.6.1',
-            'x-amzn-trace-id': f'Root={uuid.uuid4()}',
-            'x-client-key': client_key,
-            'x-cursor-checksum': cursor_checksum,
-            'x-cursor-client-version': '1.1.3',
-            'x-cursor-config-version': str(uuid.uuid4()),
-            'x-cursor-timezone': 'Asia/Shanghai',
-            'x-ghost-mode': 'true',
-            'x-request-id': str(uuid.uuid4()),
-            'x-session-id': session_id,
-            'Host': 'api2.cursor.sh',
-        }
+        headers = self.SESSION_HEADERS.headers(
+            auth_token=auth_token, client_key=client_key,
+            cursor_checksum=cursor_checksum, session_id=session_id,
+        )
         
-        async with httpx.AsyncClient(http2=False, timeout=10.0) as client:
+        async with self.transport.client(http2=False, timeout=10.0) as client:
             response = await client.post(url, headers=headers)
             print(f"Session: {response.status_code}")
             return response.status_code == 200
@@ -368,25 +213,12 @@ class CursorProperProtobuf:
         print(f"Body size: {len(cursor_body)} bytes")
         
         url = f"{self.base_url}/aiserver.v1.ChatService/StreamUnifiedChatWithTools"
-        headers = {
-            'authorization': f'Bearer {auth_token}',
-            'connect-accept-encoding': 'gzip',
-            'connect-protocol-version': '1',
-            'content-type': 'application/connect+proto',
-            'user-agent': 'connect-es/1.6.1',
-            'x-amzn-trace-id': f'Root={uuid.uuid4()}',
-            'x-client-key': client_key,
-            'x-cursor-checksum': cursor_checksum,
-            'x-cursor-client-version': '1.1.3',
-            'x-cursor-config-version': str(uuid.uuid4()),
-            'x-cursor-timezone': 'Asia/Shanghai',
-            'x-ghost-mode': 'true',
-            'x-request-id': str(uuid.uuid4()),
-            'x-session-id': session_id,
-            'Host': 'api2.cursor.sh'
-        }
+        headers = self.CHAT_HEADERS.headers(
+            auth_token=auth_token, client_key=client_key,
+            cursor_checksum=cursor_checksum, session_id=session_id,
+        )
         
-        async with httpx.AsyncClient(http2=False, timeout=30.0) as client:
+        async with self.transport.client(http2=False, timeout=30.0) as client:
             try:
                 async with client.stream('POST', url, headers=headers, content=cursor_body) as response:
                     print(f"Status: {response.status_code}")
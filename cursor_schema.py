@@ -0,0 +1,752 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Declarative protobuf schemas for the Cursor messages our clients encode and
+decode, compiled into specialized codec functions at import time.
+
+Field maps come from the analysis documents:
+- TASK-7-protobuf-schemas.md: StreamUnifiedChatRequest and its sub-messages
+- TASK-26-tool-schemas.md: ClientSideToolV2Call, ClientSideToolV2Result and tool results
+- TASK-126-toolv2-params.md: ClientSideToolV2Call params messages
+- TASK-10-bidi-append.md: BidiAppendRequest
+
+Each message lists its fields in the order they are written, which is not
+always field-number order; the clients rely on it for byte-identical bodies.
+compile_schemas() turns every message into a straight-line encoder with the
+tags pre-encoded as constants, and a decoder that dispatches on the full tag
+(fields arriving with an unexpected wire type are skipped like unknown ones).
+
+    body = encode('StreamUnifiedChatRequestWithTools', {'request': {...}})
+    call = decode('ClientSideToolV2Call', payload)
+
+encode() and decode() run these compiled functions by default; set_backend('pb2')
+switches them to protobuf message classes generated from the same schemas
+(see cursor_pb2_codec.py).
+
+Values are dicts keyed by field name. A field is written when its value (or
+its schema default) is not None. Repeated fields take a list, message fields
+take a dict or bytes that are already encoded; a repeated field also takes
+EncodedFields holding all of its occurrences. Repeated numeric fields are
+written packed unless declared packed=False, and read in either form.
+Decoded dicts only hold the fields present on the wire.
+
+MessageTemplate encodes the fields that are the same on every request once
+and compiles a build function that only encodes the rest.
+"""
+
+import os
+import struct
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Tuple, Union
+
+from cursor_chat_proto import ProtobufWriter, encode_tag
+
+
+@dataclass(frozen=True)
+class Field:
+    """One field of a message schema"""
+    number: int
+    name: str
+    type: str                # Scalar type name below, or a message name
+    repeated: bool = False
+    default: Any = None      # Written when the value has no entry for this field
+    packed: bool = True      # Repeated numeric fields only: one length-delimited run
+    
+    @property
+    def is_packed(self) -> bool:
+        return self.repeated and self.packed and self.type in PACKABLE_TYPES
+
+
+VARINT_TYPES = ('int32', 'int64', 'enum', 'uint32', 'uint64')
+SIGNED_TYPES = ('int32', 'int64', 'enum')
+LENGTH_TYPES = ('string', 'bytes')
+SCALAR_TYPES = VARINT_TYPES + LENGTH_TYPES + ('bool', 'double')
+PACKABLE_TYPES = VARINT_TYPES + ('bool', 'double')
+
+WIRE_TYPES = {name: 0 for name in VARINT_TYPES + ('bool',)}
+WIRE_TYPES.update(string=2, bytes=2, double=1)
+
+
+def _tool_results(*entries: Tuple[int, str, str]) -> List[Field]:
+    return [Field(number, name, type_name) for number, name, type_name in entries]
+
+
+SCHEMAS: Dict[str, List[Field]] = {
+    # --- StreamUnifiedChatRequest (TASK-7) ---
+    'ConversationMessage': [
+        Field(1, 'content', 'string'),
+        Field(2, 'role', 'enum'),                   # 1=user, 2=assistant
+        Field(13, 'message_id', 'string'),
+        Field(47, 'chat_mode_enum', 'enum'),        # Only set on user messages
+    ],
+    'Instruction': [
+        Field(1, 'instruction', 'string'),
+    ],
+    'Model': [
+        Field(1, 'name', 'string'),
+        Field(4, 'empty', 'bytes'),
+    ],
+    'CursorSettingUnknown6': [
+        Field(1, 'unknown1', 'bytes', default=b''),
+        Field(2, 'unknown2', 'bytes', default=b''),
+    ],
+    'CursorSetting': [
+        Field(1, 'name', 'string', default="cursor\\aisettings"),
+        Field(3, 'unknown3', 'bytes', default=b''),
+        Field(6, 'unknown6', 'CursorSettingUnknown6', default={}),
+        Field(8, 'unknown8', 'int32', default=1),
+        Field(9, 'unknown9', 'int32', default=1),
+    ],
+    'Metadata': [
+        Field(1, 'os', 'string', default="linux"),
+        Field(2, 'arch', 'string', default="x64"),
+        Field(3, 'version', 'string', default="6.13.0"),
+        Field(4, 'path', 'string', default="/usr/bin/python3"),
+        Field(5, 'timestamp', 'string'),
+    ],
+    'MessageId': [
+        Field(1, 'message_id', 'string'),
+        Field(2, 'summary_id', 'string'),
+        Field(3, 'role', 'enum'),
+    ],
+    'StreamUnifiedChatRequest': [
+        Field(1, 'messages', 'ConversationMessage', repeated=True),
+        Field(2, 'unknown2', 'int32', default=1),
+        Field(3, 'instruction', 'Instruction', default={}),
+        Field(4, 'unknown4', 'int32', default=1),
+        Field(5, 'model', 'Model'),
+        Field(8, 'web_tool', 'string', default=""),
+        Field(13, 'unknown13', 'int32', default=1),
+        Field(15, 'cursor_setting', 'CursorSetting', default={}),
+        Field(19, 'unknown19', 'int32', default=1),
+        Field(23, 'conversation_id', 'string'),
+        Field(26, 'metadata', 'Metadata'),
+        Field(27, 'is_agentic', 'bool'),
+        Field(29, 'supported_tools', 'enum', repeated=True),
+        Field(30, 'message_ids', 'MessageId', repeated=True),
+        Field(35, 'large_context', 'int32', default=0),
+        Field(38, 'unknown38', 'int32', default=0),
+        Field(46, 'chat_mode_enum', 'int32'),      # 1=ask, 2=agent
+        Field(47, 'unknown47', 'string', default=""),
+        Field(48, 'unknown48', 'int32', default=0),
+        Field(49, 'unknown49', 'int32', default=0),
+        Field(51, 'unknown51', 'int32', default=0),
+        Field(53, 'unknown53', 'int32', default=1),
+        Field(54, 'chat_mode', 'string'),          # "Ask" or "agent"
+    ],
+    'StreamUnifiedChatRequestWithTools': [
+        Field(1, 'request', 'StreamUnifiedChatRequest'),
+        Field(2, 'client_side_tool_v2_result', 'ClientSideToolV2Result'),
+    ],
+
+    # --- Legacy chat message built by CursorChatMessage ---
+    'ChatMessage': [
+        Field(2, 'messages', 'ConversationMessage', repeated=True),
+        Field(4, 'instructions', 'Instruction'),
+        Field(5, 'project_path', 'string'),
+        Field(7, 'model', 'Model'),
+        Field(9, 'request_id', 'string'),
+        Field(11, 'summary', 'string'),
+        Field(15, 'conversation_id', 'string'),
+    ],
+
+    # --- ClientSideToolV2Call (TASK-26, params from TASK-126) ---
+    'ReadFileParams': [
+        Field(1, 'relative_workspace_path', 'string'),
+        Field(2, 'read_entire_file', 'bool'),
+        Field(3, 'start_line_one_indexed', 'int32'),
+        Field(4, 'end_line_one_indexed_inclusive', 'int32'),
+        Field(5, 'file_is_allowed_to_be_read_entirely', 'bool'),
+        Field(6, 'max_lines', 'int32'),
+        Field(7, 'max_chars', 'int32'),
+        Field(8, 'min_lines', 'int32'),
+    ],
+    'ListDirParams': [
+        Field(1, 'directory_path', 'string'),
+    ],
+    'RunTerminalCommandV2Params': [
+        Field(1, 'command', 'string'),
+        Field(2, 'cwd', 'string'),
+        Field(3, 'new_session', 'bool'),
+        Field(5, 'is_background', 'bool'),
+        Field(6, 'require_user_approval', 'bool'),
+        Field(8, 'idle_timeout_seconds', 'int32'),
+    ],
+    'GlobFileSearchParams': [
+        Field(1, 'target_directory', 'string'),
+        Field(2, 'glob_pattern', 'string'),
+    ],
+    'ClientSideToolV2Call': [
+        Field(1, 'tool', 'enum'),
+        Field(3, 'tool_call_id', 'string'),
+        Field(6, 'timeout_ms', 'double'),
+        Field(9, 'name', 'string'),
+        Field(10, 'raw_args', 'string'),
+        Field(14, 'is_streaming', 'bool'),
+        Field(15, 'is_last_message', 'bool'),
+        Field(48, 'tool_index', 'uint32'),
+        Field(49, 'model_call_id', 'string'),
+        Field(51, 'internal', 'bool'),
+        Field(8, 'read_file_params', 'ReadFileParams'),
+        Field(12, 'list_dir_params', 'ListDirParams'),
+        Field(23, 'run_terminal_command_v2_params', 'RunTerminalCommandV2Params'),
+        Field(55, 'glob_file_search_params', 'GlobFileSearchParams'),
+    ],
+
+    # --- ClientSideToolV2Result (TASK-26) ---
+    'ReadFileResult': [
+        Field(1, 'contents', 'string'),
+        Field(9, 'relative_workspace_path', 'string'),
+        Field(12, 'total_lines', 'int32'),
+    ],
+    'ListDirFile': [
+        Field(1, 'name', 'string'),
+        Field(2, 'is_directory', 'bool'),
+        Field(3, 'size', 'int64'),
+    ],
+    'ListDirResult': [
+        Field(1, 'files', 'ListDirFile', repeated=True),
+        Field(2, 'directory_relative_workspace_path', 'string'),
+    ],
+    'Range': [
+        Field(1, 'start_line_number', 'int32'),
+        Field(2, 'start_column', 'int32'),
+        Field(3, 'end_line_number', 'int32'),
+        Field(4, 'end_column', 'int32'),
+    ],
+    'ISearchRangeSetPairing': [
+        Field(1, 'source', 'Range'),
+    ],
+    'ITextSearchMatch': [
+        Field(3, 'preview_text', 'string'),
+        Field(2, 'range_locations', 'ISearchRangeSetPairing', repeated=True),
+    ],
+    'ITextSearchResult': [
+        Field(1, 'match', 'ITextSearchMatch'),
+    ],
+    'IFileMatch': [
+        Field(1, 'resource', 'string'),
+        Field(2, 'results', 'ITextSearchResult', repeated=True),
+    ],
+    'RipgrepSearchResultInternal': [
+        Field(1, 'results', 'IFileMatch', repeated=True),
+        Field(2, 'exit', 'enum'),                   # 1=NORMAL
+    ],
+    'RipgrepSearchResult': [
+        Field(1, 'internal', 'RipgrepSearchResultInternal'),
+    ],
+    'RunTerminalCommandV2Result': [
+        Field(1, 'output', 'string'),
+        Field(2, 'exit_code', 'int32'),
+        Field(3, 'rejected', 'bool'),
+    ],
+    'EditFileResult': [
+        Field(2, 'is_applied', 'bool'),
+    ],
+    'FileSearchFile': [
+        Field(1, 'uri', 'string'),
+    ],
+    'ToolCallFileSearchResult': [
+        Field(1, 'files', 'FileSearchFile', repeated=True),
+        Field(2, 'limit_hit', 'bool'),
+        Field(3, 'num_results', 'int32'),
+    ],
+    'ToolResultError': [
+        Field(1, 'client_visible_error_message', 'string'),
+        Field(2, 'model_visible_error_message', 'string'),
+    ],
+    'ClientSideToolV2Result': [
+        Field(1, 'tool', 'enum'),
+        Field(35, 'tool_call_id', 'string'),
+        # oneof result; messages we do not build yet are carried as bytes
+        *_tool_results(
+            (2, 'read_semsearch_files_result', 'bytes'),
+            (4, 'ripgrep_search_result', 'RipgrepSearchResult'),
+            (6, 'read_file_result', 'ReadFileResult'),
+            (9, 'list_dir_result', 'ListDirResult'),
+            (10, 'edit_file_result', 'EditFileResult'),
+            (11, 'file_search_result', 'ToolCallFileSearchResult'),
+            (18, 'semantic_search_full_result', 'bytes'),
+            (20, 'delete_file_result', 'bytes'),
+            (21, 'reapply_result', 'bytes'),
+            (24, 'run_terminal_command_v2_result', 'RunTerminalCommandV2Result'),
+            (25, 'fetch_rules_result', 'bytes'),
+            (27, 'web_search_result', 'bytes'),
+            (28, 'mcp_result', 'bytes'),
+            (32, 'search_symbols_result', 'bytes'),
+            (33, 'background_composer_followup_result', 'bytes'),
+            (34, 'knowledge_base_result', 'bytes'),
+            (36, 'fetch_pull_request_result', 'bytes'),
+            (37, 'deep_search_result', 'bytes'),
+            (38, 'create_diagram_result', 'bytes'),
+            (39, 'fix_lints_result', 'bytes'),
+            (40, 'read_lints_result', 'bytes'),
+            (41, 'gotodef_result', 'bytes'),
+            (42, 'task_result', 'bytes'),
+            (43, 'await_task_result', 'bytes'),
+            (44, 'todo_read_result', 'bytes'),
+            (45, 'todo_write_result', 'bytes'),
+            (51, 'edit_file_v2_result', 'bytes'),
+            (52, 'list_dir_v2_result', 'bytes'),
+            (53, 'read_file_v2_result', 'bytes'),
+            (54, 'ripgrep_raw_search_result', 'bytes'),
+            # Same layout as file_search_result for the fields we send
+            (55, 'glob_file_search_result', 'ToolCallFileSearchResult'),
+            (56, 'create_plan_result', 'bytes'),
+            (57, 'list_mcp_resources_result', 'bytes'),
+            (58, 'read_mcp_resource_result', 'bytes'),
+            (59, 'read_project_result', 'bytes'),
+            (60, 'update_project_result', 'bytes'),
+            (61, 'task_v2_result', 'bytes'),
+            (62, 'call_mcp_tool_result', 'bytes'),
+            (63, 'apply_agent_diff_result', 'bytes'),
+            (64, 'ask_question_result', 'bytes'),
+            (65, 'switch_mode_result', 'bytes'),
+            (66, 'computer_use_result', 'bytes'),
+            (67, 'generate_image_result', 'bytes'),
+            (68, 'write_shell_stdin_result', 'bytes'),
+        ),
+        Field(8, 'error', 'ToolResultError'),
+    ],
+
+    # --- BidiService (TASK-10) ---
+    'BidiRequestId': [
+        Field(1, 'request_id', 'string'),
+    ],
+    'BidiAppendRequest': [
+        Field(1, 'data', 'string'),
+        Field(2, 'request_id', 'BidiRequestId'),
+        Field(3, 'append_seqno', 'int64'),
+    ],
+}
+
+
+class EncodedFields(bytes):
+    """Occurrences of a repeated field that are already encoded, tags included
+    
+    Passed instead of a list, they are copied into the message as is, so a
+    caller can keep the encoded history of a growing conversation and only
+    encode what it appends.
+    """
+    __slots__ = ()
+
+
+# ---------------------------------------------------------------------------
+# Runtime helpers used by the generated functions
+# ---------------------------------------------------------------------------
+
+def _read_varint(data, pos: int, end: int) -> Tuple[int, int]:
+    """Read a varint, return (value, new_position); raise ValueError on truncation"""
+    result = 0
+    shift = 0
+    while pos < end:
+        b = data[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+    raise ValueError("truncated varint")
+
+
+def _skip_field(data, pos: int, end: int, wire_type: int) -> int:
+    """Skip the value of an unknown field, return the new position"""
+    if wire_type == 0:
+        return _read_varint(data, pos, end)[1]
+    if wire_type == 2:
+        length, pos = _read_varint(data, pos, end)
+        pos += length
+    elif wire_type == 1:
+        pos += 8
+    elif wire_type == 5:
+        pos += 4
+    else:
+        raise ValueError(f"unsupported wire type {wire_type}")
+    if pos > end:
+        raise ValueError("truncated field")
+    return pos
+
+
+_pack_double = struct.Struct('<d').pack
+_unpack_double = struct.Struct('<d').unpack_from
+
+
+# ---------------------------------------------------------------------------
+# Compiler
+# ---------------------------------------------------------------------------
+
+def _encode_field_lines(message: str, field: Field, value: str, consts: Dict[str, Any]) -> List[str]:
+    """Source lines appending one (non-repeated) value of field to buf"""
+    type_name = field.type
+    if type_name in SCALAR_TYPES:
+        tag = encode_tag(field.number, WIRE_TYPES[type_name])
+    else:
+        tag = encode_tag(field.number, 2)
+    tag_name = f"_t_{message}_{field.number}"
+    consts[tag_name] = tag
+
+    if type_name in VARINT_TYPES:
+        return [
+            f"buf += {tag_name}",
+            f"if 0 <= {value} < 0x80:",
+            f"    buf.append({value})",
+            f"else:",
+            f"    w.write_varint({value})",
+        ]
+    if type_name == 'bool':
+        consts[f"{tag_name}_true"] = tag + b'\x01'
+        consts[f"{tag_name}_false"] = tag + b'\x00'
+        return [f"buf += {tag_name}_true if {value} else {tag_name}_false"]
+    if type_name == 'double':
+        return [f"buf += {tag_name}", f"buf += _pack_double({value})"]
+
+    lines = []
+    if type_name in LENGTH_TYPES:
+        lines += [
+            f"if isinstance({value}, str):",
+            f"    {value} = {value}.encode('utf-8')",
+        ]
+    else:
+        # Nested message: encode dicts in place, take pre-encoded bytes as is
+        lines += [
+            f"if isinstance({value}, dict):",
+            f"    buf += {tag_name}",
+            f"    buf.append(0)",
+            f"    start = len(buf)",
+            f"    _encode_{type_name}({value}, w)",
+            f"    w.end_message(start)",
+            f"else:",
+        ]
+    body = [
+        f"buf += {tag_name}",
+        f"n = len({value})",
+        f"if n < 0x80:",
+        f"    buf.append(n)",
+        f"else:",
+        f"    w.write_varint(n)",
+        f"buf += {value}",
+    ]
+    indent = '' if type_name in LENGTH_TYPES else '    '
+    return lines + [indent + line for line in body]
+
+
+def _encode_packed_lines(message: str, field: Field, consts: Dict[str, Any]) -> List[str]:
+    """Source lines appending the list v as one packed run"""
+    tag_name = f"_t_{message}_{field.number}"
+    consts[tag_name] = encode_tag(field.number, 2)
+    if field.type == 'bool':
+        item = ["    buf.append(1 if item else 0)"]
+    elif field.type == 'double':
+        item = ["    buf += _pack_double(item)"]
+    else:
+        item = [
+            "    if 0 <= item < 0x80:",
+            "        buf.append(item)",
+            "    else:",
+            "        w.write_varint(item)",
+        ]
+    # Same in-place length backpatching as nested messages
+    return [
+        "if v:",
+        f"    buf += {tag_name}",
+        "    buf.append(0)",
+        "    start = len(buf)",
+        "    for item in v:",
+    ] + ["    " + line for line in item] + ["    w.end_message(start)"]
+
+
+def _encoder_source(name: str, fields: List[Field], consts: Dict[str, Any]) -> str:
+    lines = [f"def _encode_{name}(value, w):", "    buf = w.buf"]
+    lines += _encode_fields_lines(name, fields, consts)
+    return '\n'.join(lines) + '\n'
+
+
+def _encode_fields_lines(name: str, fields: List[Field], consts: Dict[str, Any]) -> List[str]:
+    """Function body lines appending fields of value to buf"""
+    lines = []
+    for field in fields:
+        if field.default is None:
+            lines.append(f"    v = value.get({field.name!r})")
+        else:
+            default_name = f"_d_{name}_{field.name}"
+            consts[default_name] = field.default
+            lines.append(f"    v = value.get({field.name!r}, {default_name})")
+        lines.append("    if v is not None:")
+        if field.repeated:
+            lines += [
+                "        if v.__class__ is EncodedFields:",
+                "            buf += v",
+                "        else:",
+            ]
+            if field.is_packed:
+                lines += ["            " + line for line in _encode_packed_lines(name, field, consts)]
+            else:
+                lines.append("            for item in v:")
+                lines += ["                " + line for line in _encode_field_lines(name, field, 'item', consts)]
+        else:
+            lines += ["        " + line for line in _encode_field_lines(name, field, 'v', consts)]
+    return lines
+
+
+def _decode_value_lines(field: Field, end: str = 'end') -> List[str]:
+    """Source lines reading one value of field at pos into v, bounded by end"""
+    type_name = field.type
+    if type_name in VARINT_TYPES or type_name == 'bool':
+        lines = [f"v, pos = _read_varint(data, pos, {end})"]
+        if type_name in SIGNED_TYPES:
+            lines += ["if v >= 0x8000000000000000:", "    v -= 0x10000000000000000"]
+        elif type_name == 'bool':
+            lines.append("v = v != 0")
+        return lines
+    if type_name == 'double':
+        return [
+            f"if pos + 8 > {end}:",
+            "    raise ValueError('truncated field')",
+            "v = _unpack_double(data, pos)[0]",
+            "pos += 8",
+        ]
+
+    lines = [
+        "n, pos = _read_varint(data, pos, end)",
+        "stop = pos + n",
+        "if stop > end:",
+        "    raise ValueError('truncated field')",
+    ]
+    if type_name == 'string':
+        lines.append("v = str(data[pos:stop], 'utf-8')")
+    elif type_name == 'bytes':
+        lines.append("v = bytes(data[pos:stop])")
+    else:
+        lines.append(f"v = _decode_{type_name}(data[pos:stop])")
+    lines.append("pos = stop")
+    return lines
+
+
+def _decode_packed_lines(field: Field) -> List[str]:
+    """Source lines reading a packed run of field at pos into its result list"""
+    lines = [
+        "n, pos = _read_varint(data, pos, end)",
+        "stop = pos + n",
+        "if stop > end:",
+        "    raise ValueError('truncated field')",
+        f"items = result.setdefault({field.name!r}, [])",
+        "while pos < stop:",
+    ]
+    # Values must not run past the packed run
+    value_lines = _decode_value_lines(field, end='stop')
+    return lines + ["    " + line for line in value_lines] + ["    items.append(v)"]
+
+
+def _decoder_source(name: str, fields: List[Field]) -> str:
+    lines = [
+        f"def _decode_{name}(data):",
+        "    result = {}",
+        "    pos = 0",
+        "    end = len(data)",
+        "    while pos < end:",
+        "        tag = data[pos]",
+        "        if tag < 0x80:",
+        "            pos += 1",
+        "        else:",
+        "            tag, pos = _read_varint(data, pos, end)",
+    ]
+    keyword = 'if'
+    for field in fields:
+        wire_type = WIRE_TYPES.get(field.type, 2)
+        lines.append(f"        {keyword} tag == {(field.number << 3) | wire_type}:")
+        lines += ["            " + line for line in _decode_value_lines(field)]
+        if field.repeated:
+            lines.append(f"            result.setdefault({field.name!r}, []).append(v)")
+        else:
+            lines.append(f"            result[{field.name!r}] = v")
+        if field.repeated and field.type in PACKABLE_TYPES:
+            # Packed and unpacked runs are both valid for repeated numeric fields
+            lines.append(f"        elif tag == {(field.number << 3) | 2}:")
+            lines += ["            " + line for line in _decode_packed_lines(field)]
+        keyword = 'elif'
+    if fields:
+        lines.append("        else:")
+        lines.append("            pos = _skip_field(data, pos, end, tag & 7)")
+    else:
+        lines.append("        pos = _skip_field(data, pos, end, tag & 7)")
+    lines.append("    return result")
+    return '\n'.join(lines) + '\n'
+
+
+def compile_schemas(schemas: Dict[str, List[Field]]) -> Tuple[Dict[str, Callable], Dict[str, Callable]]:
+    """Compile message schemas into (encoders, decoders) keyed by message name
+
+    Encoders take (value, writer) and append to the ProtobufWriter; decoders
+    take bytes or a memoryview and return a dict.
+    """
+    namespace = {
+        'EncodedFields': EncodedFields,
+        '_read_varint': _read_varint,
+        '_skip_field': _skip_field,
+        '_pack_double': _pack_double,
+        '_unpack_double': _unpack_double,
+    }
+    sources = []
+    for name, fields in schemas.items():
+        numbers = set()
+        for field in fields:
+            if field.type not in SCALAR_TYPES and field.type not in schemas:
+                raise ValueError(f"{name}.{field.name}: unknown type {field.type!r}")
+            if field.number in numbers:
+                raise ValueError(f"{name}.{field.name}: duplicate field number {field.number}")
+            numbers.add(field.number)
+        sources.append(_encoder_source(name, fields, namespace))
+        sources.append(_decoder_source(name, fields))
+    exec(compile(''.join(sources), '<cursor_schema>', 'exec'), namespace)
+    encoders = {name: namespace[f"_encode_{name}"] for name in schemas}
+    decoders = {name: namespace[f"_decode_{name}"] for name in schemas}
+    return encoders, decoders
+
+
+ENCODERS, DECODERS = compile_schemas(SCHEMAS)
+
+
+# ---------------------------------------------------------------------------
+# Backends
+# ---------------------------------------------------------------------------
+
+# 'python' runs the compiled functions above; 'pb2' runs protobuf message
+# classes generated from the same schemas (cursor_pb2_codec.py), serialized
+# by the protobuf runtime (upb). Set CURSOR_CODEC=pb2 or call set_backend().
+BACKENDS = ('python', 'pb2')
+
+_backend = 'python'
+_pb2_codec = None
+
+
+def set_backend(name: str):
+    """Select the codec backend used by encode_into(), encode() and decode()"""
+    global _backend, _pb2_codec
+    if name not in BACKENDS:
+        raise ValueError(f"unknown codec backend {name!r}, expected one of {BACKENDS}")
+    if name == 'pb2' and _pb2_codec is None:
+        from cursor_pb2_codec import Pb2Codec
+        _pb2_codec = Pb2Codec()
+    _backend = name
+
+
+def get_backend() -> str:
+    return _backend
+
+
+def encode_into(w: ProtobufWriter, message: str, value: Dict[str, Any]):
+    """Append value encoded as the named message to a ProtobufWriter"""
+    if _backend == 'pb2':
+        _pb2_codec.encode_into(w, message, value)
+    else:
+        ENCODERS[message](value, w)
+
+
+def encode(message: str, value: Dict[str, Any]) -> bytes:
+    """Encode value as the named message"""
+    if _backend == 'pb2':
+        return _pb2_codec.encode(message, value)
+    w = ProtobufWriter()
+    ENCODERS[message](value, w)
+    return w.getvalue()
+
+
+def decode(message: str, data: Union[bytes, bytearray, memoryview]) -> Dict[str, Any]:
+    """Decode data as the named message; raises ValueError on malformed input"""
+    if _backend == 'pb2':
+        return _pb2_codec.decode(message, data)
+    return DECODERS[message](data)
+
+
+class MessageTemplate:
+    """A message whose fields are mostly the same on every call
+    
+    Fields not named in dynamic are encoded once, from static and the schema
+    defaults, and kept as bytes. build() is compiled like the encoders above:
+    it appends those bytes and encodes only the dynamic fields in between, in
+    the schema's write order, so the output equals encode() of the combined
+    values. With another backend selected (set_backend('pb2')), build() and
+    build_into() hand the combined values to that backend instead.
+    
+        template = MessageTemplate('Metadata', dynamic=('timestamp',))
+        data = template.build({'timestamp': now})
+    """
+    
+    __slots__ = ('message', 'pieces', 'static', '_build')
+    
+    def __init__(self, message: str, static: Dict[str, Any] = None, dynamic: Tuple[str, ...] = ()):
+        fields = SCHEMAS[message]
+        unknown = (set(dynamic) | set(static or ())) - {field.name for field in fields}
+        if unknown:
+            raise ValueError(f"{message} has no fields {sorted(unknown)}")
+        
+        # Runs of consecutive fields: encoded bytes for static runs, field
+        # names for dynamic ones
+        self.message = message
+        self.pieces: List[Union[bytes, Tuple[str, ...]]] = []
+        # Values of the fields not in dynamic, for the other backends
+        self.static = {
+            field.name: (static or {}).get(field.name, field.default)
+            for field in fields if field.name not in dynamic
+        }
+        namespace = dict(ENCODERS[message].__globals__)
+        lines = ["def _build(value, w):", "    buf = w.buf"]
+        run = []
+        for i, field in enumerate(fields):
+            run.append(field)
+            is_dynamic = field.name in dynamic
+            if i + 1 < len(fields) and (fields[i + 1].name in dynamic) == is_dynamic:
+                continue
+            if is_dynamic:
+                self.pieces.append(tuple(f.name for f in run))
+                lines += _encode_fields_lines(message, run, namespace)
+            else:
+                values = {f.name: None for f in fields}
+                for f in run:
+                    values[f.name] = (static or {}).get(f.name, f.default)
+                w = ProtobufWriter()
+                ENCODERS[message](values, w)
+                namespace[f"_s_{i}"] = w.getvalue()
+                self.pieces.append(namespace[f"_s_{i}"])
+                lines.append(f"    buf += _s_{i}")
+            run = []
+        exec(compile('\n'.join(lines) + '\n', f'<MessageTemplate {message}>', 'exec'), namespace)
+        self._build = namespace['_build']
+    
+    def build_into(self, w: ProtobufWriter, values: Dict[str, Any]):
+        """Append the message with the dynamic fields taken from values"""
+        if _backend != 'python':
+            encode_into(w, self.message, {**self.static, **values})
+        else:
+            self._build(values, w)
+    
+    def build(self, values: Dict[str, Any]) -> bytes:
+        if _backend != 'python':
+            return encode(self.message, {**self.static, **values})
+        w = ProtobufWriter()
+        self._build(values, w)
+        return w.getvalue()
+
+
+def field_sizes(message: str, data: Union[bytes, bytearray, memoryview]) -> Dict[str, int]:
+    """Encoded bytes per top-level field of data, tags and lengths included
+    
+    Keyed by field name, in wire order; fields missing from the schema are
+    keyed 'field_<number>'. Works on the wire bytes, so it reports the same
+    for either backend.
+    """
+    names = {field.number: field.name for field in SCHEMAS[message]}
+    sizes: Dict[str, int] = {}
+    pos = 0
+    end = len(data)
+    while pos < end:
+        start = pos
+        tag, pos = _read_varint(data, pos, end)
+        pos = _skip_field(data, pos, end, tag & 7)
+        name = names.get(tag >> 3, f"field_{tag >> 3}")
+        sizes[name] = sizes.get(name, 0) + pos - start
+    return sizes
+
+
+if os.environ.get('CURSOR_CODEC'):
+    set_backend(os.environ['CURSOR_CODEC'])
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Cache of session bootstraps (the AvailableModels call) per token and session.
+
+CursorHTTP2Client used to POST AvailableModels over a fresh HTTP/1.1
+connection before every chat request, which costs a TLS handshake and a full
+round trip before the request is even sent. SessionCache remembers that a
+session was established, in memory and in a JSON file shared by later
+processes, until:
+
+- ttl seconds have passed since the bootstrap, or
+- a request on the session fails with an auth-related error and the client
+  calls invalidate()
+
+Entries are keyed by a SHA-256 of token and session id, so the file never
+holds the token itself; it is written atomically with mode 0600.
+
+    cache = SessionCache(ttl=1800)
+    if not cache.get(token, session_id):
+        ok = await establish_session(...)
+        cache.put(token, session_id, {'status': 200})
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+
+def default_path() -> Path:
+    """$CURSOR_SESSION_CACHE, else sessions.json under the user cache dir"""
+    if os.environ.get('CURSOR_SESSION_CACHE'):
+        return Path(os.environ['CURSOR_SESSION_CACHE'])
+    base = os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache'
+    return Path(base) / 'cursor-api' / 'sessions.json'
+
+
+class SessionCache:
+    """Session bootstraps kept for ttl seconds, see the module docstring"""
+    
+    TTL = 30 * 60
+    
+    def __init__(self, path: Optional[Path] = None, ttl: float = TTL):
+        self.path = Path(path) if path is not None else default_path()
+        self.ttl = ttl
+        self._entries: Optional[Dict[str, dict]] = None  # Loaded on first use
+    
+    @staticmethod
+    def key(token: str, session_id: str) -> str:
+        return hashlib.sha256(f"{token}\0{session_id}".encode('utf-8')).hexdigest()
+    
+    def get(self, token: str, session_id: str) -> Optional[dict]:
+        """The cached bootstrap for token and session_id, None if missing or expired"""
+        entry = self._load().get(self.key(token, session_id))
+        if entry is None:
+            # Another process may have bootstrapped the session since we loaded
+            self._entries = None
+            entry = self._load().get(self.key(token, session_id))
+        if entry is None or time.time() - entry['established'] >= self.ttl:
+            return None
+        return entry
+    
+    def put(self, token: str, session_id: str, data: Optional[dict] = None) -> dict:
+        """Record a successful bootstrap of the session"""
+        entry = dict(data or {}, established=time.time())
+        self._entries = self._read()
+        self._entries[self.key(token, session_id)] = entry
+        self._write()
+        return entry
+    
+    def invalidate(self, token: str, session_id: str):
+        """Forget the session, e.g. after the server rejected it"""
+        self._entries = self._read()
+        if self._entries.pop(self.key(token, session_id), None) is not None:
+            self._write()
+    
+    def _load(self) -> Dict[str, dict]:
+        if self._entries is None:
+            self._entries = self._read()
+        return self._entries
+    
+    def _read(self) -> Dict[str, dict]:
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(entries, dict):
+            return {}
+        # Drop expired entries so the file does not grow without bound
+        now = time.time()
+        return {
+            key: entry for key, entry in entries.items()
+            if isinstance(entry, dict) and now - entry.get('established', 0) < self.ttl
+        }
+    
+    def _write(self):
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix='.sessions-')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self._entries, f)
+            os.chmod(tmp, 0o600)
+            os.replace(tmp, self.path)
+        except OSError:
+            # The in-memory entries still spare this process the bootstrap
+            pass
+
+
+# Shared by the clients unless they are given their own cache
+DEFAULT_SESSION_CACHE = SessionCache()
@@ -5,12 +5,14 @@ Handles frame-based protobuf messages with compression support.
 """
 
 import struct
-import gzip
+import time
 import json
-from typing import List, Optional, Generator, Tuple
+from typing import AsyncIterable, AsyncIterator, Iterator, List, Optional, Generator, Tuple, Union
 import sys
 import os
 
+from cursor_compression import GzipFrameInflater
+
 # Add cursor-grpc to path for protobuf imports
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'cursor-grpc'))
 
@@ -22,25 +24,277 @@ except ImportError as e:
     sys.exit(1)
 
 
+# Tags of the canonical text-delta frame (see TASK-2-bidi-service.md,
+# TASK-7-protobuf-schemas.md):
+#   StreamUnifiedChatResponseWithTools.stream_unified_chat_response = 2 (wire type 2)
+#   StreamUnifiedChatResponse.text = 1 (wire type 2)
+_TAG_CHAT_RESPONSE = (2 << 3) | 2
+_TAG_TEXT = (1 << 3) | 2
+
+
+def _read_length(data, pos: int, end: int) -> Tuple[int, int]:
+    """Read a length varint, return (length, new_position) or (-1, pos) on truncation"""
+    length = 0
+    shift = 0
+    while pos < end:
+        b = data[pos]
+        pos += 1
+        length |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return length, pos
+        shift += 7
+    return -1, pos
+
+
+def extract_text_delta(data: Union[bytes, memoryview]) -> Optional[str]:
+    """
+    Fast path for the common chat frame: pull stream_unified_chat_response.text
+    straight from the wire format of a StreamUnifiedChatResponseWithTools.
+    
+    Only the canonical layout is accepted, where the frame holds nothing but
+    one stream_unified_chat_response whose only field is a non-empty text.
+    Anything else (tool calls, thinking, citations, extra fields) returns None
+    and the caller falls back to the generated-class parse.
+    """
+    end = len(data)
+    if end < 4 or data[0] != _TAG_CHAT_RESPONSE:
+        return None
+    
+    # Single-byte lengths (deltas under 128 bytes) are read inline
+    inner_len = data[1]
+    pos = 2
+    if inner_len & 0x80:
+        inner_len, pos = _read_length(data, 1, end)
+    if inner_len < 2 or pos + inner_len != end or data[pos] != _TAG_TEXT:
+        return None
+    
+    text_len = data[pos + 1]
+    pos += 2
+    if text_len & 0x80:
+        text_len, pos = _read_length(data, pos - 1, end)
+    if text_len <= 0 or pos + text_len != end:
+        return None
+    
+    try:
+        return bytes(data[pos:end]).decode('utf-8')
+    except UnicodeDecodeError:
+        return None
+
+
+class DecoderMetrics:
+    """
+    Counters describing what a decoder has processed.
+    
+    Updated inline on every frame (a few integer adds and two perf_counter
+    calls), so it can stay enabled in production. One instance can be shared
+    by many decoders to aggregate a whole gateway; snapshot() and to_json()
+    export the current values.
+    """
+    
+    __slots__ = ('frames', 'wire_bytes', 'decompressed_bytes', 'errors',
+                 'largest_frame', 'parse_time', 'last_error')
+    
+    FRAME_TYPE_NAMES = {0: 'protobuf', 1: 'gzip_protobuf', 2: 'json', 3: 'gzip_json'}
+    
+    def __init__(self):
+        self.frames = {}              # frame type byte -> count
+        self.wire_bytes = 0           # Envelope + payload bytes as received
+        self.decompressed_bytes = 0   # Output of gzip frames (types 1 and 3)
+        self.errors = {}              # error kind -> count
+        self.largest_frame = 0        # Largest payload seen on the wire
+        self.parse_time = 0.0         # Seconds spent decoding frame payloads
+        self.last_error = None        # Message of the most recent error
+    
+    def record_error(self, kind: str, error: Exception):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+        self.last_error = f"{kind}: {error}"
+    
+    def merge(self, other: 'DecoderMetrics'):
+        """Add another decoder's counters into this one"""
+        for frame_type, count in other.frames.items():
+            self.frames[frame_type] = self.frames.get(frame_type, 0) + count
+        for kind, count in other.errors.items():
+            self.errors[kind] = self.errors.get(kind, 0) + count
+        self.wire_bytes += other.wire_bytes
+        self.decompressed_bytes += other.decompressed_bytes
+        self.largest_frame = max(self.largest_frame, other.largest_frame)
+        self.parse_time += other.parse_time
+        self.last_error = other.last_error or self.last_error
+    
+    def snapshot(self) -> dict:
+        """Current values as a plain dict"""
+        return {
+            'frames': {self.FRAME_TYPE_NAMES.get(t, f'type_{t}'): n for t, n in self.frames.items()},
+            'wire_bytes': self.wire_bytes,
+            'decompressed_bytes': self.decompressed_bytes,
+            'errors': dict(self.errors),
+            'largest_frame': self.largest_frame,
+            'parse_time': self.parse_time,
+            'last_error': self.last_error,
+        }
+    
+    def to_json(self) -> str:
+        return json.dumps(self.snapshot())
+
+
 class StreamMessage:
-    """Represents a parsed streaming message."""
+    """
+    Base class for decoded stream events.
     
-    def __init__(self, msg_type: str, content: str):
-        self.msg_type = msg_type
-        self.content = content
+    Each event type is a slotted subclass holding its decoded payload as-is
+    (text, or the generated protobuf message for thinking, citations and tool
+    calls). ``msg_type`` and ``content`` keep the original string interface;
+    ``content`` is only rendered when asked for.
+    """
+    
+    __slots__ = ()
+    msg_type = ""
+    
+    @property
+    def content(self) -> str:
+        return ""
     
     def __repr__(self):
-        return f"StreamMessage(type={self.msg_type}, content={repr(self.content[:100])}{'...' if len(self.content) > 100 else ''})"
+        content = self.content
+        return f"{type(self).__name__}({repr(content[:100])}{'...' if len(content) > 100 else ''})"
+
+
+class TextDelta(StreamMessage):
+    """Assistant text delta (stream_unified_chat_response.text)"""
+    
+    __slots__ = ('text',)
+    msg_type = "content"
+    
+    def __init__(self, text: str):
+        self.text = text
+    
+    @property
+    def content(self) -> str:
+        return self.text
+
+
+class DebugPrompt(StreamMessage):
+    """Server-side filled prompt (stream_unified_chat_response.filled_prompt)"""
+    
+    __slots__ = ('text',)
+    msg_type = "debug"
+    
+    def __init__(self, text: str):
+        self.text = text
+    
+    @property
+    def content(self) -> str:
+        return self.text
+
+
+class Thinking(StreamMessage):
+    """Reasoning block (stream_unified_chat_response.thinking message)"""
+    
+    __slots__ = ('thinking',)
+    msg_type = "thinking"
+    
+    def __init__(self, thinking):
+        self.thinking = thinking
+    
+    @property
+    def content(self) -> str:
+        return str(self.thinking)
+
+
+class Citation(StreamMessage):
+    """Web citation (stream_unified_chat_response.web_citation message)"""
+    
+    __slots__ = ('citation',)
+    msg_type = "web_reference"
+    
+    def __init__(self, citation):
+        self.citation = citation
+    
+    @property
+    def content(self) -> str:
+        return str(self.citation)
+
+
+class ToolCallEvent(StreamMessage):
+    """Tool call request carrying the ClientSideToolV2Call message itself"""
+    
+    __slots__ = ('call',)
+    msg_type = "tool_call"
+    
+    def __init__(self, call):
+        self.call = call
+    
+    @property
+    def content(self) -> str:
+        return str(self.call)
+
+
+class StreamError(StreamMessage):
+    """End-of-stream JSON frame carrying an error"""
+    
+    __slots__ = ('payload',)
+    msg_type = "error"
+    
+    def __init__(self, payload: dict):
+        self.payload = payload
+    
+    @property
+    def error(self):
+        return self.payload.get('error')
+    
+    @property
+    def content(self) -> str:
+        return json.dumps(self.payload)
+
+
+class StreamEnd(StreamMessage):
+    """Empty end-of-stream JSON frame"""
+    
+    __slots__ = ()
+    msg_type = "stream_end"
+
+
+class JsonMessage(StreamMessage):
+    """Any other JSON frame, kept as text"""
+    
+    __slots__ = ('text',)
+    msg_type = "json"
+    
+    def __init__(self, text: str):
+        self.text = text
+    
+    @property
+    def content(self) -> str:
+        return self.text
 
 
 class CursorStreamDecoder:
     """
     Decodes Cursor streaming responses using proper frame-based protobuf parsing.
     Based on cursor-api/src/core/stream/decoder.rs implementation.
+    
+    Incoming bytes are appended to a single buffer and consumed through a read
+    offset, so a large burst of frames is parsed in linear time. The consumed
+    prefix is only dropped once it grows past COMPACT_THRESHOLD.
     """
     
-    def __init__(self):
+    # Drop consumed bytes from the front of the buffer once they exceed this size
+    COMPACT_THRESHOLD = 64 * 1024
+    
+    # Message types produced by the JSON end-of-stream frame (types 2 and 3)
+    END_STREAM_TYPES = ("stream_end", "error", "json")
+    
+    def __init__(self, fast_text_path: bool = True,
+                 max_decompressed_size: int = GzipFrameInflater.MAX_SIZE,
+                 metrics: Optional[DecoderMetrics] = None):
         self.buffer = bytearray()
+        self.offset = 0  # Read position of the next unparsed frame in self.buffer
+        # Extract plain text deltas from the wire format instead of a full parse
+        self.fast_text_path = fast_text_path
+        # One inflater per stream for gzip frames, bounded by max_decompressed_size
+        self.inflater = GzipFrameInflater(max_decompressed_size)
+        # Pass a shared DecoderMetrics to aggregate several streams
+        self.metrics = metrics if metrics is not None else DecoderMetrics()
     
     def feed_data(self, data: bytes) -> List[StreamMessage]:
         """
@@ -51,33 +305,95 @@ class CursorStreamDecoder:
             return []
         
         self.buffer.extend(data)
-        messages = []
+        return list(self._drain())
+    
+    async def events(self, chunks: AsyncIterable[bytes]) -> AsyncIterator[StreamMessage]:
+        """
+        Decode an async byte stream, e.g. ``response.aiter_bytes()``.
         
-        while len(self.buffer) >= 5:  # Minimum frame header size
+        Each message is yielded as soon as its frame is complete. The next
+        chunk is only pulled once the consumer asks for the next message, so
+        a slow consumer applies backpressure to the transport. Iteration stops
+        after the JSON end-of-stream frame.
+        """
+        async for chunk in chunks:
+            if not chunk:
+                continue
+            self.buffer.extend(chunk)
+            for message in self._drain():
+                yield message
+                if message.msg_type in self.END_STREAM_TYPES:
+                    return
+    
+    def _drain(self) -> Iterator[StreamMessage]:
+        """
+        Parse every complete frame in the buffer, yielding messages one by one.
+        
+        Frame payloads are handed to the message handlers as memoryview slices
+        of the buffer; handlers must not keep a reference past their return.
+        The read offset is saved before each yield so an abandoned iteration
+        leaves the decoder consistent.
+        """
+        buffer = self.buffer
+        offset = self.offset
+        end = len(buffer)
+        
+        while end - offset >= 5:  # Minimum frame header size
             # Parse frame header
-            msg_type = self.buffer[0]
-            msg_len = struct.unpack('>I', self.buffer[1:5])[0]  # Big endian uint32
+            msg_type = buffer[offset]
+            msg_len = struct.unpack_from('>I', buffer, offset + 1)[0]  # Big endian uint32
             
             # Check if we have the complete message
-            if len(self.buffer) < 5 + msg_len:
+            frame_end = offset + 5 + msg_len
+            if frame_end > end:
                 break  # Wait for more data
             
-            # Extract message data
-            msg_data = bytes(self.buffer[5:5 + msg_len])
-            self.buffer = self.buffer[5 + msg_len:]  # Remove processed data
+            msg_start = offset + 5
+            offset = frame_end
             
             # Process message based on type
             if msg_len == 0:
                 continue  # Skip empty messages
             
-            message = self._process_message(msg_type, msg_data)
+            with memoryview(buffer) as view, view[msg_start:frame_end] as msg_data:
+                message = self._process_message(msg_type, msg_data)
             if message:
-                messages.append(message)
+                self.offset = offset
+                yield message
+        
+        # Compact: reset for free when fully drained, otherwise only once the
+        # consumed prefix is large enough to be worth the copy
+        if offset == end:
+            buffer.clear()
+            offset = 0
+        elif offset >= self.COMPACT_THRESHOLD:
+            del buffer[:offset]
+            offset = 0
+        self.offset = offset
+    
+    def decode_frame(self, msg_type: int, msg_data: Union[bytes, memoryview]) -> Optional[StreamMessage]:
+        """Decode a single frame payload whose envelope was already parsed by the caller."""
+        if not msg_data:
+            return None
+        return self._process_message(msg_type, msg_data)
+    
+    def _process_message(self, msg_type: int, msg_data: memoryview) -> Optional[StreamMessage]:
+        """Process a single message based on its type, recording metrics."""
+        metrics = self.metrics
+        size = len(msg_data)
+        metrics.frames[msg_type] = metrics.frames.get(msg_type, 0) + 1
+        metrics.wire_bytes += 5 + size
+        if size > metrics.largest_frame:
+            metrics.largest_frame = size
         
-        return messages
+        start = time.perf_counter()
+        try:
+            return self._decode_payload(msg_type, msg_data)
+        finally:
+            metrics.parse_time += time.perf_counter() - start
     
-    def _process_message(self, msg_type: int, msg_data: bytes) -> Optional[StreamMessage]:
-        """Process a single message based on its type."""
+    def _decode_payload(self, msg_type: int, msg_data: memoryview) -> Optional[StreamMessage]:
+        """Decode a frame payload; failures are counted in metrics.errors."""
         try:
             if msg_type == 0:
                 # Raw protobuf message
@@ -85,31 +401,38 @@ class CursorStreamDecoder:
             elif msg_type == 1:
                 # Gzip compressed protobuf message
                 try:
-                    decompressed = gzip.decompress(msg_data)
-                    return self._handle_protobuf_message(decompressed)
+                    decompressed = self.inflater.inflate(msg_data)
                 except Exception as e:
-                    print(f"Failed to decompress gzip protobuf: {e}", file=sys.stderr)
+                    self.metrics.record_error('decompress', e)
                     return None
+                self.metrics.decompressed_bytes += len(decompressed)
+                return self._handle_protobuf_message(decompressed)
             elif msg_type == 2:
                 # Raw JSON message
                 return self._handle_json_message(msg_data)
             elif msg_type == 3:
                 # Gzip compressed JSON message
                 try:
-                    decompressed = gzip.decompress(msg_data)
-                    return self._handle_json_message(decompressed)
+                    decompressed = self.inflater.inflate(msg_data)
                 except Exception as e:
-                    print(f"Failed to decompress gzip JSON: {e}", file=sys.stderr)
+                    self.metrics.record_error('decompress', e)
                     return None
+                self.metrics.decompressed_bytes += len(decompressed)
+                return self._handle_json_message(decompressed)
             else:
-                print(f"Unknown message type: {msg_type}", file=sys.stderr)
+                self.metrics.record_error('unknown_type', ValueError(f"message type {msg_type}"))
                 return None
         except Exception as e:
-            print(f"Error processing message type {msg_type}: {e}", file=sys.stderr)
+            self.metrics.record_error('other', e)
             return None
     
-    def _handle_protobuf_message(self, msg_data: bytes) -> Optional[StreamMessage]:
+    def _handle_protobuf_message(self, msg_data: Union[bytes, memoryview]) -> Optional[StreamMessage]:
         """Handle protobuf message data."""
+        if self.fast_text_path:
+            text = extract_text_delta(msg_data)
+            if text:
+                return TextDelta(text)
+        
         try:
             response = StreamUnifiedChatResponseWithTools()
             response.ParseFromString(msg_data)
@@ -119,42 +442,42 @@ class CursorStreamDecoder:
                 chat_response = response.stream_unified_chat_response
                 
                 if chat_response.text:
-                    return StreamMessage("content", chat_response.text)
+                    return TextDelta(chat_response.text)
                 elif hasattr(chat_response, 'filled_prompt') and chat_response.filled_prompt:
-                    return StreamMessage("debug", chat_response.filled_prompt)
+                    return DebugPrompt(chat_response.filled_prompt)
                 elif hasattr(chat_response, 'thinking') and chat_response.thinking:
-                    return StreamMessage("thinking", str(chat_response.thinking))
+                    return Thinking(chat_response.thinking)
                 elif hasattr(chat_response, 'web_citation') and chat_response.web_citation:
-                    return StreamMessage("web_reference", str(chat_response.web_citation))
+                    return Citation(chat_response.web_citation)
             
             elif response.HasField('client_side_tool_v2_call'):
-                return StreamMessage("tool_call", str(response.client_side_tool_v2_call))
+                return ToolCallEvent(response.client_side_tool_v2_call)
             
             # If no recognized content, return None
             return None
             
         except Exception as e:
-            print(f"Failed to parse protobuf message: {e}", file=sys.stderr)
+            self.metrics.record_error('protobuf', e)
             return None
     
-    def _handle_json_message(self, msg_data: bytes) -> Optional[StreamMessage]:
+    def _handle_json_message(self, msg_data: Union[bytes, memoryview]) -> Optional[StreamMessage]:
         """Handle JSON message data."""
         try:
             if len(msg_data) == 2:
-                return StreamMessage("stream_end", "")
+                return StreamEnd()
             
-            text = msg_data.decode('utf-8', errors='ignore')
+            text = bytes(msg_data).decode('utf-8', errors='ignore')
             try:
                 parsed = json.loads(text)
-                if 'error' in parsed:
-                    return StreamMessage("error", json.dumps(parsed))
+                if isinstance(parsed, dict) and 'error' in parsed:
+                    return StreamError(parsed)
             except json.JSONDecodeError:
                 pass
             
-            return StreamMessage("json", text)
+            return JsonMessage(text)
             
         except Exception as e:
-            print(f"Failed to handle JSON message: {e}", file=sys.stderr)
+            self.metrics.record_error('json', e)
             return None
 
 
@@ -164,9 +487,8 @@ def decode_cursor_response(response_data: bytes) -> Generator[StreamMessage, Non
     Yields StreamMessage objects as they're parsed.
     """
     decoder = CursorStreamDecoder()
-    messages = decoder.feed_data(response_data)
-    for message in messages:
-        yield message
+    decoder.buffer.extend(response_data)
+    yield from decoder._drain()
 
 
 if __name__ == "__main__":
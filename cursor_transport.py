@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+HTTP connections shared by all clients.
+
+Every call used to open its own httpx.AsyncClient (or aiohttp session) and
+pay a TCP and TLS handshake, plus the HTTP/2 preface, before the request
+went out. ConnectionPool keeps one long-lived httpx.AsyncClient per event
+loop and protocol, and its connection pool keeps warm connections per
+origin:
+
+- HTTP/2 connections multiplex concurrent requests as streams
+- connections idle for keepalive_expiry seconds are closed
+- at most max_connections are open per client, max_keepalive of them idle
+
+    async with DEFAULT_POOL.client(http2=True, timeout=30.0) as client:
+        async with client.stream('POST', url, headers=headers, content=body) as response:
+            ...
+
+The client is shared: leaving the block does not close it, and timeout is
+applied per request. aclose() closes the connections of the running loop.
+CursorBidiClient drives its own h2 connection for bidirectional streams and
+is not pooled.
+"""
+
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional
+
+import httpx
+
+
+class PooledClient:
+    """A shared httpx.AsyncClient with a default timeout for each request"""
+    
+    __slots__ = ('client', 'timeout')
+    
+    def __init__(self, client: httpx.AsyncClient, timeout: Optional[float] = None):
+        self.client = client
+        self.timeout = timeout
+    
+    def _with_timeout(self, kwargs: dict) -> dict:
+        if self.timeout is not None:
+            kwargs.setdefault('timeout', self.timeout)
+        return kwargs
+    
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        return await self.client.request(method, url, **self._with_timeout(kwargs))
+    
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.client.post(url, **self._with_timeout(kwargs))
+    
+    def stream(self, method: str, url: str, **kwargs):
+        return self.client.stream(method, url, **self._with_timeout(kwargs))
+    
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class ConnectionPool:
+    """Long-lived httpx clients per event loop, see the module docstring"""
+    
+    MAX_CONNECTIONS = 20
+    MAX_KEEPALIVE = 10
+    KEEPALIVE_EXPIRY = 120.0
+    
+    def __init__(self, max_connections: int = MAX_CONNECTIONS, max_keepalive: int = MAX_KEEPALIVE,
+                 keepalive_expiry: float = KEEPALIVE_EXPIRY):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive,
+            keepalive_expiry=keepalive_expiry,
+        )
+        # loop -> {http2: client}; httpx clients are bound to the loop they
+        # first run on, and asyncio.run() gives every call its own loop
+        self._clients = weakref.WeakKeyDictionary()
+        self.clients_opened = 0
+    
+    def get(self, http2: bool = True) -> httpx.AsyncClient:
+        """The shared client for the running loop; http2=False for HTTP/1.1 only"""
+        clients = self._clients.setdefault(asyncio.get_running_loop(), {})
+        client = clients.get(http2)
+        if client is None or client.is_closed:
+            client = clients[http2] = httpx.AsyncClient(http2=http2, limits=self.limits)
+            self.clients_opened += 1
+        return client
+    
+    @asynccontextmanager
+    async def client(self, http2: bool = True, timeout: Optional[float] = None) -> AsyncIterator[PooledClient]:
+        """Shared client with timeout as the default per request; not closed on exit"""
+        yield PooledClient(self.get(http2), timeout)
+    
+    async def aclose(self):
+        """Close the clients, and their connections, of the running loop"""
+        clients = self._clients.pop(asyncio.get_running_loop(), {})
+        for client in clients.values():
+            await client.aclose()
+
+
+# Shared by the clients unless they are given their own pool
+DEFAULT_POOL = ConnectionPool()
@@ -4,12 +4,17 @@
 import sys
 import os
 import struct
+import asyncio
+import gzip
 
 # Add cursor-grpc to path
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'cursor-grpc'))
 
-from cursor_streaming_decoder import CursorStreamDecoder
-from server_full_pb2 import StreamUnifiedChatResponseWithTools, StreamUnifiedChatResponse
+from cursor_streaming_decoder import CursorStreamDecoder, TextDelta, Thinking, ToolCallEvent
+from server_full_pb2 import StreamUnifiedChatResponseWithTools, StreamUnifiedChatResponse, ClientSideToolV2Call
+from cursor_chat_proto import ProtobufWriter, MessageView, ToolCallDecoder, ToolCallAssembler
+from cursor_schema import encode, decode, set_backend, field_sizes, MessageTemplate
+from cursor_compression import CompressionPolicy
 
 def create_real_test_frame():
     """Create a proper protobuf message frame"""
@@ -53,10 +58,930 @@ def test_real_decoder():
         traceback.print_exc()
         return False
 
+def test_split_and_burst_feeding():
+    """Frames split across feed_data calls decode the same as one burst"""
+    frames = create_real_test_frame() * 3 + struct.pack('>BI', 2, 2) + b'{}'
+    
+    burst = [(m.msg_type, m.content) for m in CursorStreamDecoder().feed_data(frames)]
+    
+    decoder = CursorStreamDecoder()
+    trickle = []
+    for i in range(len(frames)):
+        trickle.extend((m.msg_type, m.content) for m in decoder.feed_data(frames[i:i + 1]))
+    
+    assert burst == trickle
+    assert [t for t, _ in burst] == ["content"] * 3 + ["stream_end"]
+    assert len(decoder.buffer) == 0
+
+def test_events_stop_at_end_of_stream():
+    """events() yields per frame and ignores data after the end-of-stream frame"""
+    frames = create_real_test_frame() * 2 + struct.pack('>BI', 2, 2) + b'{}' + create_real_test_frame()
+    
+    async def chunks():
+        for i in range(0, len(frames), 7):
+            yield frames[i:i + 7]
+    
+    async def collect():
+        return [m.msg_type async for m in CursorStreamDecoder().events(chunks())]
+    
+    assert asyncio.run(collect()) == ["content", "content", "stream_end"]
+
+def test_fast_text_path_matches_full_parse():
+    """The wire-level text fast path agrees with the generated-class parse"""
+    frames = b''
+    for text, thinking, tool_call_id in [("x" * 300, "", ""), ("", "hmm", ""), ("hi", "", "toolu_1"), ("ok", "", "")]:
+        response = StreamUnifiedChatResponseWithTools()
+        if tool_call_id:
+            response.client_side_tool_v2_call.tool_call_id = tool_call_id
+        else:
+            response.stream_unified_chat_response.text = text
+            if thinking:
+                response.stream_unified_chat_response.thinking.text = thinking
+        payload = response.SerializeToString()
+        frames += struct.pack('>BI', 0, len(payload)) + payload
+    
+    fast = [(m.msg_type, m.content) for m in CursorStreamDecoder().feed_data(frames)]
+    full = [(m.msg_type, m.content) for m in CursorStreamDecoder(fast_text_path=False).feed_data(frames)]
+    assert fast == full
+    assert [t for t, _ in fast] == ["content", "thinking", "tool_call", "content"]
+    
+    # Structured payloads are kept as decoded, not flattened to strings
+    text, thinking, tool_call, _ = CursorStreamDecoder().feed_data(frames)
+    assert isinstance(text, TextDelta) and text.text == "x" * 300
+    assert isinstance(thinking, Thinking) and thinking.thinking.text == "hmm"
+    assert isinstance(tool_call, ToolCallEvent) and tool_call.call.tool_call_id == "toolu_1"
+
+def test_gzip_frames_and_size_limit():
+    """Gzip frames inflate through the per-stream inflater and honour its limit"""
+    payload = create_real_test_frame()[5:]
+    big = gzip.compress(payload + b'\x00' * 4096)  # Trailing padding past the limit
+    frames = (struct.pack('>BI', 1, len(gzip.compress(payload))) + gzip.compress(payload)
+              + struct.pack('>BI', 1, len(big)) + big
+              + struct.pack('>BI', 3, len(gzip.compress(b'{}'))) + gzip.compress(b'{}'))
+    
+    decoder = CursorStreamDecoder(max_decompressed_size=1024)
+    messages = decoder.feed_data(frames)
+    assert [m.msg_type for m in messages] == ["content", "stream_end"]
+    
+    stats = decoder.metrics.snapshot()
+    assert stats['frames'] == {'gzip_protobuf': 2, 'gzip_json': 1}
+    assert stats['wire_bytes'] == len(frames)
+    assert stats['decompressed_bytes'] == len(payload) + 2
+    assert stats['errors'] == {'decompress': 1}
+    assert stats['largest_frame'] == len(big)
+
+def text_frame(text, compress=False):
+    response = StreamUnifiedChatResponseWithTools()
+    response.stream_unified_chat_response.text = text
+    payload = response.SerializeToString()
+    if compress:
+        payload = gzip.compress(payload)
+    return struct.pack('>BI', int(compress), len(payload)) + payload
+
+def test_capture_batches_hold_whole_frames():
+    """Batches end on frame boundaries at either limit; a truncated tail is left out"""
+    from cursor_capture_decoder import BATCH_BYTES, BATCH_FRAMES, iter_batches
+    
+    small = [text_frame(f"delta {i}") for i in range(BATCH_FRAMES + 10)]
+    big = text_frame("x" * BATCH_BYTES)  # Crosses the byte limit on its own
+    data = b''.join(small) + big + small[0] + small[1][:-3]
+    
+    batches = list(iter_batches(data))
+    frame_ends = set()
+    offset = 0
+    for frame in small + [big, small[0]]:
+        offset += len(frame)
+        frame_ends.add(offset)
+    
+    assert batches[0] == (0, sum(map(len, small[:BATCH_FRAMES])))
+    assert all(end in frame_ends for _, end in batches)
+    assert all(a[1] == b[0] for a, b in zip(batches, batches[1:]))
+    # The big frame closes its batch instead of being split across two
+    big_end = sum(map(len, small)) + len(big)
+    assert (batches[1][0], big_end) == batches[1]
+    assert batches[-1][1] == len(data) - len(small[1]) + 3
+
+def test_capture_decoder_keeps_order_across_workers():
+    """Gzip frames decode and lines come out in capture order with several workers"""
+    import io
+    import json
+    import tempfile
+    from cursor_capture_decoder import BATCH_FRAMES, decode_batch, decode_capture
+    
+    count = BATCH_FRAMES * 3 + 5
+    frames = [text_frame(f"delta {i}", compress=i % 7 == 0) for i in range(count)]
+    with tempfile.NamedTemporaryFile(suffix='.bin') as f:
+        f.write(b''.join(frames))
+        f.flush()
+        
+        lines = [json.loads(line) for line in decode_batch(f.name, 0, len(frames[0]) + len(frames[1]))]
+        assert [(line['frame_type'], line['content']) for line in lines] == [(1, "delta 0"), (0, "delta 1")]
+        
+        out = io.StringIO()
+        assert decode_capture(f.name, out, workers=2, max_in_flight=3) == count
+    
+    lines = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert [line['content'] for line in lines] == [f"delta {i}" for i in range(count)]
+    assert [line['offset'] for line in lines] == sorted(line['offset'] for line in lines)
+
+def test_compression_policy_decides_by_size_and_ratio():
+    """Small and incompressible payloads go out as is, the rest gzipped"""
+    policy = CompressionPolicy(min_size=1024, min_gain=0.1, sample_size=64 * 1024)
+    text = b"def f(x):\n    return x\n" * 4000
+    noise = os.urandom(200 * 1024)
+    
+    assert policy.frame(b"hi") == struct.pack('>BI', 0, 2) + b"hi"
+    framed = policy.frame(text)
+    assert framed[0] == 1 and gzip.decompress(framed[5:]) == text
+    assert policy.frame(noise) == struct.pack('>BI', 0, len(noise)) + noise
+    forced = policy.frame(b"hi", compress=True)
+    assert forced[0] == 1 and gzip.decompress(forced[5:]) == b"hi"
+    assert policy.frame(text, compress=False) == struct.pack('>BI', 0, len(text)) + text
+    
+    stats = policy.stats
+    assert (stats.messages, stats.compressed, stats.skipped_small, stats.skipped_ratio) == (5, 2, 1, 1)
+    assert stats.skipped_forced == 1
+    assert stats.messages == stats.compressed + stats.skipped_small + stats.skipped_ratio + stats.skipped_forced
+    assert stats.bytes_in == 2 + len(text) + len(noise) + 2 + len(text)
+    assert stats.bytes_out == 2 + len(framed) - 5 + len(noise) + len(forced) - 5 + len(text)
+
+def test_protobuf_writer_nested_lengths():
+    """Nested messages backpatch their length, growing the varint when needed"""
+    for size in (1, 125, 126, 16380, 16381):
+        w = ProtobufWriter()
+        w.write_varint_field(1, 2)
+        with w.message(2):
+            w.write_string(1, "x" * size)
+        w.write_varint_field(3, -1)
+        
+        response = StreamUnifiedChatResponseWithTools()
+        response.stream_unified_chat_response.text = "x" * size
+        expected = (b'\x08\x02' + response.SerializeToString()
+                    + b'\x18' + b'\xff' * 9 + b'\x01')
+        assert w.getvalue() == expected
+
+def test_schema_codec_matches_generated_classes():
+    """Compiled schema codecs agree with the generated protobuf classes"""
+    fields = {
+        'tool': 5, 'tool_call_id': "toolu_1", 'timeout_ms': 30000.0, 'name': "read_file",
+        'raw_args': '{"path": "x"}' * 20, 'is_streaming': True, 'is_last_message': True,
+        'tool_index': 300, 'model_call_id': "call_1",
+    }
+    call = ClientSideToolV2Call(**fields)
+    
+    assert encode('ClientSideToolV2Call', fields) == call.SerializeToString()
+    assert decode('ClientSideToolV2Call', call.SerializeToString()) == fields
+    assert decode('ClientSideToolV2Call', memoryview(call.SerializeToString())) == fields
+    
+    try:
+        decode('ClientSideToolV2Call', call.SerializeToString()[:-1])
+        assert False, "truncated message decoded"
+    except ValueError:
+        pass
+
+def test_repeated_enums_are_packed():
+    """supported_tools is written packed and read back in either form"""
+    tools = [5, 6, 300]
+    packed = encode('StreamUnifiedChatRequest', {'supported_tools': tools})
+    run = b'\xea\x01\x04\x05\x06\xac\x02'
+    assert run in packed
+    assert decode('StreamUnifiedChatRequest', packed)['supported_tools'] == tools
+    
+    w = ProtobufWriter()
+    for tool in tools:
+        w.write_enum_field(29, tool)
+    w.write_bytes_field(29, b'\x07')
+    assert decode('StreamUnifiedChatRequest', w.getvalue())['supported_tools'] == tools + [7]
+    
+    try:
+        decode('StreamUnifiedChatRequest', b'\xea\x01\x02\x05\xac\x02')
+        assert False, "varint running past the packed run decoded"
+    except ValueError:
+        pass
+    
+    sizes = field_sizes('StreamUnifiedChatRequest', packed)
+    assert sizes['supported_tools'] == len(run) and sum(sizes.values()) == len(packed)
+
+def test_agent_conversation_reuses_encoded_messages():
+    """AgentConversation requests match a plain message list, ids stay stable"""
+    from cursor_agent_client import AgentConversation, CursorAgentClient
+    client = CursorAgentClient.__new__(CursorAgentClient)
+    
+    def request(messages):
+        fields = decode('StreamUnifiedChatRequest', client.encode_agent_request(messages, "m"))
+        del fields['conversation_id'], fields['metadata']
+        return fields
+    
+    history = [{'role': 'user', 'content': "a"}, {'role': 'assistant', 'content': "b"}]
+    conversation = AgentConversation(history)
+    first = request(conversation)
+    conversation.append({'role': 'user', 'content': "c é"})
+    second = request(conversation)
+    
+    assert second['message_ids'][:1] == first['message_ids']
+    assert second['messages'][:1] == first['messages']
+    assert [m['message_id'] for m in second['message_ids']] == [
+        conversation.message_ids[0], conversation.message_ids[2]]
+    
+    expected = request(history + [{'role': 'user', 'content': "c é"}])
+    for fields in (second, expected):
+        for message in fields['messages'] + fields['message_ids']:
+            del message['message_id']
+    assert second == expected
+    
+    # Assistant and tool turns are not sent
+    before = request(conversation)
+    conversation.append({'role': 'assistant', 'content': "d"})
+    conversation.append({'role': 'tool', 'tool_call_id': "toolu_1", 'content': "e"})
+    assert request(conversation) == before
+    
+    # The verbose report reads the encoded request instead of encoding it again
+    encoded = client.encode_agent_request(conversation, "m")
+    report = client.field_size_report(encoded)
+    assert sum(report.values()) == len(encoded)
+    assert list(report.values()) == sorted(report.values(), reverse=True)
+    assert client.wrap_agent_request(encoded) == encode('StreamUnifiedChatRequestWithTools', {'request': encoded})
+
+def test_message_template_matches_encode():
+    """Static fields encoded once plus dynamic ones give encode()'s bytes"""
+    static = {'is_agentic': True, 'supported_tools': [5, 6], 'chat_mode': "agent"}
+    dynamic = ('messages', 'conversation_id', 'metadata')
+    template = MessageTemplate('StreamUnifiedChatRequest', static=static, dynamic=dynamic)
+    metadata = MessageTemplate('Metadata', dynamic=('timestamp',))
+    
+    for i in range(3):
+        values = {
+            'messages': [{'content': f"hi {i}", 'role': 1}] * i,
+            'conversation_id': f"conv-{i}",
+            'metadata': metadata.build({'timestamp': f"t{i}"}),
+        }
+        assert template.build(values) == encode('StreamUnifiedChatRequest', {**static, **values})
+    assert metadata.build({'timestamp': "t"}) == encode('Metadata', {'timestamp': "t"})
+    
+    # Templates follow the selected backend; the generated classes write
+    # ClientSideToolV2Result in field-number order, unlike the Python codecs
+    result = MessageTemplate('ClientSideToolV2Result', static={'tool': 3}, dynamic=('tool_call_id', 'error'))
+    values = {'tool_call_id': "toolu_1", 'error': {'client_visible_error_message': "no"}}
+    set_backend('pb2')
+    try:
+        pb2_bytes = encode('ClientSideToolV2Result', {'tool': 3, **values})
+        assert result.build(values) == pb2_bytes
+        w = ProtobufWriter()
+        result.build_into(w, values)
+        assert w.getvalue() == pb2_bytes
+    finally:
+        set_backend('python')
+    assert result.build(values) == encode('ClientSideToolV2Result', {'tool': 3, **values})
+    assert pb2_bytes != result.build(values)
+    
+    try:
+        MessageTemplate('Metadata', dynamic=('nope',))
+        assert False, "unknown field accepted"
+    except ValueError:
+        pass
+
+def test_codec_backends_agree():
+    """The pb2 backend writes byte-identical requests and decodes like the Python one"""
+    request = {
+        'messages': [{'content': "hi é", 'role': 1, 'message_id': "m1", 'chat_mode_enum': 2}],
+        'model': {'name': "gpt-4", 'empty': b''},
+        'conversation_id': "c1",
+        'metadata': {'timestamp': "2026-01-01T00:00:00"},
+        'is_agentic': True,
+        'supported_tools': [5, 6, 300],
+        'message_ids': [{'message_id': "m1", 'role': 1}],
+        'chat_mode_enum': 2,
+        'chat_mode': "agent",
+    }
+    result = {
+        'tool': 3,
+        'tool_call_id': "toolu_1",
+        'ripgrep_search_result': {'internal': {'results': [{
+            'resource': "a.py",
+            'results': [{'match': {
+                'preview_text': "x = 1",
+                'range_locations': [{'source': {'start_line_number': 300, 'end_line_number': 300}}],
+            }}],
+        }], 'exit': 1}},
+    }
+    byte_identical = [
+        ('StreamUnifiedChatRequestWithTools', {'request': request}),
+        ('BidiAppendRequest', {'data': "ab", 'request_id': {'request_id': "r"}, 'append_seqno': 0}),
+    ]
+    # Generated classes write fields in number order, so only compare content
+    same_fields = [('ClientSideToolV2Result', result)]
+    
+    cases = byte_identical + same_fields
+    python_bytes = [encode(name, value) for name, value in cases]
+    python_decoded = [decode(name, data) for (name, _), data in zip(cases, python_bytes)]
+    set_backend('pb2')
+    try:
+        pb2_bytes = [encode(name, value) for name, value in cases]
+        pb2_decoded = [decode(name, data) for (name, _), data in zip(cases, python_bytes)]
+    finally:
+        set_backend('python')
+    
+    n = len(byte_identical)
+    assert pb2_bytes[:n] == python_bytes[:n]
+    assert pb2_decoded == python_decoded
+    assert [decode(name, data) for (name, _), data in zip(cases, pb2_bytes)] == python_decoded
+
+def test_message_view_is_lazy_and_zero_copy():
+    """MessageView returns views into the payload and finds nested tool calls"""
+    response = StreamUnifiedChatResponseWithTools()
+    call = response.client_side_tool_v2_call
+    call.tool = 5
+    call.tool_call_id = "toolu_1"
+    call.raw_args = '{"path": "%s"}' % ("x" * 100000)
+    payload = response.SerializeToString()
+    
+    view = MessageView(payload)
+    raw_args = view.get_message(1).get_bytes(10)
+    assert isinstance(raw_args, memoryview) and raw_args.obj is payload
+    assert view.get_message(1).get_string(3) == "toolu_1"
+    assert view.get_int(1) is None and view.get_message(2) is None
+    
+    assert ToolCallDecoder.find_tool_calls(payload) == [{
+        'tool': 5, 'tool_call_id': "toolu_1", 'name': '', 'raw_args': call.raw_args,
+    }]
+
+def test_tool_call_path_ignores_text_payloads():
+    """Only the client_side_tool_v2_call field is decoded unless probing"""
+    response = StreamUnifiedChatResponseWithTools()
+    response.stream_unified_chat_response.text = "some streamed text " * 1000
+    payload = response.SerializeToString()
+    assert ToolCallDecoder.find_tool_calls(payload) == []
+    
+    call = response.client_side_tool_v2_call
+    call.tool = 7
+    call.tool_call_id = "toolu_2"
+    call.name = "list_dir"
+    payload = response.SerializeToString()
+    expected = [{'tool': 7, 'tool_call_id': "toolu_2", 'name': "list_dir", 'raw_args': ''}]
+    assert ToolCallDecoder.find_tool_calls(payload) == expected
+    assert ToolCallDecoder.find_tool_calls(payload, probe=True) == expected
+
+def test_message_payloads_drop_bad_gzip_frames():
+    """Corrupt, truncated and oversized gzip frames are skipped, not raised"""
+    from cursor_compression import GzipFrameInflater
+    
+    def frame(flags, payload):
+        return struct.pack('>BI', flags, len(payload)) + payload
+    
+    body = gzip.compress(b'x' * 4096)
+    data = b''.join([
+        frame(0, b'plain'),
+        frame(1, body[:10] + b'\xff' * 20),    # invalid deflate block
+        frame(1, body[:len(body) // 2]),        # truncated
+        frame(1, body),                         # inflates past max_size
+        frame(1, gzip.compress(b'small')),
+        frame(2, b'{}'),
+        frame(0, b'partial')[:-2],
+    ])
+    payloads, consumed = ToolCallDecoder.message_payloads(data, GzipFrameInflater(max_size=1024))
+    assert payloads == [b'plain', b'small']
+    assert consumed == len(data) - len(frame(0, b'partial')) + 2
+
+def test_tool_call_assembler_waits_for_final_arguments():
+    """Streamed parts are merged by tool_call_id and emitted once, when final"""
+    def frame(compress=False, **fields):
+        response = StreamUnifiedChatResponseWithTools()
+        response.client_side_tool_v2_call.CopyFrom(ClientSideToolV2Call(**fields))
+        payload = response.SerializeToString()
+        if compress:
+            payload = gzip.compress(payload)
+        return struct.pack('>BI', int(compress), len(payload)) + payload
+    
+    stream = b''.join([
+        # read_file announced before its arguments arrive
+        frame(tool=5, tool_call_id="toolu_a", name="read_file"),
+        frame(tool=5, tool_call_id="toolu_a", raw_args='{"relative_workspace_path": "a.py"}'),
+        frame(tool=5, tool_call_id="toolu_a", raw_args='{"relative_workspace_path": "a.py"}'),
+        # streaming edit: arguments arrive in pieces until is_last_message
+        frame(tool=38, tool_call_id="toolu_b", is_streaming=True, raw_args='{"path": '),
+        frame(True, tool_call_id="toolu_b", is_streaming=True, raw_args='"b.py"}'),
+        frame(tool_call_id="toolu_b", is_streaming=True, is_last_message=True),
+        # list_dir (6) needs no arguments
+        frame(tool=6, tool_call_id="toolu_c"),
+        struct.pack('>BI', 2, 2) + b'{}',
+    ])
+    
+    assembler = ToolCallAssembler(needs_args={5})
+    completed = []
+    for i in range(0, len(stream), 7):
+        completed.extend(assembler.feed(stream[i:i + 7]))
+    
+    assert completed == [
+        {'tool': 5, 'tool_call_id': "toolu_a", 'name': "read_file",
+         'raw_args': '{"relative_workspace_path": "a.py"}'},
+        {'tool': 38, 'tool_call_id': "toolu_b", 'name': '', 'raw_args': '{"path": "b.py"}'},
+        {'tool': 6, 'tool_call_id': "toolu_c", 'name': '', 'raw_args': ''},
+    ]
+    assert assembler.pending == []
+
+def test_tool_call_assembler_waits_for_list_dir_arguments():
+    """Tools with arguments wait for complete JSON, or the end of the stream"""
+    from cursor_bidi_client import CursorBidiClient
+    
+    def frame(**fields):
+        response = StreamUnifiedChatResponseWithTools()
+        response.client_side_tool_v2_call.CopyFrom(ClientSideToolV2Call(**fields))
+        payload = response.SerializeToString()
+        return struct.pack('>BI', 0, len(payload)) + payload
+    
+    assembler = ToolCallAssembler(CursorBidiClient.TOOLS_NEEDING_PARAMS)
+    # list_dir (6) announced first, its arguments split over two later frames
+    assert assembler.feed(frame(tool=6, tool_call_id="toolu_l", name="list_dir")) == []
+    assert assembler.feed(frame(tool_call_id="toolu_l", raw_args='{"directory_path": ')) == []
+    assert assembler.feed(frame(tool_call_id="toolu_l", raw_args='{"directory_path": "src"}')) == [
+        {'tool': 6, 'tool_call_id': "toolu_l", 'name': "list_dir", 'raw_args': '{"directory_path": "src"}'},
+    ]
+    
+    # A tool not in needs_args still waits once partial arguments show up
+    assembler = ToolCallAssembler()
+    assert assembler.feed(frame(tool=39, tool_call_id="toolu_v", raw_args='{"path"')) == []
+    assert assembler.feed(frame(tool=40, tool_call_id="toolu_r")) == [
+        {'tool': 40, 'tool_call_id': "toolu_r", 'name': '', 'raw_args': ''},
+    ]
+    
+    # Whatever is pending when the stream ends is handed back as incomplete
+    assert assembler.finish() == [
+        {'tool': 39, 'tool_call_id': "toolu_v", 'name': '', 'raw_args': '{"path"'},
+    ]
+    assert assembler.pending == [] and assembler.finish() == []
+
+def test_tool_call_assembler_never_emits_cut_off_streams():
+    """A streamed call cut off mid-arguments is reported by finish(), never emitted"""
+    def frame(**fields):
+        response = StreamUnifiedChatResponseWithTools()
+        response.client_side_tool_v2_call.CopyFrom(ClientSideToolV2Call(**fields))
+        payload = response.SerializeToString()
+        return struct.pack('>BI', 0, len(payload)) + payload
+    
+    assembler = ToolCallAssembler({5, 38})
+    stream = b''.join([
+        frame(tool=38, tool_call_id="toolu_e", is_streaming=True, raw_args='{"path": "a.py", '),
+        frame(tool_call_id="toolu_e", is_streaming=True, raw_args='"contents": "def f('),
+        frame(tool=5, tool_call_id="toolu_r", name="read_file"),
+        struct.pack('>BI', 2, 2) + b'{}',
+    ])
+    assert assembler.feed(stream) == []
+    
+    incomplete = assembler.finish()
+    assert [(call['tool_call_id'], call['raw_args']) for call in incomplete] == [
+        ("toolu_e", '{"path": "a.py", "contents": "def f('),
+        ("toolu_r", ''),
+    ]
+    # Late parts of an abandoned call do not revive it
+    assert assembler.feed(frame(tool_call_id="toolu_e", is_streaming=True, is_last_message=True)) == []
+
+def test_agent_loops_take_tool_calls_from_decoded_frames():
+    """Tool calls come from decoded frames only; ids or JSON in text are ignored"""
+    import tempfile
+    from contextlib import asynccontextmanager
+    from cursor_agent_client import CursorAgentClient
+    from cursor_bidi_client import CursorBidiClient
+    
+    def frame(**fields):
+        response = StreamUnifiedChatResponseWithTools()
+        response.client_side_tool_v2_call.CopyFrom(ClientSideToolV2Call(**fields))
+        payload = response.SerializeToString()
+        return struct.pack('>BI', 0, len(payload)) + payload
+    
+    lookalike = b'toolu_bdrk_0123456789abcdefghijklmn list_dir {"command": "rm -rf /"}'
+    bidi = CursorBidiClient.__new__(CursorBidiClient)
+    bidi.probe_tool_calls = False
+    assert bidi.parse_tool_call(lookalike) is None
+    call = bidi.parse_tool_call(frame(tool=6, tool_call_id="toolu_1", raw_args='{"directory_path": "."}'))
+    assert (call.name, call.params) == ("list_dir", {"directory_path": "."})
+    
+    bodies = [
+        # First turn: text that looks like a call, then list_dir split across chunks
+        [text_frame(lookalike.decode()), frame(tool=6, tool_call_id="toolu_l", name="list_dir")[:9],
+         frame(tool=6, tool_call_id="toolu_l", name="list_dir")[9:],
+         frame(tool_call_id="toolu_l", raw_args='{"directory_path": "sub"}')],
+        # Second turn: plain text ends the loop
+        [text_frame("done")],
+    ]
+    requests = []
+    
+    class Response:
+        status_code = 200
+        
+        def __init__(self, chunks):
+            self.chunks = chunks
+        
+        async def aiter_bytes(self):
+            for chunk in self.chunks:
+                yield chunk
+    
+    class Transport:
+        @asynccontextmanager
+        async def client(self, http2=True, timeout=None):
+            yield self
+        
+        @asynccontextmanager
+        async def stream(self, method, url, **kwargs):
+            requests.append(kwargs['content'])
+            yield Response(bodies[len(requests) - 1])
+    
+    class Client(CursorAgentClient):
+        token = "token"
+        transport = Transport()
+        
+        def generate_cursor_checksum(self, token):
+            return "checksum"
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        os.mkdir(os.path.join(tmp, 'sub'))
+        open(os.path.join(tmp, 'sub', 'found.txt'), 'w').close()
+        client = Client(tmp)
+        executed = []
+        execute = client.tool_executor.execute
+        client.tool_executor.execute = lambda tool_call: executed.append(tool_call) or execute(tool_call)
+        asyncio.run(client.run_agent_loop("list sub", verbose=False))
+    
+    assert len(requests) == 2
+    assert [(c.tool_call_id, c.name, c.params) for c in executed] == [
+        ("toolu_l", "list_dir", {"directory_path": "sub"}),
+    ]
+    assert not hasattr(CursorAgentClient, 'parse_tool_call_from_chunk')
+
+def test_tool_call_assembler_survives_corrupt_gzip_frames():
+    """A bad gzip frame is dropped and the calls around it still complete"""
+    def frame(flags, payload):
+        return struct.pack('>BI', flags, len(payload)) + payload
+    
+    def call_frame(**fields):
+        response = StreamUnifiedChatResponseWithTools()
+        response.client_side_tool_v2_call.CopyFrom(ClientSideToolV2Call(**fields))
+        return response.SerializeToString()
+    
+    corrupt = gzip.compress(call_frame(tool=6, tool_call_id="toolu_x"))
+    stream = b''.join([
+        frame(1, corrupt[:10] + b'\xff' * (len(corrupt) - 10)),
+        frame(1, gzip.compress(call_frame(tool=5, tool_call_id="toolu_big", raw_args='{"a": "%s"}' % ('x' * 4096)))),
+        frame(1, gzip.compress(call_frame(tool=6, tool_call_id="toolu_ok"))),
+    ])
+    
+    assembler = ToolCallAssembler(max_decompressed_size=1024)
+    assert assembler.feed(stream) == [{'tool': 6, 'tool_call_id': "toolu_ok", 'name': '', 'raw_args': ''}]
+
+def test_session_cache_skips_bootstrap_until_expiry_or_rejection():
+    """Sessions are bootstrapped once, shared through the file, and redone when invalidated"""
+    import tempfile
+    from cursor_session_cache import SessionCache
+    from cursor_http2_client import CursorHTTP2Client
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'sessions.json')
+        client = CursorHTTP2Client.__new__(CursorHTTP2Client)
+        client.session_cache = SessionCache(path)
+        bootstraps = []
+        
+        async def establish(*args):
+            bootstraps.append(args)
+            return True
+        client.establish_session_http2 = establish
+        
+        for _ in range(3):
+            assert asyncio.run(client.ensure_session("secret-token", "s1", "key", "sum"))
+        assert len(bootstraps) == 1
+        assert "secret-token" not in open(path).read()
+        
+        # A new process sees the session; an expired or rejected one is gone
+        assert SessionCache(path).get("secret-token", "s1")
+        assert SessionCache(path, ttl=0).get("secret-token", "s1") is None
+        client.session_cache.invalidate("secret-token", "s1")
+        assert asyncio.run(client.ensure_session("secret-token", "s1", "key", "sum"))
+        assert len(bootstraps) == 2
+
+def test_header_template_and_checksum_bucket():
+    """Fixed headers are formatted once, ids are fresh, checksum follows the 1e6 ms bucket"""
+    from cursor_headers import HeaderTemplate, cursor_checksum
+    
+    template = HeaderTemplate({
+        'authorization': 'Bearer {auth_token}',
+        'x-request-id': '{uuid}',
+        'x-cursor-checksum': '{cursor_checksum}',
+        'x-amzn-trace-id': 'Root={uuid}',
+    })
+    first = template.headers(auth_token="t", cursor_checksum="c1")
+    second = template.headers(auth_token="t", cursor_checksum="c1")
+    assert list(first) == ['authorization', 'x-request-id', 'x-cursor-checksum', 'x-amzn-trace-id']
+    assert first['authorization'] == second['authorization'] == "Bearer t"
+    assert first['x-request-id'] != second['x-request-id']
+    assert first['x-amzn-trace-id'].startswith("Root=")
+    assert template.headers(auth_token="t", cursor_checksum="c2")['x-cursor-checksum'] == "c2"
+    
+    bucket = 1_760_000  # 1e6 ms buckets
+    assert cursor_checksum("mid", bucket * 1000.0) == cursor_checksum("mid", bucket * 1000.0 + 999)
+    assert cursor_checksum("mid", bucket * 1000.0) != cursor_checksum("mid", (bucket + 1) * 1000.0)
+    assert cursor_checksum("mid", 0).endswith("mid") and len(cursor_checksum("", 0)) == 8
+
+def test_auth_reader_reads_keys_by_index():
+    """Only cursorAuth/ keys are read, through a read-only connection"""
+    import sqlite3
+    import tempfile
+    from pathlib import Path
+    from cursor_auth_reader import CursorAuthReader, connect_readonly
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'state.vscdb'
+        conn = sqlite3.connect(str(path))
+        for table in CursorAuthReader.TABLES:
+            conn.execute(f"CREATE TABLE {table} (key TEXT UNIQUE ON CONFLICT REPLACE, value BLOB)")
+        conn.executemany("INSERT INTO ItemTable VALUES (?, ?)", [
+            ('cursorAuth/accessToken', 'tok'),
+            ('cursorAuth/cachedEmail', b'"a@b.c"'),
+            ('cursorAuth0', 'outside'),
+            ('cursorAuthz', 'outside'),
+        ])
+        conn.execute("INSERT INTO cursorDiskKV VALUES ('cursorAuth/stripeMembershipType', 'pro')")
+        conn.execute("INSERT INTO cursorDiskKV VALUES ('composerData:1', ?)", (b'x' * 1000,))
+        conn.commit()
+        conn.close()
+        
+        reader = CursorAuthReader.__new__(CursorAuthReader)
+        reader.storage_path = path
+        assert reader.read_sqlite_storage() == {
+            'cursorAuth/accessToken': 'tok',
+            'cursorAuth/cachedEmail': 'a@b.c',
+            'cursorAuth/stripeMembershipType': 'pro',
+        }
+        assert reader.read_sqlite_keys(['cursorAuth/accessToken', 'missing']) == {
+            'cursorAuth/accessToken': 'tok'}
+        assert reader.get_bearer_token() == 'tok'
+        
+        conn = connect_readonly(path)
+        try:
+            conn.execute("DELETE FROM ItemTable")
+            assert False, "read-only connection accepted a write"
+        except sqlite3.OperationalError:
+            pass
+        finally:
+            conn.close()
+
+def test_credential_provider_reloads_on_storage_change():
+    """Credentials are read once and again only when state.vscdb changes"""
+    import sqlite3
+    import tempfile
+    from pathlib import Path
+    from cursor_auth_reader import CursorAuthReader, CredentialProvider
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'state.vscdb'
+        conn = sqlite3.connect(str(path))
+        conn.execute("CREATE TABLE ItemTable (key TEXT UNIQUE ON CONFLICT REPLACE, value BLOB)")
+        conn.executemany("INSERT INTO ItemTable VALUES (?, ?)", [
+            ('cursorAuth/accessToken', 'old'), ('storage.serviceMachineId', 'mid')])
+        conn.commit()
+        
+        reader = CursorAuthReader.__new__(CursorAuthReader)
+        reader.storage_path = path
+        reads = []
+        read_machine_id = reader.read_machine_id
+        reader.read_machine_id = lambda: reads.append(1) or read_machine_id()
+        provider = CredentialProvider(reader)
+        
+        assert provider.get_bearer_token() == 'old'
+        assert provider.get_machine_id() == 'mid'
+        assert len(reads) == 1
+        
+        conn.execute("INSERT INTO ItemTable VALUES ('cursorAuth/accessToken', 'new-token')")
+        conn.commit()
+        conn.close()
+        os.utime(path, ns=(0, 10 ** 18))  # mtime resolution may not see the write
+        assert provider.get_bearer_token() == 'new-token'
+        assert len(reads) == 2
+        
+        asyncio.run(provider.refresh())
+        assert len(reads) == 3
+
+def test_connection_pool_shares_clients_per_loop():
+    """One client per loop and protocol, kept open across blocks; timeouts apply per request"""
+    import httpx
+    from cursor_transport import ConnectionPool, PooledClient
+    
+    pool = ConnectionPool(max_connections=4, keepalive_expiry=5.0)
+    
+    async def use():
+        async with pool.client(http2=True, timeout=1.0) as first:
+            pass
+        async with pool.client(http2=True) as second:
+            assert second.client is first.client and not first.client.is_closed
+        async with pool.client(http2=False) as http1:
+            assert http1.client is not first.client
+        await pool.aclose()
+        assert first.client.is_closed
+        return first.client
+    
+    assert asyncio.run(use()) is not asyncio.run(use())
+    assert pool.clients_opened == 4
+    
+    seen = []
+    
+    def handler(request):
+        seen.append(request.extensions['timeout'])
+        return httpx.Response(200)
+    
+    async def post():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            pooled = PooledClient(client, timeout=3.0)
+            await pooled.post("https://example.invalid/a")
+            await pooled.post("https://example.invalid/b", timeout=7.0)
+    asyncio.run(post())
+    assert [t['read'] for t in seen] == [3.0, 7.0]
+
+def test_ask_daemon_streams_over_unix_socket():
+    """The daemon relays streamed text and errors to thin clients"""
+    import tempfile
+    from pathlib import Path
+    from cursor_ask_daemon import AskDaemon, connect, request
+    
+    class Client:
+        async def stream_chat(self, messages, model):
+            if messages[0]['content'] == "fail":
+                raise RuntimeError("Error 401: nope")
+            for word in ("hello ", model, "!"):
+                yield word
+    
+    def ask(path, prompt):
+        try:
+            return ''.join(request(connect(path), prompt, "m1"))
+        except RuntimeError as e:
+            return f"error: {e}"
+    
+    async def run(path):
+        daemon = AskDaemon(path, client=Client())
+        await daemon.start()
+        assert os.stat(path).st_mode & 0o777 == 0o600
+        loop = asyncio.get_running_loop()
+        try:
+            return await asyncio.gather(
+                loop.run_in_executor(None, ask, path, "hi"),
+                loop.run_in_executor(None, ask, path, "fail"),
+            )
+        finally:
+            await daemon.close()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'ask.sock'
+        assert asyncio.run(run(path)) == ["hello m1!", "error: Error 401: nope"]
+        assert connect(path) is None
+
+def test_ask_daemon_closes_stream_when_client_leaves():
+    """Hang-ups close the upstream stream; ask takes large prompts, falls back on errors, strips output"""
+    import contextlib
+    import importlib.machinery
+    import importlib.util
+    import io
+    import socket
+    import tempfile
+    from pathlib import Path
+    from cursor_ask_daemon import AskDaemon
+    
+    closed = []
+    
+    class Client:
+        streams = []  # Kept alive, so only an explicit aclose() finalizes them
+        
+        def stream_chat(self, messages, model):
+            stream = self._stream(messages)
+            self.streams.append(stream)
+            return stream
+        
+        async def _stream(self, messages):
+            try:
+                prompt = messages[0]['content']
+                if prompt == "strip":
+                    for text in ("  \n", " hello ", "world \n", "  "):
+                        yield text
+                    return
+                if prompt == "fail":
+                    raise RuntimeError("Error 503: busy")
+                if len(prompt) > 1000:
+                    yield f" {len(prompt)} bytes "
+                    return
+                for _ in range(1000):
+                    yield "x" * 65536
+                    await asyncio.sleep(0.01)
+            finally:
+                closed.append(messages[0]['content'])
+    
+    loader = importlib.machinery.SourceFileLoader('ask_script', os.path.join(os.path.dirname(__file__), 'ask'))
+    ask = importlib.util.module_from_spec(importlib.util.spec_from_loader(loader.name, loader))
+    loader.exec_module(ask)
+    
+    def hang_up(path):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(str(path))
+            sock.sendall(b'{"prompt": "long"}\n')
+            sock.recv(1)
+    
+    def ask_stripped():
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            assert ask.ask_daemon("strip", "m1")
+            # Prompts past asyncio's default 64 KiB line limit are accepted
+            assert ask.ask_daemon("y" * 200000, "m1")
+            # An error before any text leaves the answer to the in-process path
+            assert ask.ask_daemon("fail", "m1") is False
+        return out.getvalue()
+    
+    async def run(path):
+        daemon = AskDaemon(path, client=Client())
+        await daemon.start()
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(None, hang_up, path)
+            for _ in range(200):
+                if "long" in closed:
+                    break
+                await asyncio.sleep(0.01)
+            assert closed == ["long"]
+            return await loop.run_in_executor(None, ask_stripped)
+        finally:
+            await daemon.close()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / 'ask.sock'
+        os.environ['CURSOR_ASK_SOCKET'] = str(path)
+        try:
+            output = asyncio.run(run(path))
+        finally:
+            del os.environ['CURSOR_ASK_SOCKET']
+    assert output == ask.clean_response("  \n hello world \n  ") + "\n" + "200000 bytes\n"
+
+def test_ask_batch_orders_results():
+    """Batch prompts run concurrently, retry when busy and keep input order"""
+    import io
+    import json
+    from cursor_http2_client import CursorHTTP2Client, ServerBusy, run_batch_file
+    
+    class Client(CursorHTTP2Client):
+        token = None
+        BATCH_BACKOFF = 0
+        busy = 1
+        
+        async def stream_chat(self, messages, model):
+            prompt = messages[0]['content']
+            if prompt == "busy" and self.busy:
+                self.busy -= 1
+                raise ServerBusy("Error 429: slow down", retry_after=0)
+            if prompt == "fail":
+                raise RuntimeError("Error 500: boom")
+            await asyncio.sleep(0.01 if prompt == "slow" else 0)
+            yield prompt + "/"
+            yield model
+    
+    lines = [
+        '{"prompt": "slow", "id": "a"}\n',
+        '\n',
+        '{"prompt": "busy", "model": "m2"}\n',
+        '{"prompt": "fail"}\n',
+        'not json\n',
+        '{"prompt": "fast"}\n',
+    ]
+    
+    def run(order):
+        output = io.StringIO()
+        failed = asyncio.run(run_batch_file(Client.__new__(Client), lines, output, "m1", order, 4))
+        return failed, [json.loads(line) for line in output.getvalue().splitlines()]
+    
+    failed, records = run("input")
+    assert failed == 2
+    assert records == [
+        {'index': 0, 'id': 'a', 'model': 'm1', 'response': 'slow/m1'},
+        {'index': 1, 'id': None, 'model': 'm2', 'response': 'busy/m2'},
+        {'index': 2, 'id': None, 'model': 'm1', 'error': 'Error 500: boom'},
+        {'index': 3, 'id': None, 'model': 'm1', 'error': 'no prompt'},
+        {'index': 4, 'id': None, 'model': 'm1', 'response': 'fast/m1'},
+    ]
+    
+    failed, records = run("completion")
+    assert failed == 2
+    assert records[-1]['index'] == 0  # The slow prompt finishes last
+    assert sorted(r['index'] for r in records) == [0, 1, 2, 3, 4]
+
 if __name__ == "__main__":
     success = test_real_decoder()
     if success:
         print("\nDecoder test PASSED.")
     else:
         print("\nDecoder test FAILED.")
+        sys.exit(1)
+    
+    # The remaining tests, in file order, as pytest would run them
+    failed = 0
+    for name, test in list(globals().items()):
+        if name.startswith("test_") and name != "test_real_decoder" and callable(test):
+            try:
+                test()
+                print(f"PASSED {name}")
+            except Exception as e:
+                failed += 1
+                print(f"FAILED {name}: {type(e).__name__}: {e}")
+    if failed:
+        print(f"\n{failed} test(s) FAILED.")
         sys.exit(1)
\ No newline at end of file